@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 import sys
@@ -9,9 +9,11 @@ from typing import List
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from common.models import User, UserCreate, Token, UserProfileUpdate
-from common import database
+from common import async_database
 from common import auth
 from common.database import init_db
+from common.metrics import REGISTRY, install_metrics, register_stats_collectors, stats_collector
+from common.password_hashing import password_hasher
 
 app = FastAPI(
     title="MarketWise - Serviço de Autenticação",
@@ -24,7 +26,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Access-Token"],
 )
+install_metrics(app, "auth_service")
+register_stats_collectors()
+REGISTRY.add_collector("password_hasher", stats_collector(
+    "password_hasher", lambda: {"pending": password_hasher.pending}))
+
+# Rotas da API: incluídas no app deste serviço (no fim do arquivo) e no gateway (gateway/main.py)
+router = APIRouter()
 
 @app.on_event("startup")
 def on_startup():
@@ -33,65 +43,81 @@ def on_startup():
     print("Inicializando banco de dados...", file=sys.stderr)
     init_db()
     print("Banco de dados inicializado.", file=sys.stderr)
+    start_service()
+
+def start_service():
+    """Startup sem o schema (também usado pelo gateway, que cria o schema uma única vez)."""
+    # Sobe o pool de hash de senhas antes do primeiro login
+    password_hasher.start()
 
-@app.post("/api/auth/register", response_model=Token)
+@app.on_event("shutdown")
+def on_shutdown():
+    """Encerra o executor do banco de dados e fecha as conexões do pool."""
+    async_database.shutdown_executor()
+    password_hasher.shutdown()
+
+@router.post("/api/auth/register", response_model=Token)
 async def register_user(user_in: UserCreate):
     """
     Registra um novo usuário.
     """
-    db_user = database.get_user_by_email(user_in.email)
+    db_user = await async_database.get_user_by_email(user_in.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email já registrado",
         )
     
-    user = database.create_user(user_in)
-    access_token = auth.create_access_token(
-        data={"sub": user.email, "user_id": user.id}
-    )
+    hashed_password = await auth.hash_password_async(user_in.password)
+    user = await async_database.create_user(user_in, hashed_password=hashed_password)
+    access_token = auth.create_access_token(data=auth.build_token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/api/auth/login", response_model=Token)
+@router.post("/api/auth/login", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     Fornece um token JWT para um usuário válido.
     """
-    user = auth.authenticate_user(form_data.username, form_data.password)
+    user = await auth.authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email ou senha incorretos",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(
-        data={"sub": user.email, "user_id": user.id}
-    )
+    access_token = auth.create_access_token(data=auth.build_token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/api/auth/me", response_model=User)
+@router.get("/api/auth/me", response_model=User)
 async def read_users_me(current_user: User = Depends(auth.get_current_user)):
     """
     Retorna os dados do usuário autenticado.
     """
     return current_user
 
-@app.put("/api/auth/profile", response_model=User)
+@router.put("/api/auth/profile", response_model=User)
 async def update_user_profile(
     profile_data: UserProfileUpdate,
+    response: Response,
     current_user: User = Depends(auth.get_current_user)
 ):
     """
     Atualiza o nome e/ou avatar_url do usuário autenticado.
+    Com JWT_EMBED_PROFILE_CLAIMS, um token com o perfil novo é enviado no header X-Access-Token.
     """
-    updated_user = database.update_user_profile(current_user.id, profile_data)
+    updated_user = await async_database.update_user_profile(current_user.id, profile_data)
+    auth.invalidate_principal(current_user.id)
     if not updated_user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    if auth.JWT_EMBED_PROFILE_CLAIMS:
+        response.headers["X-Access-Token"] = auth.create_access_token(data=auth.build_token_claims(updated_user))
     return updated_user
 
 @app.get("/")
 def read_root():
     return {"Hello": "Serviço de Autenticação MarketWise AI"}
 
+app.include_router(router)
+
 # Para rodar este serviço:
 # uvicorn auth_service.main:app --reload --port 8000
\ No newline at end of file
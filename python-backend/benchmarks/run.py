@@ -0,0 +1,297 @@
+# python-backend/benchmarks/run.py
+"""
+Benchmark de ponta a ponta dos três serviços, sem rede nem chave de API
+(o provedor de IA falso é usado: LLM_PROVIDER=fake).
+
+Uso (dentro de python-backend):
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 1000,10000,100000 --requests 20 --concurrency 8 --json resultado.json
+    # Contra serviços já em execução (iniciados com LLM_PROVIDER=fake):
+    python -m benchmarks.run --auth-url http://localhost:8000 \\
+        --segmentation-url http://localhost:8001 --strategy-url http://localhost:8002
+
+Relata, por endpoint, vazão (req/s) e latências p50/p95/p99 e, no modo local,
+os tempos de cada etapa do pipeline de segmentação.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.synthetic import make_transactions_csv
+
+# Variações do formulário de segmentação medidas para cada tamanho de CSV
+SEGMENTATION_VARIANTS = {
+    "padrão": {},
+    "localClustering": {"localClustering": "true"},
+    "compactPrompt": {"compactPrompt": "true"},
+    "streamingIngestion": {"streamingIngestion": "true"},
+}
+NUMBER_OF_CLUSTERS = 4
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do backend MarketWise.")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="linhas dos CSVs sintéticos, separadas por vírgula")
+    parser.add_argument("--requests", type=int, default=10, help="requisições por endpoint (e por tamanho)")
+    parser.add_argument("--concurrency", type=int, default=4, help="requisições simultâneas")
+    parser.add_argument("--stage-repeats", type=int, default=3, help="repetições das etapas do pipeline")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="latência do provedor falso")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="taxa de erros transitórios do provedor falso")
+    parser.add_argument("--cache", action="store_true", help="mantém o cache de respostas da IA ligado")
+    parser.add_argument("--json", help="grava o resultado neste arquivo")
+    parser.add_argument("--auth-url")
+    parser.add_argument("--segmentation-url")
+    parser.add_argument("--strategy-url")
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir: str):
+    """Isola o benchmark: banco, cache e uploads temporários e o provedor de IA falso."""
+    os.environ.update({
+        "LLM_PROVIDER": "fake",
+        "LLM_FAKE_LATENCY_MS": str(args.llm_latency_ms),
+        "LLM_FAKE_ERROR_RATE": str(args.llm_error_rate),
+        "LLM_CACHE_ENABLED": "1" if args.cache else "0",
+        "LLM_RATE_PER_MINUTE": "0",
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "LLM_CACHE_DB_PATH": os.path.join(workdir, "bench_llm_cache.db"),
+        "SEGMENTATION_JOB_UPLOAD_DIR": os.path.join(workdir, "job_uploads"),
+    })
+
+
+class Recorder:
+    """Amostras de latência (segundos) e tempo total de cada cenário."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.wall: Dict[str, float] = {}
+
+    def add(self, label: str, seconds: float, ok: bool = True):
+        self.samples[label].append(seconds)
+        if not ok:
+            self.errors[label] += 1
+
+    def report(self) -> List[Dict[str, object]]:
+        rows = []
+        for label, values in self.samples.items():
+            ordered = sorted(values)
+            wall = self.wall.get(label)
+            rows.append({
+                "label": label,
+                "n": len(ordered),
+                "errors": self.errors.get(label, 0),
+                "throughput_rps": round(len(ordered) / wall, 2) if wall else None,
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+            })
+        return rows
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Percentil pelo método nearest-rank."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def scenario(rec: Recorder, label: str, requests: int, concurrency: int,
+                   send: Callable[[], Awaitable[object]]):
+    """Executa `requests` chamadas com no máximo `concurrency` simultâneas."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await send()
+                ok = getattr(response, "status_code", 200) < 400
+            except Exception as e:
+                print(f"[{label}] erro: {e}", file=sys.stderr)
+                ok = False
+            rec.add(label, time.perf_counter() - started, ok)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    rec.wall[label] = time.perf_counter() - started
+    print(f"  {label}: {requests} requisições em {rec.wall[label]:.2f}s", file=sys.stderr)
+
+
+async def bench_endpoints(args, clients, datasets: Dict[int, bytes], rec: Recorder):
+    auth_client, segmentation_client, strategy_client = clients["auth"], clients["segmentation"], clients["strategy"]
+    email, password = f"bench-{uuid.uuid4().hex[:8]}@example.com", "benchmark-senha"
+    response = await auth_client.post("/api/auth/register", json={"email": email, "password": password, "name": "Benchmark"})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    await scenario(rec, "auth POST /api/auth/login", args.requests, args.concurrency,
+                   lambda: auth_client.post("/api/auth/login", data={"username": email, "password": password}))
+    await scenario(rec, "auth GET /api/auth/me", args.requests, args.concurrency,
+                   lambda: auth_client.get("/api/auth/me", headers=headers))
+
+    form = {"numberOfClusters": str(NUMBER_OF_CLUSTERS), "normalize": "true", "excludeNulls": "true", "groupCategories": "true"}
+    for size, csv_bytes in datasets.items():
+        for variant, extra in SEGMENTATION_VARIANTS.items():
+            await scenario(
+                rec, f"segmentation POST /api/segmentation-insights [{size} linhas, {variant}]",
+                args.requests, args.concurrency,
+                lambda extra=extra, csv_bytes=csv_bytes: segmentation_client.post(
+                    "/api/segmentation-insights", headers=headers,
+                    files={"file": ("bench.csv", csv_bytes, "text/csv")}, data={**form, **extra}
+                )
+            )
+
+        async def stream_once(csv_bytes=csv_bytes, size=size):
+            started = time.perf_counter()
+            first = None
+            async with segmentation_client.stream(
+                "POST", "/api/segmentation-insights/stream", headers=headers,
+                files={"file": ("bench.csv", csv_bytes, "text/csv")}, data={**form, "localClustering": "true"}
+            ) as response:
+                async for line in response.aiter_lines():
+                    if first is None and '"segment"' in line:
+                        first = time.perf_counter() - started
+            rec.add(f"segmentation stream: primeiro segmento [{size} linhas]", first or 0.0, first is not None)
+            return response
+
+        await scenario(rec, f"segmentation POST /api/segmentation-insights/stream [{size} linhas]",
+                       args.requests, args.concurrency, stream_once)
+
+    await scenario(rec, "segmentation GET /api/segmentation-analyses", args.requests, args.concurrency,
+                   lambda: segmentation_client.get("/api/segmentation-analyses", headers=headers))
+
+    history = (await segmentation_client.get("/api/segmentation-analyses", headers=headers)).json()
+    strategy_input = {"customerSegmentAttributes": "Clientes fiéis de alto valor", "campaignObjectives": "Aumentar a recompra"}
+    await scenario(rec, "strategy POST /api/marketing-strategies", args.requests, args.concurrency,
+                   lambda: strategy_client.post("/api/marketing-strategies", headers=headers, json=strategy_input))
+    if history:
+        batch_input = {"campaignObjectives": "Aumentar a recompra", "analysisId": history[0]["id"]}
+        await scenario(rec, "strategy POST /api/marketing-strategies/batch", args.requests, args.concurrency,
+                       lambda: strategy_client.post("/api/marketing-strategies/batch", headers=headers, json=batch_input))
+
+
+async def bench_stages(args, datasets: Dict[int, bytes], rec: Recorder, service, workdir: str):
+    """Tempo de cada etapa do pipeline de segmentação, executada diretamente (modo local)."""
+    from common import async_database
+    from common.clustering import cluster_customers
+    from common.ingestion import aggregate_customers, aggregate_customers_streaming, read_transactions
+    from common.models import DataTreatment, MarketSegmentationInsightsInput
+    from common.prompt_sketch import build_profile_sketch
+
+    treatment = DataTreatment(normalize=True, excludeNulls=True, groupCategories=True)
+    user = await async_database.get_user_by_email("bench-stages@example.com")
+    if user is None:
+        from common.models import UserCreate
+        user = await async_database.create_user(UserCreate(email="bench-stages@example.com", password="x"), hashed_password="x")
+
+    def timed(label: str, func, *func_args, **func_kwargs):
+        started = time.perf_counter()
+        result = func(*func_args, **func_kwargs)
+        rec.add(label, time.perf_counter() - started)
+        return result
+
+    for size, csv_bytes in datasets.items():
+        path = os.path.join(workdir, f"stage_{size}.csv")
+        with open(path, "wb") as f:
+            f.write(csv_bytes)
+        for _ in range(args.stage_repeats):
+            df = timed(f"etapa leitura do CSV [{size} linhas]", read_transactions, io.BytesIO(csv_bytes))
+            customer_df = timed(f"etapa agregação [{size} linhas]", aggregate_customers, df)
+            timed(f"etapa agregação em streaming [{size} linhas]", aggregate_customers_streaming, path)
+            clustering = timed(f"etapa clusterização [{size} linhas]", cluster_customers, customer_df, NUMBER_OF_CLUSTERS, treatment)
+            timed(f"etapa resumo do prompt [{size} linhas]", build_profile_sketch, customer_df)
+            csv_string = timed(f"etapa serialização do CSV agregado [{size} linhas]", customer_df.to_csv, index=False, sep=';')
+
+            input_data = MarketSegmentationInsightsInput(
+                clusterData=csv_string, dataTreatment=treatment,
+                numberOfClusters=NUMBER_OF_CLUSTERS, clusterProfiles=clustering.profiles
+            )
+            started = time.perf_counter()
+            output = await service.generate_segmentation_insights(input_data, use_cache=False)
+            rec.add(f"etapa IA (provedor falso) [{size} linhas]", time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await async_database.save_analysis(user.id, input_data, output)
+            rec.add(f"etapa gravação da análise [{size} linhas]", time.perf_counter() - started)
+
+
+def print_report(rows: List[Dict[str, object]]):
+    width = max(len(str(row["label"])) for row in rows)
+    print(f"{'cenário'.ljust(width)}  {'n':>4} {'erros':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in rows:
+        throughput = f"{row['throughput_rps']:.2f}" if row["throughput_rps"] is not None else "-"
+        print(f"{str(row['label']).ljust(width)}  {row['n']:>4} {row['errors']:>5} {throughput:>8} "
+              f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+
+async def main_async(args, workdir: str) -> List[Dict[str, object]]:
+    import httpx
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    datasets = {size: make_transactions_csv(size) for size in sizes}
+    rec = Recorder()
+
+    # Startup e shutdown dos apps locais (os mesmos hooks que o uvicorn executa)
+    lifespan = contextlib.AsyncExitStack()
+    remote = args.auth_url and args.segmentation_url and args.strategy_url
+    if remote:
+        clients = {
+            "auth": httpx.AsyncClient(base_url=args.auth_url, timeout=300),
+            "segmentation": httpx.AsyncClient(base_url=args.segmentation_url, timeout=300),
+            "strategy": httpx.AsyncClient(base_url=args.strategy_url, timeout=300),
+        }
+    else:
+        from auth_service.main import app as auth_app
+        from segmentation_service import main as segmentation_main
+        from strategy_service.main import app as strategy_app
+
+        apps = [auth_app, segmentation_main.app, strategy_app]
+        for app in apps:
+            await lifespan.enter_async_context(app.router.lifespan_context(app))
+        clients = {
+            name: httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=f"http://{name}", timeout=300)
+            for name, app in zip(("auth", "segmentation", "strategy"), apps)
+        }
+
+    try:
+        print("Medindo endpoints...", file=sys.stderr)
+        await bench_endpoints(args, clients, datasets, rec)
+        if not remote:
+            print("Medindo etapas do pipeline...", file=sys.stderr)
+            await bench_stages(args, datasets, rec, segmentation_main.service, workdir)
+    finally:
+        for client in clients.values():
+            await client.aclose()
+        await lifespan.aclose()
+    return rec.report()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="marketwise-bench-") as workdir:
+        configure_environment(args, workdir)
+        rows = asyncio.run(main_async(args, workdir))
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# python-backend/benchmarks/synthetic.py
+
+import io
+import itertools
+import random
+from datetime import datetime, timedelta
+
+# Mesmo formato dos CSVs de transações aceitos pela segmentação (';' e vírgula decimal)
+HEADER = "InvoiceNo;StockCode;Description;Quantity;InvoiceDate;UnitPrice;CustomerID;Country"
+COUNTRIES = ["United Kingdom", "Germany", "France", "EIRE", "Spain", "Netherlands", "Belgium", "Portugal"]
+COUNTRY_WEIGHTS = [70, 6, 6, 4, 3, 3, 2, 1]
+
+
+def make_transactions_csv(rows: int, customers: int = None, seed: int = 7) -> bytes:
+    """
+    CSV sintético com `rows` linhas de transações. Os clientes têm perfis diferentes
+    (ticket e frequência), para que a clusterização encontre grupos reais.
+    Cerca de 2% das linhas não têm CustomerID, como nos dados reais.
+    """
+    rng = random.Random(seed)
+    customers = customers or max(10, rows // 20)
+    profiles = [
+        (17000 + i, rng.choices(COUNTRIES, COUNTRY_WEIGHTS)[0], rng.choice([1.5, 4.0, 12.0]), rng.choice([1, 3, 10]))
+        for i in range(customers)
+    ]
+    # Pesos acumulados calculados uma vez (choices com `weights` refaz a soma a cada sorteio)
+    cum_weights = list(itertools.accumulate(profile[3] for profile in profiles))
+    start = datetime(2010, 12, 1, 8, 0)
+
+    out = io.StringIO()
+    out.write(HEADER + "\n")
+    invoice = 536365
+    for row in range(rows):
+        customer_id, country, price_scale, _ = rng.choices(profiles, cum_weights=cum_weights)[0]
+        if row % 7 == 0:
+            invoice += 1
+        quantity = rng.randint(1, 24)
+        unit_price = f"{rng.uniform(0.5, 2.0) * price_scale:.2f}".replace('.', ',')
+        customer = "" if rng.random() < 0.02 else str(customer_id)
+        date = (start + timedelta(minutes=row)).strftime("%d/%m/%Y %H:%M")
+        out.write(f"{invoice};{85000 + row % 500};ITEM {row % 500};{quantity};{date};{unit_price};{customer};{country}\n")
+    return out.getvalue().encode("utf-8")
@@ -1,28 +1,55 @@
+import asyncio
 import os
-import google.generativeai as genai
 import json
 import sys
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
-from typing import List, Dict, Any
-from pydantic import BaseModel # Importação que faltava
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+from pydantic import BaseModel, ValidationError # Importação que faltava
+
+from common.json_stream import IncrementalArrayParser
+from common.llm_cache import LLM_CACHE_ENABLED, LLMResponseCache, make_cache_key
+from common.llm_governance import InvalidModelOutput, LLMCallGovernor, is_transient
+from common.llm_providers import LLMProvider, create_provider
+from common.metrics import LLM_PROMPT_CHARS, LLM_REQUESTS, LLM_RESPONSE_CHARS, STAGE_DURATION, stage_timer
 
 # Importa os modelos Pydantic
 from common.models import (
     MarketSegmentationInsightsInput, MarketSegmentationInsightsOutput,
-    MarketingStrategiesInput, MarketingStrategiesOutput
+    MarketingStrategiesInput, MarketingStrategiesOutput, ClusterProfile, Segment,
+    SegmentDescription, SegmentStrategies, SegmentStrategiesList
 )
 
+# --- Configuração da Inicialização ---
+# google.generativeai só é importado quando o modelo é criado (import pesado)
+# Cria o modelo no primeiro uso (ou no warm-up do serviço) em vez de no construtor
+GENAI_LAZY_INIT = os.getenv("GENAI_LAZY_INIT", "1") == "1"
+# Chamadas individuais simultâneas para segmentos que a resposta em lote deixar de fora
+STRATEGY_BATCH_FANOUT = int(os.getenv("STRATEGY_BATCH_FANOUT", "4"))
+
 class GeminiMarketingService:
     """
     Esta classe encapsula a lógica de negócios e a interação com a API Gemini.
     Isso atende ao requisito de Programação Orientada a Objetos.
+    O provedor da IA é plugável (LLM_PROVIDER): Gemini ou um provedor local falso.
     """
     
-    def __init__(self):
+    def __init__(self, provider: Optional[LLMProvider] = None):
         print("Inicializando GeminiMarketingService...", file=sys.stderr)
         self._load_environment()
-        self._configure_genai()
-        self.model = self._initialize_model()
+        self.provider = provider or create_provider()
+        # Guardados para compor a chave do cache de respostas
+        self.model_name = self.provider.model_name
+        self.generation_config = self.provider.generation_config
+        if not GENAI_LAZY_INIT:
+            self.provider.initialize()
+        self.cache = LLMResponseCache() if LLM_CACHE_ENABLED else None
+        # Chamadas em andamento, por chave do pedido (single-flight)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # Concorrência, taxa, prazos, novas tentativas e circuit breaker das chamadas à API
+        self.governor = LLMCallGovernor()
 
     def _load_environment(self):
         # Carrega o .env da raiz da pasta python-backend
@@ -33,94 +60,260 @@ class GeminiMarketingService:
         load_ok = load_dotenv(dotenv_path=dotenv_path)
         print(f"load_dotenv() retornou: {load_ok}", file=sys.stderr)
 
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        if not self.api_key:
-            print("ERRO FATAL: GOOGLE_API_KEY não encontrada.", file=sys.stderr)
-            raise ValueError("GOOGLE_API_KEY não configurada")
+    @property
+    def ready(self) -> bool:
+        return self.provider.ready
+
+    async def warm_up(self):
+        """Prepara o cliente da IA fora do event loop (usado no startup dos serviços e no primeiro uso)."""
+        if not self.provider.ready:
+            await asyncio.to_thread(self.provider.initialize)
+        return self.provider
+
+    async def _generate_json_response(self, prompt_text: str, expected_model: BaseModel, use_cache: bool = True,
+                                      expected_items: Optional[Tuple[str, int]] = None) -> Dict[str, Any]:
+        """
+        Método genérico para chamar a API e tratar erros.
+        Respostas validadas ficam no cache; use_cache=False ignora a leitura do cache
+        (a resposta nova ainda é gravada, atualizando a entrada).
+        Com expected_items (campo do array, quantidade) a resposta com outra quantidade
+        de itens é inválida: a IA é chamada de novo e nada vai para o cache.
+        Chamadas simultâneas com o mesmo prompt compartilham uma única chamada à API.
+        """
+        request_key = make_cache_key(self.model_name, self.generation_config, prompt_text, expected_model.__name__)
+        if self.cache is not None and use_cache:
+            cached = await self.cache.get_async(request_key)
+            if cached is not None and self._has_expected_items(cached, expected_items):
+                print(f"Resposta da IA obtida do cache ({request_key[:12]}).", file=sys.stderr)
+                return cached
+
+        task = self._in_flight.get(request_key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_model(prompt_text, expected_model, request_key, expected_items))
+            self._in_flight[request_key] = task
+            task.add_done_callback(lambda done, key=request_key: self._finish_in_flight(key, done))
         else:
-            print("GOOGLE_API_KEY encontrada.", file=sys.stderr)
+            print(f"Chamada à IA já em andamento ({request_key[:12]}), aguardando o mesmo resultado.", file=sys.stderr)
 
-    def _configure_genai(self):
-        try:
-            genai.configure(api_key=self.api_key)
-            print("genai configurado com sucesso.", file=sys.stderr)
-        except Exception as config_error:
-            print(f"Erro durante genai.configure(): {config_error}", file=sys.stderr)
-            raise config_error
+        # shield: o cancelamento de um cliente não cancela a chamada compartilhada com os demais
+        return await asyncio.shield(task)
 
-    def _list_models(self):
-        try:
-            print("Modelos disponíveis que suportam 'generateContent':", file=sys.stderr)
-            found_model = False
-            for m in genai.list_models():
-              if 'generateContent' in m.supported_generation_methods:
-                print(f"- {m.name}", file=sys.stderr)
-                found_model = True
-            if not found_model:
-                print("Nenhum modelo encontrado.", file=sys.stderr)
-        except Exception as list_error:
-            print(f"Erro ao listar modelos: {list_error}", file=sys.stderr)
-
-    def _initialize_model(self):
-        self._list_models() # Lista os modelos para depuração
-        generation_config = {
-            "temperature": 1,
-            "top_p": 0.95,
-            "top_k": 64,
-            "max_output_tokens": 8192,
-            "response_mime_type": "application/json",
-        }
-        model_name_to_use = "gemini-pro-latest"
-        
+    def _finish_in_flight(self, request_key: str, task: asyncio.Future):
+        if self._in_flight.get(request_key) is task:
+            del self._in_flight[request_key]
+        # Marca a exceção como consumida caso todos os clientes tenham desistido
+        if not task.cancelled():
+            task.exception()
+
+    async def _call_model(self, prompt_text: str, expected_model: BaseModel, request_key: str,
+                          expected_items: Optional[Tuple[str, int]] = None) -> Dict[str, Any]:
+        """Faz a chamada à API sob a governança (taxa, concorrência, prazos, novas tentativas) e grava no cache."""
+        async def attempt(previous_error: Optional[str]) -> Dict[str, Any]:
+            prompt = prompt_text if previous_error is None else self._correction_prompt(prompt_text, previous_error)
+            return await self._request_once(prompt, expected_model, expected_items)
+
+        result = await self.governor.call(attempt)
+        if self.cache is not None:
+            await self.cache.set_async(request_key, result)
+        return result
+
+    async def _request_once(self, prompt_text: str, expected_model: BaseModel,
+                            expected_items: Optional[Tuple[str, int]] = None) -> Dict[str, Any]:
+        """Uma tentativa: chama a API e valida a resposta."""
+        schema = expected_model.__name__
+        LLM_PROMPT_CHARS.observe(len(prompt_text), schema=schema)
         try:
-            model = genai.GenerativeModel(
-                model_name=model_name_to_use,
-                generation_config=generation_config,
-            )
-            print(f"Modelo {model_name_to_use} inicializado.", file=sys.stderr)
-            return model
+            provider = await self.warm_up()
+            with stage_timer("llm_request"):
+                response_text = await provider.generate(prompt_text, schema)
         except Exception as e:
-            print(f"Erro ao inicializar modelo: {e}", file=sys.stderr)
+            LLM_REQUESTS.inc(schema=schema, outcome="error")
+            print(f"Erro ao chamar a API ({self.provider.name}): {e}", file=sys.stderr)
             raise
+        return self._parse_and_count(response_text, expected_model, expected_items)
 
-    async def _generate_json_response(self, prompt_text: str, expected_model: BaseModel) -> Dict[str, Any]:
-        """Método genérico para chamar a API e tratar erros."""
-        response = None  # <--- ADICIONE ESTA LINHA
-        response_text = "" # <--- ADICIONE ESTA LI
+    def _parse_and_count(self, response_text: str, expected_model: BaseModel,
+                         expected_items: Optional[Tuple[str, int]] = None) -> Dict[str, Any]:
+        """_parse_output com as métricas de tamanho da resposta, tempo de validação e resultado."""
+        schema = expected_model.__name__
+        LLM_RESPONSE_CHARS.observe(len(response_text or ""), schema=schema)
         try:
-            # Em versões mais recentes, 'response_text' pode não ser síncrono
-            response = await self.model.generate_content_async(prompt_text)
-            
-            # Tenta acessar a propriedade 'text'
-            try:
-                response_text = response.text
-            except Exception:
-                # Se 'text' não for uma propriedade direta, tenta resolver partes
-                print("Acessando 'response.text' falhou, tentando iterar partes...", file=sys.stderr)
-                # Este é um fallback, pode precisar de ajuste dependendo da versão da lib
-                all_parts = [part.text async for part in response]
-                response_text = "".join(all_parts)
-
-            if not response_text:
-                 raise ValueError("A resposta da IA estava vazia.")
+            with stage_timer("llm_parse_validate"):
+                result = self._parse_output(response_text, expected_model, expected_items)
+        except InvalidModelOutput:
+            LLM_REQUESTS.inc(schema=schema, outcome="invalid_output")
+            raise
+        LLM_REQUESTS.inc(schema=schema, outcome="ok")
+        return result
 
+    @staticmethod
+    def _parse_output(response_text: str, expected_model: BaseModel,
+                      expected_items: Optional[Tuple[str, int]] = None) -> Dict[str, Any]:
+        """Decodifica e valida a resposta; falhas viram InvalidModelOutput (a IA pode ser chamada de novo)."""
+        if not response_text:
+            raise InvalidModelOutput("A resposta da IA estava vazia.")
+        try:
             output_data = json.loads(response_text)
             # Valida a saída com o modelo Pydantic
-            validated_output = expected_model(**output_data)
-            return validated_output.model_dump() # Retorna um dict
-        
+            result = expected_model(**output_data).model_dump() # Retorna um dict
         except json.JSONDecodeError as e:
             print(f"Erro ao decodificar JSON: {e}", file=sys.stderr)
             print(f"Resposta recebida da IA: {response_text}", file=sys.stderr)
-            raise ValueError(f"A resposta da IA não é um JSON válido: {response_text}")
-        except Exception as e:
-            print(f"Erro ao chamar a API Gemini ou validar a resposta: {e}", file=sys.stderr)
-            # Alterado 'N/A' para 'N/D' (Não Disponível)
-            print(f"Resposta recebida da IA (se disponível): {getattr(response, 'text', 'N/D')}", file=sys.stderr)
-            raise
+            raise InvalidModelOutput(f"A resposta da IA não é um JSON válido ({e}).")
+        except (ValidationError, TypeError) as e:
+            print(f"Resposta da IA fora do schema: {e}", file=sys.stderr)
+            raise InvalidModelOutput(f"A resposta da IA não corresponde ao schema esperado: {e}")
+        if not GeminiMarketingService._has_expected_items(result, expected_items):
+            array_key, count = expected_items
+            raise InvalidModelOutput(
+                f"A resposta da IA tem {len(result[array_key])} itens em '{array_key}', mas eram esperados exatamente {count}."
+            )
+        return result
+
+    @staticmethod
+    def _has_expected_items(output: Dict[str, Any], expected_items: Optional[Tuple[str, int]]) -> bool:
+        if expected_items is None:
+            return True
+        array_key, count = expected_items
+        return len(output.get(array_key) or []) == count
+
+    @staticmethod
+    def _correction_prompt(prompt_text: str, error: str) -> str:
+        return f"""{prompt_text}
+        ATENÇÃO: a sua resposta anterior foi rejeitada pelo seguinte motivo: {error}
+        Responda novamente apenas com um JSON válido que siga exatamente o schema acima.
+        """
+
+    async def _stream_json_response(self, prompt_text: str, expected_model: BaseModel, array_key: str,
+                                    use_cache: bool = True, expected_count: Optional[int] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Variante de _generate_json_response que usa a API de streaming do modelo.
+        Gera ("item", valor) para cada elemento de `array_key` assim que ele fica completo
+        no texto recebido e, por último, ("result", dict validado).
+        Compartilha o cache com a versão sem streaming (um acerto gera todos os itens de uma vez),
+        mas não o single-flight: cada cliente recebe o seu próprio stream.
+        Novas tentativas (erros transitórios ou saída inválida) só acontecem
+        enquanto nenhum item foi enviado ao cliente. Com expected_count, um item além
+        dessa quantidade (ou um total diferente no fim) torna a resposta inválida.
+        """
+        expected_items = None if expected_count is None else (array_key, expected_count)
+        request_key = make_cache_key(self.model_name, self.generation_config, prompt_text, expected_model.__name__)
+        if self.cache is not None and use_cache:
+            cached = await self.cache.get_async(request_key)
+            if cached is not None and self._has_expected_items(cached, expected_items):
+                print(f"Resposta da IA obtida do cache ({request_key[:12]}).", file=sys.stderr)
+                for item in cached.get(array_key, []):
+                    yield "item", item
+                yield "result", cached
+                return
+
+        governor = self.governor
+        deadline = governor.new_deadline()
+        failures = 0
+        invalid_outputs = 0
+        previous_error: Optional[str] = None
+        while True:
+            prompt = prompt_text if previous_error is None else self._correction_prompt(prompt_text, previous_error)
+            parser = IncrementalArrayParser(array_key)
+            sent = 0
+            LLM_PROMPT_CHARS.observe(len(prompt), schema=expected_model.__name__)
+            try:
+                async with governor.permit(deadline):
+                    provider = await self.warm_up()
+                    chunks = provider.stream(prompt, expected_model.__name__).__aiter__()
+                    # Só o tempo esperando o modelo: o tempo em que o cliente consome os itens (yield) fica de fora
+                    upstream_seconds = 0.0
+                    try:
+                        while True:
+                            started = time.perf_counter()
+                            try:
+                                # Cada pedaço tem o seu próprio limite: um stream parado não prende o worker
+                                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=governor.attempt_timeout_for(deadline))
+                            except StopAsyncIteration:
+                                break
+                            finally:
+                                upstream_seconds += time.perf_counter() - started
+                            for item in parser.feed(chunk):
+                                sent += 1
+                                if expected_count is not None and sent > expected_count:
+                                    LLM_REQUESTS.inc(schema=expected_model.__name__, outcome="invalid_output")
+                                    raise InvalidModelOutput(
+                                        f"A resposta da IA tem mais de {expected_count} itens em '{array_key}'."
+                                    )
+                                yield "item", item
+                    finally:
+                        STAGE_DURATION.observe(upstream_seconds, stage="llm_stream")
+                result = self._parse_and_count(parser.text, expected_model, expected_items)
+            except InvalidModelOutput as e:
+                invalid_outputs += 1
+                if parser.items_found or invalid_outputs > governor.invalid_output_retries:
+                    raise
+                governor.reprompts += 1
+                previous_error = str(e)
+                continue
+            except Exception as e:
+                LLM_REQUESTS.inc(schema=expected_model.__name__, outcome="error")
+                print(f"Erro no streaming da API ({self.provider.name}): {e}", file=sys.stderr)
+                if parser.items_found or not is_transient(e) or failures >= governor.max_retries:
+                    raise
+                failures += 1
+                await governor.backoff(failures, deadline)
+                continue
+            break
+
+        if self.cache is not None:
+            await self.cache.set_async(request_key, result)
+        yield "result", result
 
     # Método para o serviço de Segmentação
-    async def generate_segmentation_insights(self, input_data: MarketSegmentationInsightsInput) -> MarketSegmentationInsightsOutput:
+    async def generate_segmentation_insights(self, input_data: MarketSegmentationInsightsInput, use_cache: bool = True) -> MarketSegmentationInsightsOutput:
+        with stage_timer("prompt_build"):
+            prompt_text = self._segmentation_prompt(input_data)
+        # Com os clusters locais, uma resposta com outra quantidade de segmentos é inválida
+        expected_items = ("segments", len(input_data.clusterProfiles)) if input_data.clusterProfiles else None
+        response_dict = await self._generate_json_response(
+            prompt_text, MarketSegmentationInsightsOutput, use_cache, expected_items
+        )
+        output = MarketSegmentationInsightsOutput(**response_dict) # Retorna o objeto Pydantic
+        if input_data.clusterProfiles:
+            return self._apply_cluster_profiles(output, input_data.clusterProfiles)
+        return output
+
+    async def stream_segmentation_insights(self, input_data: MarketSegmentationInsightsInput,
+                                           use_cache: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Gera ("segment", Segment) para cada segmento assim que a IA o completa
+        e, por último, ("result", MarketSegmentationInsightsOutput) validado.
+        """
+        profiles = input_data.clusterProfiles
+        with stage_timer("prompt_build"):
+            prompt_text = self._segmentation_prompt(input_data)
+        index = 0
+        async for kind, value in self._stream_json_response(
+            prompt_text, MarketSegmentationInsightsOutput, "segments", use_cache,
+            expected_count=len(profiles) if profiles else None
+        ):
+            if kind == "item":
+                segment = Segment(**value)
+                if profiles:
+                    self._apply_profile(segment, profiles[index])
+                index += 1
+                yield "segment", segment
+            else:
+                output = MarketSegmentationInsightsOutput(**value)
+                if profiles:
+                    output = self._apply_cluster_profiles(output, profiles)
+                yield "result", output
+
+    def _segmentation_prompt(self, input_data: MarketSegmentationInsightsInput) -> str:
+        if input_data.clusterProfiles:
+            return self._cluster_profiles_prompt(input_data)
+
+        if input_data.promptSketch:
+            data_section = f"Perfil Estatístico Resumido dos Clientes:\n{input_data.promptSketch}"
+        else:
+            data_section = f"Amostra de Dados do Cliente (formato CSV):\n{input_data.clusterData}"
+
         # --- PROMPT CORRIGIDO ---
         # Adicionei o schema JSON explícito de volta
         prompt_text = f"""
@@ -144,8 +337,7 @@ class GeminiMarketingService:
 
         As estimativas devem ser derivadas logicamente dos dados de amostra fornecidos. Garanta que a saída seja estruturada como JSON válido de acordo com o schema esperado.
 
-        Amostra de Dados do Cliente (formato CSV):
-        {input_data.clusterData}
+        {data_section}
 
         Schema JSON esperado para a resposta (NÃO inclua esta seção de schema na saída, apenas use-a como guia para a estrutura):
         {{
@@ -161,12 +353,96 @@ class GeminiMarketingService:
           ]
         }}
         """
-        
-        response_dict = await self._generate_json_response(prompt_text, MarketSegmentationInsightsOutput)
-        return MarketSegmentationInsightsOutput(**response_dict) # Retorna o objeto Pydantic
+        return prompt_text
+
+    def _cluster_profiles_prompt(self, input_data: MarketSegmentationInsightsInput) -> str:
+        """
+        Os clusters já foram calculados localmente: a IA recebe apenas as estatísticas
+        compactas de cada cluster para nomeá-los e descrevê-los.
+        """
+        profiles = input_data.clusterProfiles
+        profiles_json = json.dumps(
+            [profile.model_dump() for profile in profiles], ensure_ascii=False, separators=(',', ':')
+        )
+        prompt_text = f"""
+        Você é um analista de marketing especialista. Sua saída DEVE estar em Português do Brasil e ser um JSON VÁLIDO que corresponda exatamente ao schema fornecido implicitamente pelo modelo Pydantic 'MarketSegmentationInsightsOutput'.
+
+        Os clientes já foram agrupados em exatamente {len(profiles)} clusters por um algoritmo k-means. Abaixo estão as estatísticas exatas de cada cluster:
+        - size: número de clientes
+        - avg_purchase_value: ticket médio (total gasto / número de compras)
+        - purchase_frequency: número médio de compras por cliente
+        - avg_total_spent: gasto total médio por cliente
+        - avg_items: quantidade média de itens por cliente
+        - top_countries: participação dos principais países
+
+        Tratamentos de dados aplicados:
+        - Normalizar Dados: {input_data.dataTreatment.normalize}
+        - Excluir Nulos: {input_data.dataTreatment.excludeNulls}
+        - Agrupar Categorias: {input_data.dataTreatment.groupCategories}
+
+        Para cada cluster, NA MESMA ORDEM em que aparecem, você deve:
+        1. Fornecer um nome descritivo (ex: "Compradores Frequentes de Alto Valor", "Novos Compradores", "Gastadores Econômicos").
+        2. Copiar os valores de size, avg_purchase_value e purchase_frequency sem alterá-los.
+        3. Escrever um breve resumo dos principais atributos e necessidades do segmento.
+
+        Finalmente, forneça um único resumo textual combinado de todos os segmentos no campo 'textualInsights'.
+
+        Estatísticas dos clusters (JSON):
+        {profiles_json}
+
+        Schema JSON esperado para a resposta (NÃO inclua esta seção de schema na saída, apenas use-a como guia para a estrutura):
+        {{
+          "textualInsights": "string",
+          "segments": [
+            {{
+              "name": "string",
+              "size": "integer",
+              "avg_purchase_value": "number",
+              "purchase_frequency": "number",
+              "description": "string"
+            }}
+          ]
+        }}
+        """
+        return prompt_text
+
+    @staticmethod
+    def _apply_cluster_profiles(output: MarketSegmentationInsightsOutput, profiles: List[ClusterProfile]) -> MarketSegmentationInsightsOutput:
+        """Substitui os números devolvidos pela IA pelos valores exatos calculados localmente."""
+        if len(output.segments) != len(profiles):
+            raise ValueError(
+                f"A IA retornou {len(output.segments)} segmentos, mas existem {len(profiles)} clusters."
+            )
+        for segment, profile in zip(output.segments, profiles):
+            GeminiMarketingService._apply_profile(segment, profile)
+        return output
+
+    @staticmethod
+    def _apply_profile(segment: Segment, profile: ClusterProfile):
+        segment.size = profile.size
+        segment.avg_purchase_value = profile.avg_purchase_value
+        segment.purchase_frequency = profile.purchase_frequency
 
     # Método para o serviço de Estratégias
-    async def generate_marketing_strategies(self, input_data: MarketingStrategiesInput) -> MarketingStrategiesOutput:
+    async def generate_marketing_strategies(self, input_data: MarketingStrategiesInput, use_cache: bool = True) -> MarketingStrategiesOutput:
+        prompt_text = self._strategies_prompt(input_data)
+        response_dict = await self._generate_json_response(prompt_text, MarketingStrategiesOutput, use_cache)
+        return MarketingStrategiesOutput(**response_dict)
+
+    async def stream_marketing_strategies(self, input_data: MarketingStrategiesInput,
+                                          use_cache: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Gera ("strategy", str) para cada estratégia assim que a IA a completa
+        e, por último, ("result", MarketingStrategiesOutput) validado.
+        """
+        prompt_text = self._strategies_prompt(input_data)
+        async for kind, value in self._stream_json_response(prompt_text, MarketingStrategiesOutput, "marketingStrategies", use_cache):
+            if kind == "item":
+                yield "strategy", str(value)
+            else:
+                yield "result", MarketingStrategiesOutput(**value)
+
+    def _strategies_prompt(self, input_data: MarketingStrategiesInput) -> str:
         # --- PROMPT CORRIGIDO ---
         # Adicionei o schema JSON explícito de volta
         prompt_text = f"""
@@ -182,6 +458,108 @@ class GeminiMarketingService:
           "marketingStrategies": ["string"]
         }}
         """
-        
-        response_dict = await self._generate_json_response(prompt_text, MarketingStrategiesOutput)
-        return MarketingStrategiesOutput(**response_dict)
\ No newline at end of file
+        return prompt_text
+
+    async def generate_batch_marketing_strategies(self, segments: List[SegmentDescription], campaign_objectives: str,
+                                                  use_cache: bool = True) -> List[SegmentStrategies]:
+        """
+        Estratégias para vários segmentos numa única chamada estruturada à IA.
+        O resultado segue a ordem (e os nomes) de `segments`; segmentos que a IA deixar de fora
+        são completados com chamadas individuais, no máximo STRATEGY_BATCH_FANOUT ao mesmo tempo.
+        """
+        prompt_text = self._batch_strategies_prompt(segments, campaign_objectives)
+        response_dict = await self._generate_json_response(prompt_text, SegmentStrategiesList, use_cache)
+        generated = SegmentStrategiesList(**response_dict).segments
+
+        results: List[Optional[SegmentStrategies]] = []
+        for segment, item in zip(segments, self._match_batch_strategies(segments, generated)):
+            if item is not None and item.marketingStrategies:
+                item = SegmentStrategies(segmentName=segment.segmentName, marketingStrategies=item.marketingStrategies)
+            else:
+                item = None
+            results.append(item)
+
+        missing = [index for index, item in enumerate(results) if item is None]
+        if missing:
+            print(f"Resposta em lote sem {len(missing)} de {len(segments)} segmentos; completando individualmente.", file=sys.stderr)
+            semaphore = asyncio.Semaphore(STRATEGY_BATCH_FANOUT)
+
+            async def fill(index: int):
+                async with semaphore:
+                    output = await self.generate_marketing_strategies(
+                        MarketingStrategiesInput(
+                            customerSegmentAttributes=segments[index].customerSegmentAttributes,
+                            campaignObjectives=campaign_objectives
+                        ),
+                        use_cache
+                    )
+                results[index] = SegmentStrategies(
+                    segmentName=segments[index].segmentName, marketingStrategies=output.marketingStrategies
+                )
+
+            await asyncio.gather(*(fill(index) for index in missing))
+        return results
+
+    @staticmethod
+    def _match_batch_strategies(segments: List[SegmentDescription],
+                                generated: List[SegmentStrategies]) -> List[Optional[SegmentStrategies]]:
+        """
+        Item da resposta em lote de cada segmento (None se faltar). Com a mesma quantidade
+        de itens vale a posição; os nomes só reordenam a resposta quando são os mesmos
+        nomes pedidos em outra ordem. Nomes repetidos são atribuídos na ordem em que aparecem.
+        """
+        def key(name: str) -> str:
+            return name.strip().casefold()
+
+        names = [key(segment.segmentName) for segment in segments]
+        if len(generated) == len(segments) and sorted(names) != sorted(key(item.segmentName) for item in generated):
+            return list(generated)
+
+        by_name: Dict[str, Deque[SegmentStrategies]] = {}
+        for item in generated:
+            by_name.setdefault(key(item.segmentName), deque()).append(item)
+        return [by_name[name].popleft() if by_name.get(name) else None for name in names]
+
+    def _batch_strategies_prompt(self, segments: List[SegmentDescription], campaign_objectives: str) -> str:
+        segments_json = json.dumps(
+            [segment.model_dump() for segment in segments], ensure_ascii=False, separators=(',', ':')
+        )
+        prompt_text = f"""
+        Você é um estrategista de marketing especialista. Sua saída DEVE estar em Português do Brasil e ser um JSON VÁLIDO que corresponda exatamente ao schema fornecido.
+
+        Com base na descrição de cada segmento de clientes e nos objetivos da campanha (comuns a todos os segmentos), gere estratégias de marketing personalizadas para CADA segmento.
+        Retorne exatamente {len(segments)} itens no campo 'segments', NA MESMA ORDEM da lista abaixo, copiando o 'segmentName' de cada segmento sem alterá-lo.
+
+        Objetivos da Campanha: {campaign_objectives}
+
+        Segmentos (JSON):
+        {segments_json}
+
+        Schema JSON esperado para a resposta (NÃO inclua esta seção de schema na saída, apenas use-a como guia para a estrutura):
+        {{
+          "segments": [
+            {{
+              "segmentName": "string",
+              "marketingStrategies": ["string"]
+            }}
+          ]
+        }}
+        """
+        return prompt_text
+
+
+_shared_service: Optional[GeminiMarketingService] = None
+_shared_service_lock = threading.Lock()
+
+
+def get_shared_service() -> GeminiMarketingService:
+    """
+    Instância única do serviço por processo: os serviços de segmentação e de estratégias
+    montados no mesmo app (gateway) compartilham o provedor, o cache e a governança.
+    """
+    global _shared_service
+    if _shared_service is None:
+        with _shared_service_lock:
+            if _shared_service is None:
+                _shared_service = GeminiMarketingService()
+    return _shared_service
@@ -0,0 +1,147 @@
+# python-backend/common/async_database.py
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common import database
+from common.metrics import DB_CALL_DURATION, DB_CALLS_IN_FLIGHT
+from common.models import (
+    MarketSegmentationInsightsInput, MarketSegmentationInsightsOutput,
+    AnalysisMetadata, AnalysisSearchResult, User, UserCreate, UserProfileUpdate, UserInDB,
+    BatchMarketingStrategiesOutput, SegmentStrategies
+)
+
+# --- Configuração do Acesso Assíncrono ao Banco ---
+# As funções síncronas do database.py rodam num pool de threads limitado,
+# cada thread com a sua conexão reutilizada do pool de conexões
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Cria o executor sob demanda (e novamente após um fork)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Executa uma função síncrona de banco de dados fora do event loop."""
+    loop = asyncio.get_running_loop()
+    DB_CALLS_IN_FLIGHT.inc()
+    try:
+        with DB_CALL_DURATION.time(operation=func.__name__):
+            return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+    finally:
+        DB_CALLS_IN_FLIGHT.dec()
+
+
+def shutdown_executor():
+    """Encerra o executor e fecha as conexões do pool (usado no shutdown)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+    database.close_db_connections()
+
+
+# --- Usuários ---
+
+async def get_user_by_email(email: str) -> Optional[UserInDB]:
+    return await run_db(database.get_user_by_email, email)
+
+async def get_user_by_id(user_id: int) -> Optional[User]:
+    return await run_db(database.get_user_by_id, user_id)
+
+async def create_user(user_in: UserCreate, hashed_password: Optional[str] = None) -> User:
+    return await run_db(database.create_user, user_in, hashed_password)
+
+async def update_user_password_hash(user_id: int, hashed_password: str):
+    return await run_db(database.update_user_password_hash, user_id, hashed_password)
+
+async def update_user_profile(user_id: int, profile_data: UserProfileUpdate) -> Optional[User]:
+    return await run_db(database.update_user_profile, user_id, profile_data)
+
+# --- Análises ---
+
+async def save_analysis(
+    user_id: int,
+    analysis_input: MarketSegmentationInsightsInput,
+    analysis_output: MarketSegmentationInsightsOutput,
+    state: Optional[bytes] = None,
+    customers: int = 0,
+    parent_analysis_id: Optional[int] = None
+) -> int:
+    return await run_db(
+        database.save_analysis, user_id, analysis_input, analysis_output, state, customers, parent_analysis_id
+    )
+
+async def get_all_analyses(user_id: int) -> List[AnalysisMetadata]:
+    return await run_db(database.get_all_analyses, user_id)
+
+async def get_analyses_page(user_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[List[AnalysisMetadata], Optional[str]]:
+    return await run_db(database.get_analyses_page, user_id, limit, cursor)
+
+async def search_analyses(user_id: int, text: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[AnalysisSearchResult], Optional[str]]:
+    return await run_db(database.search_analyses, user_id, text, limit, cursor)
+
+async def get_analysis_csv_data(analysis_id: int, user_id: int) -> Optional[str]:
+    return await run_db(database.get_analysis_csv_data, analysis_id, user_id)
+
+async def get_analysis_by_id(analysis_id: int, user_id: int) -> Optional[MarketSegmentationInsightsOutput]:
+    return await run_db(database.get_analysis_by_id, analysis_id, user_id)
+
+async def get_analysis_state(analysis_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    return await run_db(database.get_analysis_state, analysis_id, user_id)
+
+# --- Estratégias por Segmento ---
+
+async def save_segment_strategies(analysis_id: int, campaign_objectives: str, results: List[SegmentStrategies]):
+    return await run_db(database.save_segment_strategies, analysis_id, campaign_objectives, results)
+
+async def get_segment_strategies(analysis_id: int, user_id: int) -> Optional[BatchMarketingStrategiesOutput]:
+    return await run_db(database.get_segment_strategies, analysis_id, user_id)
+
+# --- Datasets ---
+
+async def register_user_dataset(user_id: int, dataset_id: str, customers: int):
+    return await run_db(database.register_user_dataset, user_id, dataset_id, customers)
+
+async def user_has_dataset(user_id: int, dataset_id: str) -> bool:
+    return await run_db(database.user_has_dataset, user_id, dataset_id)
+
+async def get_user_datasets(user_id: int, limit: int) -> List[Dict[str, Any]]:
+    return await run_db(database.get_user_datasets, user_id, limit)
+
+# --- Jobs de Segmentação ---
+
+async def create_segmentation_job(user_id: int, params: Dict[str, Any], input_path: str) -> str:
+    return await run_db(database.create_segmentation_job, user_id, params, input_path)
+
+async def claim_segmentation_job(worker_id: str, stale_seconds: float, max_attempts: int) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    return await run_db(database.claim_segmentation_job, worker_id, stale_seconds, max_attempts)
+
+async def update_segmentation_job_progress(job_id: str, worker_id: str, stage: str, progress: float):
+    return await run_db(database.update_segmentation_job_progress, job_id, worker_id, stage, progress)
+
+async def heartbeat_segmentation_job(job_id: str, worker_id: str):
+    return await run_db(database.heartbeat_segmentation_job, job_id, worker_id)
+
+async def finish_segmentation_job(job_id: str, worker_id: str, analysis_id: Optional[int] = None,
+                                  result: Optional[str] = None, error: Optional[str] = None) -> bool:
+    return await run_db(database.finish_segmentation_job, job_id, worker_id, analysis_id, result, error)
+
+async def get_segmentation_job(job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+    return await run_db(database.get_segmentation_job, job_id, user_id)
@@ -1,17 +1,21 @@
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
-from common import database
+from common import async_database
+from common.metrics import stage_timer
 from common.models import User, TokenData
+from common.password_hashing import HashingPoolSaturated, password_hasher, pwd_context
 
 # --- Configuração de Senha ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# pwd_context (custo configurável via BCRYPT_ROUNDS) vem de common.password_hashing
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login") # Aponta para o endpoint de login
 
 # --- Configuração do JWT ---
@@ -23,12 +27,87 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 7 dias
 if SECRET_KEY == "seu_segredo_super_secreto_aqui_mude_isso":
     print("AVISO: Usando chave JWT secreta padrão. Defina JWT_SECRET_KEY no .env para produção.", file=sys.stderr)
 
+# --- Configuração do Cache de Usuários Autenticados ---
+# O cache é por processo: em outros serviços, uma alteração de perfil aparece após o TTL
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "4096"))
+# Se ativo, nome e avatar são assinados no token e o banco não é consultado
+JWT_EMBED_PROFILE_CLAIMS = os.getenv("JWT_EMBED_PROFILE_CLAIMS", "0") == "1"
+
+
+class PrincipalCache:
+    """Cache LRU com TTL dos usuários já resolvidos, indexado por (user_id, token)."""
+
+    def __init__(self, ttl_seconds: int = PRINCIPAL_CACHE_TTL_SECONDS, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, User]]" = OrderedDict()
+        self._keys_by_user: Dict[int, Set[Tuple[int, str]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, token: str) -> Optional[User]:
+        key = (user_id, token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, user_id: int, token: str, user: User):
+        key = (user_id, token)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, user)
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, user_id: int):
+        """Remove todas as entradas (todos os tokens) de um usuário."""
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._drop(key)
+
+    def _drop(self, key: Tuple[int, str]):
+        self._entries.pop(key, None)
+        keys = self._keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[0]]
+
+
+principal_cache = PrincipalCache()
+
+def invalidate_principal(user_id: int):
+    """Chamada quando o perfil do usuário muda."""
+    principal_cache.invalidate(user_id)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def _hashing_unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Serviço de autenticação sobrecarregado. Tente novamente em instantes.",
+        headers={"Retry-After": "1"},
+    )
+
+async def hash_password_async(password: str) -> str:
+    """Gera o hash no pool de processos; 503 se a fila estiver cheia."""
+    try:
+        with stage_timer("password_hash"):
+            return await password_hasher.hash(password)
+    except HashingPoolSaturated:
+        raise _hashing_unavailable()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -39,12 +118,27 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def authenticate_user(email: str, password: str) -> Optional[User]:
-    user = database.get_user_by_email(email)
+def build_token_claims(user: User) -> dict:
+    """Claims do token de acesso; inclui o perfil quando JWT_EMBED_PROFILE_CLAIMS está ativo."""
+    claims = {"sub": user.email, "user_id": user.id}
+    if JWT_EMBED_PROFILE_CLAIMS:
+        claims["profile"] = {"name": user.name, "avatar_url": user.avatar_url}
+    return claims
+
+async def authenticate_user(email: str, password: str) -> Optional[User]:
+    user = await async_database.get_user_by_email(email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    try:
+        with stage_timer("password_verify"):
+            valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    except HashingPoolSaturated:
+        raise _hashing_unavailable()
+    if not valid:
         return None
+    if new_hash:
+        # A política de custo mudou: grava o hash refeito de forma transparente
+        await async_database.update_user_password_hash(user.id, new_hash)
     return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
@@ -63,10 +157,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     
     except JWTError:
         raise credentials_exception
-    
-    user = database.get_user_by_id(user_id=token_data.user_id)
+
+    # Perfil assinado no próprio token: dispensa a consulta ao banco
+    profile = payload.get("profile")
+    if JWT_EMBED_PROFILE_CLAIMS and profile is not None and token_data.sub:
+        return User(id=token_data.user_id, email=token_data.sub, **profile)
+
+    user = principal_cache.get(token_data.user_id, token)
+    if user is not None:
+        return user
+
+    user = await async_database.get_user_by_id(user_id=token_data.user_id)
     if user is None:
         raise credentials_exception
+    principal_cache.set(token_data.user_id, token, user)
     
     # Retorna o modelo Pydantic do usuário
     return user
\ No newline at end of file
@@ -0,0 +1,240 @@
+# python-backend/common/clustering.py
+
+import os
+import sys
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from common.models import ClusterProfile, DataTreatment
+
+# --- Configuração da Clusterização Local ---
+FEATURE_COLUMNS = ['TotalGasto', 'Frequencia', 'TotalItens']
+KMEANS_MAX_ITER = int(os.getenv("KMEANS_MAX_ITER", "100"))
+KMEANS_TOL = float(os.getenv("KMEANS_TOL", "1e-4"))
+KMEANS_SEED = int(os.getenv("KMEANS_SEED", "42"))
+# Acima deste número de clientes usamos o k-means em mini-lotes
+MINI_BATCH_THRESHOLD = int(os.getenv("KMEANS_MINI_BATCH_THRESHOLD", "50000"))
+MINI_BATCH_SIZE = int(os.getenv("KMEANS_MINI_BATCH_SIZE", "4096"))
+# Quantidade de países listados no perfil de cada cluster
+TOP_COUNTRIES = 3
+
+
+class ClusteringError(ValueError):
+    """Erro de entrada na clusterização (ex: mais clusters que clientes)."""
+
+
+class FeatureScaler(NamedTuple):
+    mean: np.ndarray
+    scale: np.ndarray
+
+    def transform(self, values: np.ndarray) -> np.ndarray:
+        return (values - self.mean) / self.scale
+
+    def inverse_transform(self, values: np.ndarray) -> np.ndarray:
+        return values * self.scale + self.mean
+
+
+class ClusteringResult(NamedTuple):
+    customers: pd.DataFrame          # clientes efetivamente clusterizados, com a coluna 'Cluster'
+    labels: np.ndarray
+    centroids: np.ndarray            # no espaço das features (escalado, se normalize=True)
+    scaler: Optional[FeatureScaler]
+    inertia: float
+    profiles: List[ClusterProfile]
+
+
+def prepare_features(customer_df: pd.DataFrame, data_treatment: DataTreatment):
+    """Seleciona as features numéricas e aplica os tratamentos de dados."""
+    customers = customer_df.copy()
+    for column in FEATURE_COLUMNS:
+        customers[column] = pd.to_numeric(customers[column], errors='coerce')
+
+    if data_treatment.excludeNulls:
+        customers = customers.dropna(subset=FEATURE_COLUMNS)
+    else:
+        customers[FEATURE_COLUMNS] = customers[FEATURE_COLUMNS].fillna(0)
+
+    values = customers[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    scaler = None
+    if data_treatment.normalize and len(values):
+        std = values.std(axis=0)
+        scaler = FeatureScaler(mean=values.mean(axis=0), scale=np.where(std > 0, std, 1.0))
+        values = scaler.transform(values)
+    return customers, values, scaler
+
+
+def squared_distances(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Distâncias euclidianas ao quadrado entre cada ponto e cada centróide (n x k)."""
+    distances = (
+        np.einsum('ij,ij->i', X, X)[:, None]
+        - 2.0 * X @ centroids.T
+        + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    )
+    return np.maximum(distances, 0.0)
+
+
+def _kmeans_plus_plus(X: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Inicialização k-means++."""
+    centroids = np.empty((k, X.shape[1]), dtype=np.float64)
+    centroids[0] = X[rng.integers(len(X))]
+    closest = squared_distances(X, centroids[:1]).ravel()
+    for i in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            centroids[i] = X[rng.integers(len(X))]
+        else:
+            centroids[i] = X[rng.choice(len(X), p=closest / total)]
+        closest = np.minimum(closest, squared_distances(X, centroids[i:i + 1]).ravel())
+    return centroids
+
+
+def _assign(X: np.ndarray, centroids: np.ndarray):
+    distances = squared_distances(X, centroids)
+    labels = distances.argmin(axis=1)
+    return labels, distances[np.arange(len(X)), labels]
+
+
+def kmeans(X: np.ndarray, k: int, max_iter: int = KMEANS_MAX_ITER, tol: float = KMEANS_TOL,
+           seed: int = KMEANS_SEED, init: Optional[np.ndarray] = None):
+    """K-means (Lloyd) vetorizado. Retorna (labels, centroids, inertia)."""
+    rng = np.random.default_rng(seed)
+    centroids = init.astype(np.float64, copy=True) if init is not None else _kmeans_plus_plus(X, k, rng)
+
+    for _ in range(max_iter):
+        labels, closest = _assign(X, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+
+        new_centroids = centroids.copy()
+        filled = counts > 0
+        new_centroids[filled] = sums[filled] / counts[filled, None]
+        # Cluster vazio: reposiciona no ponto mais distante do seu centróide
+        for empty in np.flatnonzero(~filled):
+            farthest = int(closest.argmax())
+            new_centroids[empty] = X[farthest]
+            closest[farthest] = 0.0
+
+        shift = np.abs(new_centroids - centroids).max()
+        centroids = new_centroids
+        if shift <= tol:
+            break
+
+    labels, closest = _assign(X, centroids)
+    return labels, centroids, float(closest.sum())
+
+
+def mini_batch_kmeans(X: np.ndarray, k: int, batch_size: int = MINI_BATCH_SIZE,
+                      max_iter: int = KMEANS_MAX_ITER, seed: int = KMEANS_SEED,
+                      init: Optional[np.ndarray] = None):
+    """K-means em mini-lotes (Sculley, 2010) para bases grandes. Retorna (labels, centroids, inertia)."""
+    rng = np.random.default_rng(seed)
+    if init is not None:
+        centroids = init.astype(np.float64, copy=True)
+    else:
+        sample = X[rng.choice(len(X), size=min(len(X), batch_size * 4), replace=False)]
+        centroids = _kmeans_plus_plus(sample, k, rng)
+    counts = np.zeros(k, dtype=np.float64)
+
+    for _ in range(max_iter):
+        batch = X[rng.integers(len(X), size=min(len(X), batch_size))]
+        labels, _ = _assign(batch, centroids)
+        batch_counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, batch)
+
+        touched = batch_counts > 0
+        counts[touched] += batch_counts[touched]
+        # Taxa de aprendizado por centróide = tamanho do lote / total acumulado
+        rate = batch_counts[touched] / counts[touched]
+        previous = centroids.copy()
+        centroids[touched] += rate[:, None] * (sums[touched] / batch_counts[touched, None] - centroids[touched])
+        if np.abs(centroids - previous).max() <= KMEANS_TOL:
+            break
+
+    labels, closest = _assign(X, centroids)
+    return labels, centroids, float(closest.sum())
+
+
+def fit_kmeans(X: np.ndarray, k: int, init: Optional[np.ndarray] = None):
+    """K-means exato ou, acima de MINI_BATCH_THRESHOLD pontos, em mini-lotes. Retorna (labels, centroids, inertia)."""
+    if len(X) > MINI_BATCH_THRESHOLD:
+        return mini_batch_kmeans(X, k, init=init)
+    return kmeans(X, k, init=init)
+
+
+def build_cluster_profiles(customers: pd.DataFrame, group_categories: bool) -> List[ClusterProfile]:
+    """Calcula as estatísticas exatas de cada cluster a partir das atribuições."""
+    profiles: List[ClusterProfile] = []
+    for cluster_id, group in customers.groupby('Cluster', sort=True):
+        total_spent = float(group['TotalGasto'].sum())
+        total_orders = float(group['Frequencia'].sum())
+
+        countries = group['Pais'].fillna('Desconhecido').value_counts(normalize=True)
+        top = countries.head(TOP_COUNTRIES)
+        top_countries = {str(name): round(float(share), 4) for name, share in top.items()}
+        if group_categories and len(countries) > TOP_COUNTRIES:
+            top_countries['Outros'] = round(float(countries.iloc[TOP_COUNTRIES:].sum()), 4)
+
+        profiles.append(ClusterProfile(
+            cluster_id=int(cluster_id),
+            size=int(len(group)),
+            # Ticket médio: total gasto dividido pelo número de compras (notas fiscais)
+            avg_purchase_value=round(total_spent / total_orders, 2) if total_orders else 0.0,
+            purchase_frequency=round(float(group['Frequencia'].mean()), 2),
+            avg_total_spent=round(float(group['TotalGasto'].mean()), 2),
+            avg_items=round(float(group['TotalItens'].mean()), 2),
+            top_countries=top_countries,
+        ))
+    return profiles
+
+
+def raw_centroids(result: ClusteringResult) -> np.ndarray:
+    """Centróides nas unidades originais das features (independentes da normalização)."""
+    if result.scaler is None:
+        return result.centroids.copy()
+    return result.scaler.inverse_transform(result.centroids)
+
+
+def cluster_customers(customer_df: pd.DataFrame, number_of_clusters: int,
+                      data_treatment: DataTreatment,
+                      initial_centroids: Optional[np.ndarray] = None) -> ClusteringResult:
+    """
+    Atribui cada cliente a um dos `number_of_clusters` clusters e calcula os perfis.
+    Com `initial_centroids` (unidades originais, ver raw_centroids) o k-means parte
+    dos centróides de uma análise anterior e o cluster i continua sendo o cluster i,
+    sem a renumeração por tamanho.
+    """
+    if number_of_clusters < 1:
+        raise ClusteringError("O número de clusters deve ser pelo menos 1.")
+
+    customers, X, scaler = prepare_features(customer_df, data_treatment)
+    if len(X) < number_of_clusters:
+        raise ClusteringError(
+            f"Há apenas {len(X)} clientes válidos para {number_of_clusters} clusters."
+        )
+
+    if initial_centroids is not None:
+        if len(initial_centroids) != number_of_clusters:
+            raise ClusteringError(
+                f"{len(initial_centroids)} centróides iniciais para {number_of_clusters} clusters."
+            )
+        init = scaler.transform(initial_centroids) if scaler is not None else initial_centroids
+        labels, centroids, inertia = fit_kmeans(X, number_of_clusters, init=init)
+    else:
+        labels, centroids, inertia = fit_kmeans(X, number_of_clusters)
+
+        # Renumera os clusters por tamanho (0 = maior) para uma saída estável
+        order = np.argsort(-np.bincount(labels, minlength=number_of_clusters), kind='stable')
+        remap = np.empty_like(order)
+        remap[order] = np.arange(number_of_clusters)
+        labels = remap[labels]
+        centroids = centroids[order]
+
+    customers = customers.assign(Cluster=labels)
+    profiles = build_cluster_profiles(customers, data_treatment.groupCategories)
+    print(f"Clusterização local: {len(X)} clientes em {number_of_clusters} clusters "
+          f"(inércia={inertia:.2f}).", file=sys.stderr)
+    return ClusteringResult(customers, labels, centroids, scaler, inertia, profiles)
@@ -1,26 +1,62 @@
 # python-backend/common/database.py
 
+import base64
+import hashlib
+import json
 import sqlite3
+import time
+import uuid
+import zlib
 import os
+import re
 import sys
-from typing import List, Dict, Optional, Any
+from typing import Callable, Iterator, List, Dict, Optional, Any, Tuple
 from pydantic import BaseModel
 from datetime import datetime
 
 from common.models import (
     MarketSegmentationInsightsInput, MarketSegmentationInsightsOutput, Segment,
-    AnalysisMetadata, User, UserCreate, UserProfileUpdate, UserInDB
+    AnalysisMetadata, AnalysisSearchResult, User, UserCreate, UserProfileUpdate, UserInDB,
+    BatchMarketingStrategiesOutput, SegmentStrategies
 )
 from common import auth
+from common.db_pool import ConnectionPool
 
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyses.db'))
+DB_PATH = os.getenv("DB_PATH", os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analyses.db')))
+
+# Tamanho máximo do trecho do CSV exibido no histórico
+SNIPPET_LENGTH = 50
+# Nível de compressão zlib dos blobs (CSV original das análises)
+BLOB_COMPRESSION_LEVEL = int(os.getenv("BLOB_COMPRESSION_LEVEL", "6"))
+# Linhas lidas do cursor por vez nas exportações
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "1000"))
+# Busca textual: palavras consideradas por consulta, tamanho mínimo da última palavra
+# para buscá-la também como prefixo e tamanho (em palavras) do trecho retornado
+SEARCH_MAX_TERMS = 16
+SEARCH_MIN_PREFIX_LENGTH = 3
+SEARCH_SNIPPET_TOKENS = 16
+# Relevância BM25 (menor = mais relevante); a coluna do dono não conta
+SEARCH_RANK = "bm25(analysis_search, 0.0, 1.0, 1.0)"
+# A relevância é calculada só para as N análises mais recentes que casam com a busca:
+# encontrar as análises é barato, mas o BM25 custa por análise encontrada (termos
+# presentes em quase todos os insights de um usuário com dezenas de milhares de análises)
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "5000"))
+
+
+_pool = ConnectionPool(DB_PATH)
 
 
 def get_db_connection():
-    """Cria e retorna uma conexão com o banco de dados."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Retorna a conexão (reutilizada) da thread atual com o banco de dados."""
+    return _pool.connection()
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Estatísticas do pool de conexões deste processo."""
+    return _pool.stats()
+
+def close_db_connections():
+    """Fecha as conexões do pool (usado no shutdown dos serviços)."""
+    _pool.close_all()
 
 def init_db():
     """Cria as tabelas do banco de dados se elas não existirem."""
@@ -69,8 +105,255 @@ def init_db():
         );
         """)
         conn.commit()
+        _run_migrations(conn)
+    # Blobs sem referência (o conteúdo é deduplicado, então só são apagados aqui)
+    removed = collect_unreferenced_blobs()
+    if removed:
+        print(f"{removed} blobs sem referência removidos.", file=sys.stderr)
     print("Banco de dados inicializado com sucesso.", file=sys.stderr)
 
+# --- MIGRAÇÕES DE SCHEMA ---
+# Cada migração roda uma única vez; a versão aplicada fica em PRAGMA user_version.
+
+def _column_exists(cursor: sqlite3.Cursor, table: str, column: str) -> bool:
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})"))
+
+def _migration_history_indexes(cursor: sqlite3.Cursor):
+    """Índices do histórico e trecho do CSV pré-calculado em coluna própria."""
+    if not _column_exists(cursor, 'analyses', 'original_data_snippet'):
+        cursor.execute("ALTER TABLE analyses ADD COLUMN original_data_snippet TEXT")
+    # Mesma regra de _make_snippet(): primeira linha, até SNIPPET_LENGTH caracteres
+    cursor.execute(f"""
+    UPDATE analyses SET original_data_snippet = substr(
+        substr(COALESCE(original_csv_data, ''), 1,
+               instr(COALESCE(original_csv_data, '') || char(10), char(10)) - 1),
+        1, {SNIPPET_LENGTH}) || '...'
+    WHERE original_data_snippet IS NULL
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analyses_user_timestamp ON analyses (user_id, timestamp DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_segments_analysis_id ON segments (analysis_id)")
+
+def _migration_csv_blobs(cursor: sqlite3.Cursor):
+    """Move o CSV original das análises para blobs comprimidos e deduplicados."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,       -- SHA-256 do conteúdo descomprimido
+        codec TEXT NOT NULL,
+        size INTEGER NOT NULL,       -- tamanho descomprimido, em bytes
+        data BLOB NOT NULL
+    );
+    """)
+    if not _column_exists(cursor, 'analyses', 'csv_blob_hash'):
+        cursor.execute("ALTER TABLE analyses ADD COLUMN csv_blob_hash TEXT REFERENCES blobs (hash)")
+
+    migrated = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT id, original_csv_data FROM analyses "
+            "WHERE original_csv_data IS NOT NULL AND csv_blob_hash IS NULL LIMIT 100"
+        ).fetchall()
+        if not rows:
+            break
+        for analysis_id, csv_data in rows:
+            blob_hash = _put_blob(cursor, csv_data.encode('utf-8'))
+            cursor.execute(
+                "UPDATE analyses SET csv_blob_hash = ?, original_csv_data = NULL WHERE id = ?",
+                (blob_hash, analysis_id)
+            )
+        migrated += len(rows)
+    print(f"{migrated} CSVs de análises movidos para a tabela de blobs.", file=sys.stderr)
+
+def _migration_segmentation_jobs(cursor: sqlite3.Cursor):
+    """Fila persistente dos jobs assíncronos de segmentação."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS segmentation_jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,            -- queued, running, succeeded, failed
+        stage TEXT,
+        progress REAL NOT NULL DEFAULT 0,
+        params TEXT NOT NULL,            -- SegmentationOptions em JSON
+        input_path TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        locked_by TEXT,
+        heartbeat_at REAL,
+        analysis_id INTEGER,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_segmentation_jobs_status ON segmentation_jobs (status, created_at)")
+
+def _migration_segment_strategies(cursor: sqlite3.Cursor):
+    """Estratégias de marketing geradas em lote para os segmentos de uma análise."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS segment_strategies (
+        analysis_id INTEGER NOT NULL,
+        segment_index INTEGER NOT NULL,   -- posição do segmento na análise
+        segment_name TEXT NOT NULL,
+        campaign_objectives TEXT NOT NULL,
+        strategies TEXT NOT NULL,         -- lista de strings em JSON
+        created_at REAL NOT NULL,
+        PRIMARY KEY (analysis_id, segment_index),
+        FOREIGN KEY (analysis_id) REFERENCES analyses (id) ON DELETE CASCADE
+    );
+    """)
+
+def _migration_user_datasets(cursor: sqlite3.Cursor):
+    """Datasets (tabelas agregadas em cache) enviados por cada usuário, para reanálise pelo datasetId."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_datasets (
+        user_id INTEGER NOT NULL,
+        dataset_id TEXT NOT NULL,         -- hash do upload + versão das features
+        customers INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL,
+        PRIMARY KEY (user_id, dataset_id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_datasets_last_used ON user_datasets (user_id, last_used_at DESC)"
+    )
+
+def _migration_analysis_states(cursor: sqlite3.Cursor):
+    """Estado agregado (somas e notas distintas por cliente) das análises incrementais."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS analysis_states (
+        analysis_id INTEGER PRIMARY KEY,
+        parent_analysis_id INTEGER,       -- análise à qual as novas transações foram somadas
+        state_blob_hash TEXT NOT NULL REFERENCES blobs (hash),
+        customers INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (analysis_id) REFERENCES analyses (id) ON DELETE CASCADE
+    );
+    """)
+
+def _migration_analysis_search(cursor: sqlite3.Cursor):
+    """
+    Índice de busca textual (FTS5) dos insights e dos nomes/descrições dos segmentos,
+    uma linha por análise (rowid = id da análise), mantido por triggers.
+    O dono entra como termo indexado ('u<user_id>') para a busca de cada usuário
+    ser resolvida no próprio índice, sem percorrer as análises dos outros.
+    """
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS analysis_search USING fts5(
+        owner, textual_insights, segment_text,
+        tokenize = 'unicode61 remove_diacritics 2'
+    );
+    """)
+    segment_text = "SELECT COALESCE(group_concat(name || ' ' || description, char(10)), '') FROM segments"
+    triggers = [
+        """
+        CREATE TRIGGER IF NOT EXISTS analyses_search_insert AFTER INSERT ON analyses BEGIN
+            INSERT INTO analysis_search (rowid, owner, textual_insights, segment_text)
+            VALUES (new.id, 'u' || new.user_id, new.textual_insights, '');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS analyses_search_update AFTER UPDATE OF user_id, textual_insights ON analyses BEGIN
+            UPDATE analysis_search SET owner = 'u' || new.user_id, textual_insights = new.textual_insights
+            WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS analyses_search_delete AFTER DELETE ON analyses BEGIN
+            DELETE FROM analysis_search WHERE rowid = old.id;
+        END
+        """,
+        # Segmentos novos são acrescentados ao texto; alterações e remoções refazem o texto da análise
+        """
+        CREATE TRIGGER IF NOT EXISTS segments_search_insert AFTER INSERT ON segments BEGIN
+            UPDATE analysis_search SET segment_text = segment_text || char(10) || new.name || ' ' || new.description
+            WHERE rowid = new.analysis_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS segments_search_update AFTER UPDATE OF analysis_id, name, description ON segments BEGIN
+            UPDATE analysis_search SET segment_text = ({segment_text} WHERE analysis_id = old.analysis_id)
+            WHERE rowid = old.analysis_id;
+            UPDATE analysis_search SET segment_text = ({segment_text} WHERE analysis_id = new.analysis_id)
+            WHERE rowid = new.analysis_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS segments_search_delete AFTER DELETE ON segments BEGIN
+            UPDATE analysis_search SET segment_text = ({segment_text} WHERE analysis_id = old.analysis_id)
+            WHERE rowid = old.analysis_id;
+        END
+        """,
+    ]
+    for trigger in triggers:
+        cursor.execute(trigger)
+
+    # Preenche o índice com as análises já existentes
+    cursor.execute(f"""
+    INSERT INTO analysis_search (rowid, owner, textual_insights, segment_text)
+    SELECT a.id, 'u' || a.user_id, a.textual_insights, ({segment_text} WHERE analysis_id = a.id)
+    FROM analyses a WHERE a.id NOT IN (SELECT rowid FROM analysis_search)
+    """)
+    print(f"{cursor.rowcount} análises adicionadas ao índice de busca.", file=sys.stderr)
+    cursor.execute("INSERT INTO analysis_search (analysis_search) VALUES ('optimize')")
+
+def _migration_superseded_states(cursor: sqlite3.Cursor):
+    """
+    O estado de uma análise incremental é descartado quando uma análise filha o
+    substitui (state_blob_hash passa a aceitar NULL); os já substituídos são descartados aqui.
+    """
+    cursor.execute("""
+    CREATE TABLE analysis_states_new (
+        analysis_id INTEGER PRIMARY KEY,
+        parent_analysis_id INTEGER,       -- análise à qual as novas transações foram somadas
+        state_blob_hash TEXT REFERENCES blobs (hash),  -- NULL depois de substituído por uma filha
+        customers INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        FOREIGN KEY (analysis_id) REFERENCES analyses (id) ON DELETE CASCADE
+    );
+    """)
+    cursor.execute(
+        "INSERT INTO analysis_states_new (analysis_id, parent_analysis_id, state_blob_hash, customers, created_at) "
+        "SELECT analysis_id, parent_analysis_id, state_blob_hash, customers, created_at FROM analysis_states"
+    )
+    cursor.execute("DROP TABLE analysis_states")
+    cursor.execute("ALTER TABLE analysis_states_new RENAME TO analysis_states")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_analysis_states_parent ON analysis_states (parent_analysis_id)"
+    )
+    cursor.execute(
+        "UPDATE analysis_states SET state_blob_hash = NULL "
+        "WHERE analysis_id IN (SELECT parent_analysis_id FROM analysis_states)"
+    )
+    # Os blobs que ficaram sem referência são removidos por collect_unreferenced_blobs no init_db
+
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _migration_history_indexes,
+    _migration_csv_blobs,
+    _migration_segmentation_jobs,
+    _migration_segment_strategies,
+    _migration_user_datasets,
+    _migration_analysis_states,
+    _migration_analysis_search,
+    _migration_superseded_states,
+]
+
+def _run_migrations(conn: sqlite3.Connection):
+    """Aplica as migrações pendentes (seguro com vários serviços iniciando juntos)."""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"Aplicando migração {number}: {migration.__name__}", file=sys.stderr)
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
 # --- NOVAS FUNÇÕES DE USUÁRIO ---
 
 def get_user_by_email(email: str) -> Optional[UserInDB]:
@@ -87,8 +370,9 @@ def get_user_by_id(user_id: int) -> Optional[User]:
         row = cursor.fetchone()
         return User(**row) if row else None
 
-def create_user(user_in: UserCreate) -> User:
-    hashed_password = auth.get_password_hash(user_in.password)
+def create_user(user_in: UserCreate, hashed_password: Optional[str] = None) -> User:
+    if hashed_password is None:
+        hashed_password = auth.get_password_hash(user_in.password)
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
@@ -99,6 +383,11 @@ def create_user(user_in: UserCreate) -> User:
         conn.commit()
         return get_user_by_id(user_id)
 
+def update_user_password_hash(user_id: int, hashed_password: str):
+    with get_db_connection() as conn:
+        conn.execute("UPDATE users SET hashed_password = ? WHERE id = ?", (hashed_password, user_id))
+        conn.commit()
+
 def update_user_profile(user_id: int, profile_data: UserProfileUpdate) -> Optional[User]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -109,26 +398,87 @@ def update_user_profile(user_id: int, profile_data: UserProfileUpdate) -> Option
         conn.commit()
         return get_user_by_id(user_id)
 
+# --- BLOBS ENDEREÇADOS POR CONTEÚDO ---
+
+def _put_blob(cursor: sqlite3.Cursor, data: bytes) -> str:
+    """Grava o conteúdo comprimido (se ainda não existir) e retorna o seu hash."""
+    blob_hash = hashlib.sha256(data).hexdigest()
+    # Gravações simultâneas do mesmo conteúdo: a primeira vence, as outras não fazem nada
+    cursor.execute(
+        "INSERT INTO blobs (hash, codec, size, data) VALUES (?, 'zlib', ?, ?) ON CONFLICT (hash) DO NOTHING",
+        (blob_hash, len(data), zlib.compress(data, BLOB_COMPRESSION_LEVEL))
+    )
+    return blob_hash
+
+def _get_blob(cursor: sqlite3.Cursor, blob_hash: str) -> Optional[bytes]:
+    row = cursor.execute("SELECT codec, data FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+    if not row:
+        return None
+    if row[0] != 'zlib':
+        raise ValueError(f"Codec de blob desconhecido: {row[0]}")
+    return zlib.decompress(row[1])
+
+def collect_unreferenced_blobs() -> int:
+    """
+    Remove os blobs que nenhuma análise (CSV) ou estado incremental referencia mais
+    (ex: análises apagadas, estados substituídos) e retorna quantos foram removidos.
+    Seguro com gravações simultâneas: o blob e a linha que o referencia são gravados
+    na mesma transação, e esta limpeza roda numa transação de escrita própria.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.execute("""
+        DELETE FROM blobs
+        WHERE hash NOT IN (SELECT csv_blob_hash FROM analyses WHERE csv_blob_hash IS NOT NULL)
+          AND hash NOT IN (SELECT state_blob_hash FROM analysis_states WHERE state_blob_hash IS NOT NULL)
+        """)
+        conn.commit()
+        return cursor.rowcount
+
+def _drop_superseded_state(cursor: sqlite3.Cursor, analysis_id: int):
+    """Descarta o estado de uma análise incremental substituída (e o blob, se ninguém mais o usa)."""
+    row = cursor.execute(
+        "SELECT state_blob_hash FROM analysis_states WHERE analysis_id = ?", (analysis_id,)
+    ).fetchone()
+    if not row or row[0] is None:
+        return
+    cursor.execute("UPDATE analysis_states SET state_blob_hash = NULL WHERE analysis_id = ?", (analysis_id,))
+    cursor.execute("""
+    DELETE FROM blobs WHERE hash = ?
+      AND NOT EXISTS (SELECT 1 FROM analyses WHERE csv_blob_hash = blobs.hash)
+      AND NOT EXISTS (SELECT 1 FROM analysis_states WHERE state_blob_hash = blobs.hash)
+    """, (row[0],))
+
 # --- FUNÇÕES DE ANÁLISE ATUALIZADAS ---
 
 def save_analysis(
     user_id: int, # NOVO PARÂMETRO
     analysis_input: MarketSegmentationInsightsInput, 
-    analysis_output: MarketSegmentationInsightsOutput
+    analysis_output: MarketSegmentationInsightsOutput,
+    state: Optional[bytes] = None,
+    customers: int = 0,
+    parent_analysis_id: Optional[int] = None
 ) -> int:
-    """Salva uma nova análise e seus segmentos no banco de dados."""
+    """
+    Salva uma nova análise e seus segmentos no banco de dados.
+    Nas análises incrementais, `state` (estado agregado de `customers` clientes) é
+    gravado na mesma transação, como blob, e o estado da análise `parent_analysis_id`,
+    que o novo contém, é descartado.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        # O CSV vai para a tabela de blobs (comprimido; cópias idênticas são reaproveitadas)
+        csv_blob_hash = _put_blob(cursor, analysis_input.clusterData.encode('utf-8'))
         
         cursor.execute("""
         INSERT INTO analyses (
-            user_id, textual_insights, original_csv_data, data_treatment_normalize, 
+            user_id, textual_insights, csv_blob_hash, original_data_snippet, data_treatment_normalize, 
             data_treatment_exclude_nulls, data_treatment_group_categories, number_of_clusters
-        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             user_id, # DADO ADICIONADO
             analysis_output.textualInsights,
-            analysis_input.clusterData,
+            csv_blob_hash,
+            _make_snippet(analysis_input.clusterData),
             analysis_input.dataTreatment.normalize,
             analysis_input.dataTreatment.excludeNulls,
             analysis_input.dataTreatment.groupCategories,
@@ -153,33 +503,206 @@ def save_analysis(
                 segment.purchase_frequency,
                 segment.description
             ))
+
+        if state is not None:
+            cursor.execute(
+                "INSERT INTO analysis_states (analysis_id, parent_analysis_id, state_blob_hash, customers, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (analysis_id, parent_analysis_id, _put_blob(cursor, state), customers, time.time())
+            )
+            if parent_analysis_id is not None:
+                _drop_superseded_state(cursor, parent_analysis_id)
             
         conn.commit()
         print(f"Análise {analysis_id} (Usuário {user_id}) salva no DB.", file=sys.stderr)
         return analysis_id
 
+def _make_snippet(csv_data: Optional[str]) -> str:
+    return (csv_data or '').split('\n', 1)[0][:SNIPPET_LENGTH] + '...'
+
+def _row_to_metadata(row: sqlite3.Row) -> AnalysisMetadata:
+    return AnalysisMetadata(
+        id=row['id'],
+        timestamp=row['timestamp'],
+        number_of_clusters=row['number_of_clusters'],
+        original_data_snippet=row['original_data_snippet'] or '...'
+    )
+
+def encode_history_cursor(timestamp: str, analysis_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp}|{analysis_id}".encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(cursor: str) -> Tuple[str, int]:
+    """Lança ValueError se o cursor for inválido."""
+    try:
+        timestamp, analysis_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return timestamp, int(analysis_id)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido.")
+
 def get_all_analyses(user_id: int) -> List[AnalysisMetadata]: # NOVO PARÂMETRO
     """Busca metadados de todas as análises salvas PARA UM USUÁRIO ESPECÍFICO."""
-    analyses: List[AnalysisMetadata] = []
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        # --- QUERY ATUALIZADA ---
+        # Usa o índice (user_id, timestamp, id) e o trecho pré-calculado, sem ler o CSV
         cursor.execute(
-            "SELECT id, timestamp, number_of_clusters, original_csv_data FROM analyses WHERE user_id = ? ORDER BY timestamp DESC",
+            "SELECT id, timestamp, number_of_clusters, original_data_snippet FROM analyses "
+            "WHERE user_id = ? ORDER BY timestamp DESC, id DESC",
             (user_id,)
         )
-        rows = cursor.fetchall()
-        
-        for row in rows:
-            # ... (código de snippet permanece igual) ...
-            snippet = (row['original_csv_data'] or '').split('\n', 1)[0][:50] + '...'
-            analyses.append(AnalysisMetadata(
-                id=row['id'],
-                timestamp=row['timestamp'],
-                number_of_clusters=row['number_of_clusters'],
-                original_data_snippet=snippet
-            ))
-    return analyses
+        return [_row_to_metadata(row) for row in cursor.fetchall()]
+
+def get_analyses_page(user_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[List[AnalysisMetadata], Optional[str]]:
+    """
+    Página do histórico com paginação por cursor (keyset): retorna as análises
+    e o cursor da próxima página (None quando não há mais itens).
+    """
+    params: List[Any] = [user_id]
+    keyset = ""
+    if cursor:
+        timestamp, analysis_id = decode_history_cursor(cursor)
+        keyset = "AND (timestamp, id) < (?, ?)"
+        params.extend([timestamp, analysis_id])
+    params.append(limit + 1)
+
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, timestamp, number_of_clusters, original_data_snippet FROM analyses "
+            f"WHERE user_id = ? {keyset} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params
+        ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return [_row_to_metadata(row) for row in rows], next_cursor
+
+def build_search_query(user_id: int, text: str) -> str:
+    """
+    Expressão MATCH do FTS5 para o texto digitado: cada palavra vira uma frase entre
+    aspas (o usuário não escreve sintaxe do FTS5), todas obrigatórias, e a última também
+    casa como prefixo. Restrita às análises do usuário. Lança ValueError sem termos.
+    """
+    terms = re.findall(r'\w+', text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise ValueError("Informe ao menos uma palavra para a busca.")
+    phrases = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= SEARCH_MIN_PREFIX_LENGTH:
+        phrases[-1] += '*'
+    return f'owner : "u{user_id}" AND ({" ".join(phrases)})'
+
+def encode_search_cursor(offset: Optional[int], analysis_id: int, min_id: int, max_id: int) -> str:
+    """`offset` None: a paginação já passou das análises ordenadas por relevância."""
+    offset_text = "" if offset is None else str(offset)
+    return base64.urlsafe_b64encode(f"{offset_text}|{analysis_id}|{min_id}|{max_id}".encode('utf-8')).decode('ascii')
+
+def decode_search_cursor(cursor: str) -> Tuple[Optional[int], int, int, int]:
+    """Lança ValueError se o cursor for inválido."""
+    try:
+        offset, analysis_id, min_id, max_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return (int(offset) if offset else None), int(analysis_id), int(min_id), int(max_id)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido.")
+
+def search_analyses(user_id: int, text: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[AnalysisSearchResult], Optional[str]]:
+    """
+    Busca textual nos insights e nos segmentos das análises do usuário, da mais para a
+    menos relevante (BM25), com paginação por cursor.
+    A ordenação roda só no índice FTS5, sobre as SEARCH_RANK_WINDOW análises mais
+    recentes encontradas; as mais antigas que isso vêm em seguida, da mais recente para
+    a mais antiga (keyset sobre o id). O intervalo de ids da janela é fixado na primeira
+    página e vai no cursor, com a posição na ordenação: análises salvas durante a
+    paginação ficam de fora. As estatísticas do BM25 são do índice inteiro (todos os
+    usuários), então a relevância muda quando outros usuários salvam análises; por isso
+    o cursor guarda a posição e não a relevância, e a paginação sempre avança (uma
+    análise na fronteira entre páginas ainda pode, raramente, trocar de página).
+    Os metadados e os trechos são lidos apenas para as análises da página.
+    """
+    match = build_search_query(user_id, text)
+    with get_db_connection() as conn:
+        if cursor:
+            offset, analysis_id, min_id, max_id = decode_search_cursor(cursor)
+        else:
+            newest = conn.execute(
+                "SELECT rowid FROM analysis_search WHERE analysis_search MATCH ? ORDER BY rowid DESC LIMIT 1", (match,)
+            ).fetchone()
+            if not newest:
+                return [], None
+            row = conn.execute(
+                "SELECT rowid FROM analysis_search WHERE analysis_search MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (match, SEARCH_RANK_WINDOW - 1)
+            ).fetchone()
+            offset, analysis_id, min_id, max_id = 0, 0, (row[0] if row else 0), newest[0]
+
+        ranked = []
+        if offset is not None:
+            ranked = conn.execute(
+                f"SELECT rowid AS id, {SEARCH_RANK} AS score FROM analysis_search "
+                f"WHERE analysis_search MATCH ? AND rowid BETWEEN ? AND ? ORDER BY score, id LIMIT ? OFFSET ?",
+                [match, min_id, max_id, limit + 1, offset]
+            ).fetchall()
+        older = []
+        if len(ranked) <= limit and min_id > 0:
+            # Fim da janela ordenada: continua pelas análises mais antigas que ela
+            older = conn.execute(
+                f"SELECT rowid AS id, {SEARCH_RANK} AS score FROM analysis_search "
+                f"WHERE analysis_search MATCH ? AND rowid < ? ORDER BY rowid DESC LIMIT ?",
+                [match, min_id if offset is not None else analysis_id, limit + 1 - len(ranked)]
+            ).fetchall()
+        next_cursor = None
+        if len(ranked) + len(older) > limit:
+            if len(ranked) >= limit:
+                ranked, older = ranked[:limit], []
+                next_cursor = encode_search_cursor(offset + limit, ranked[-1]['id'], min_id, max_id)
+            else:
+                older = older[:limit - len(ranked)]
+                next_cursor = encode_search_cursor(None, older[-1]['id'], min_id, max_id)
+        ranked += older
+        if not ranked:
+            return [], None
+
+        # Trechos e metadados da página numa única varredura do índice (limitada ao
+        # intervalo de ids da página): buscas por prefixo refazem a lista de documentos
+        # a cada varredura, o que pesaria se cada análise fosse buscada pelo rowid
+        ids = [row['id'] for row in ranked]
+        placeholders = ", ".join("?" * len(ids))
+        page = {row['id']: row for row in conn.execute(f"""
+        SELECT a.id, a.timestamp, a.number_of_clusters, a.original_data_snippet,
+               snippet(analysis_search, 1, '**', '**', '...', {SEARCH_SNIPPET_TOKENS}) AS insights_snippet,
+               snippet(analysis_search, 2, '**', '**', '...', {SEARCH_SNIPPET_TOKENS}) AS segments_snippet
+        FROM analysis_search JOIN analyses a ON a.id = analysis_search.rowid
+        WHERE analysis_search MATCH ? AND analysis_search.rowid BETWEEN ? AND ?
+          AND +analysis_search.rowid IN ({placeholders}) AND a.user_id = ?
+        """, [match, min(ids), max(ids), *ids, user_id])}
+
+    results = []
+    for row in ranked:
+        metadata = page.get(row['id'])
+        if metadata is None:
+            continue  # removida entre as duas consultas
+        # Trecho dos insights, ou dos segmentos quando os termos só aparecem neles
+        snippet = metadata['insights_snippet']
+        if '**' not in snippet:
+            snippet = metadata['segments_snippet']
+        results.append(AnalysisSearchResult(
+            **_row_to_metadata(metadata).model_dump(), score=row['score'], snippet=snippet
+        ))
+    return results, next_cursor
+
+def get_analysis_csv_data(analysis_id: int, user_id: int) -> Optional[str]:
+    """Retorna o CSV agregado original de uma análise, descomprimindo-o somente aqui."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        row = cursor.execute(
+            "SELECT original_csv_data, csv_blob_hash FROM analyses WHERE id = ? AND user_id = ?",
+            (analysis_id, user_id)
+        ).fetchone()
+        if not row:
+            return None
+        if row['csv_blob_hash']:
+            data = _get_blob(cursor, row['csv_blob_hash'])
+            return data.decode('utf-8') if data is not None else None
+        return row['original_csv_data']
 
 def get_analysis_by_id(analysis_id: int, user_id: int) -> Optional[MarketSegmentationInsightsOutput]: # NOVO PARÂMETRO
     """Busca uma análise completa pelo seu ID, VERIFICANDO O DONO."""
@@ -213,4 +736,268 @@ def get_analysis_by_id(analysis_id: int, user_id: int) -> Optional[MarketSegment
         analysis_data["segments"] = segments_list
         return MarketSegmentationInsightsOutput(**analysis_data)
     
-    return None
\ No newline at end of file
+    return None
+
+def get_analysis_state(analysis_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Estado incremental de uma análise do usuário, com os parâmetros da análise
+    (tratamentos e número de clusters). None se a análise não existir, não for do
+    usuário ou não tiver estado salvo. Se o estado já foi substituído por uma análise
+    filha, "state" é None e "superseded_by" traz o id da filha mais recente.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        row = cursor.execute(
+            "SELECT s.state_blob_hash, s.customers, a.number_of_clusters, a.data_treatment_normalize, "
+            "a.data_treatment_exclude_nulls, a.data_treatment_group_categories "
+            "FROM analysis_states s JOIN analyses a ON a.id = s.analysis_id "
+            "WHERE s.analysis_id = ? AND a.user_id = ?",
+            (analysis_id, user_id)
+        ).fetchone()
+        if not row:
+            return None
+        state, superseded_by = None, None
+        if row['state_blob_hash'] is not None:
+            state = _get_blob(cursor, row['state_blob_hash'])
+            if state is None:
+                return None
+        else:
+            child = cursor.execute(
+                "SELECT MAX(analysis_id) FROM analysis_states WHERE parent_analysis_id = ?", (analysis_id,)
+            ).fetchone()
+            superseded_by = child[0]
+    return {
+        "state": state,
+        "superseded_by": superseded_by,
+        "customers": row['customers'],
+        "number_of_clusters": row['number_of_clusters'],
+        "normalize": bool(row['data_treatment_normalize']),
+        "excludeNulls": bool(row['data_treatment_exclude_nulls']),
+        "groupCategories": bool(row['data_treatment_group_categories']),
+    }
+
+# --- EXPORTAÇÃO ---
+
+def iter_analysis_export_rows(
+    user_id: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    batch_rows: int = EXPORT_BATCH_ROWS
+) -> Iterator[sqlite3.Row]:
+    """
+    Uma linha por segmento (com os campos da análise; análises sem segmentos vêm com
+    os campos do segmento nulos), em ordem de data e id. `since` (inclusivo) e `until`
+    (exclusivo) no formato do timestamp ('AAAA-MM-DD HH:MM:SS'); user_id None = todos.
+    Lê o cursor em lotes numa conexão dedicada: a memória não cresce com o histórico
+    e o gerador pode ser consumido aos poucos, de threads diferentes.
+    """
+    conditions: List[str] = []
+    params: List[Any] = []
+    if user_id is not None:
+        conditions.append("a.user_id = ?")
+        params.append(user_id)
+    if since is not None:
+        conditions.append("a.timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("a.timestamp < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = _pool.open_connection()
+    try:
+        cursor = conn.execute(
+            "SELECT a.id AS analysis_id, a.user_id, a.timestamp, a.number_of_clusters, "
+            "a.data_treatment_normalize, a.data_treatment_exclude_nulls, a.data_treatment_group_categories, "
+            "a.textual_insights, s.name AS segment_name, s.size AS segment_size, s.avg_purchase_value, "
+            "s.purchase_frequency, s.description AS segment_description "
+            f"FROM analyses a LEFT JOIN segments s ON s.analysis_id = a.id {where} "
+            "ORDER BY a.timestamp, a.id, s.id",
+            params
+        )
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+# --- ESTRATÉGIAS POR SEGMENTO ---
+
+def save_segment_strategies(analysis_id: int, campaign_objectives: str, results: List[SegmentStrategies]):
+    """Grava (substituindo as anteriores) as estratégias de cada segmento da análise."""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO segment_strategies "
+            "(analysis_id, segment_index, segment_name, campaign_objectives, strategies, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (analysis_id, index, result.segmentName, campaign_objectives,
+                 json.dumps(result.marketingStrategies, ensure_ascii=False), now)
+                for index, result in enumerate(results)
+            ]
+        )
+        conn.execute(
+            "DELETE FROM segment_strategies WHERE analysis_id = ? AND segment_index >= ?",
+            (analysis_id, len(results))
+        )
+    print(f"Estratégias de {len(results)} segmentos da análise {analysis_id} salvas no DB.", file=sys.stderr)
+
+def get_segment_strategies(analysis_id: int, user_id: int) -> Optional[BatchMarketingStrategiesOutput]:
+    """Estratégias salvas para a análise (None se não houver ou se a análise não for do usuário)."""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT s.segment_name, s.campaign_objectives, s.strategies FROM segment_strategies s "
+            "JOIN analyses a ON a.id = s.analysis_id "
+            "WHERE s.analysis_id = ? AND a.user_id = ? ORDER BY s.segment_index",
+            (analysis_id, user_id)
+        ).fetchall()
+    if not rows:
+        return None
+    return BatchMarketingStrategiesOutput(
+        analysisId=analysis_id,
+        campaignObjectives=rows[0]["campaign_objectives"],
+        segments=[
+            SegmentStrategies(segmentName=row["segment_name"], marketingStrategies=json.loads(row["strategies"]))
+            for row in rows
+        ]
+    )
+
+# --- DATASETS ---
+
+def register_user_dataset(user_id: int, dataset_id: str, customers: int):
+    """Associa o dataset ao usuário (ou atualiza o último uso, se já associado)."""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO user_datasets (user_id, dataset_id, customers, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id, dataset_id) DO UPDATE SET last_used_at = excluded.last_used_at, "
+            "customers = excluded.customers",
+            (user_id, dataset_id, customers, now, now)
+        )
+
+def user_has_dataset(user_id: int, dataset_id: str) -> bool:
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM user_datasets WHERE user_id = ? AND dataset_id = ?", (user_id, dataset_id)
+        ).fetchone()
+    return row is not None
+
+def get_user_datasets(user_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Datasets do usuário, do usado mais recentemente para o mais antigo."""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT dataset_id, customers, created_at, last_used_at FROM user_datasets "
+            "WHERE user_id = ? ORDER BY last_used_at DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+# --- JOBS DE SEGMENTAÇÃO ---
+
+JOB_TERMINAL_STATUSES = ('succeeded', 'failed')
+
+def create_segmentation_job(user_id: int, params: Dict[str, Any], input_path: str) -> str:
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO segmentation_jobs (id, user_id, status, stage, params, input_path, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', 'queued', ?, ?, ?, ?)",
+            (job_id, user_id, json.dumps(params), input_path, now, now)
+        )
+        conn.commit()
+    return job_id
+
+def claim_segmentation_job(worker_id: str, stale_seconds: float, max_attempts: int) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Reserva o job mais antigo da fila para este worker. Jobs 'running' sem heartbeat
+    recente (worker reiniciado ou morto) voltam para a fila antes da reserva.
+    Retorna (job ou None, arquivos de entrada dos jobs que falharam por excederem
+    max_attempts): quem chama remove esses arquivos.
+    """
+    now = time.time()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            "UPDATE segmentation_jobs SET status = 'queued', stage = 'queued', progress = 0, locked_by = NULL, updated_at = ? "
+            "WHERE status = 'running' AND heartbeat_at < ?",
+            (now, now - stale_seconds)
+        )
+        abandoned_inputs: List[str] = []
+        while True:
+            row = cursor.execute(
+                "SELECT * FROM segmentation_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return None, abandoned_inputs
+            if row['attempts'] >= max_attempts:
+                cursor.execute(
+                    "UPDATE segmentation_jobs SET status = 'failed', stage = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                    ("Número máximo de tentativas excedido.", now, row['id'])
+                )
+                abandoned_inputs.append(row['input_path'])
+                continue
+            cursor.execute(
+                "UPDATE segmentation_jobs SET status = 'running', stage = 'starting', locked_by = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now, now, row['id'])
+            )
+            conn.commit()
+            job = dict(row)
+            job['params'] = json.loads(job['params'])
+            return job, abandoned_inputs
+    except Exception:
+        conn.rollback()
+        raise
+
+def update_segmentation_job_progress(job_id: str, worker_id: str, stage: str, progress: float):
+    """Atualiza a etapa do job; também serve de heartbeat do worker."""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE segmentation_jobs SET stage = ?, progress = ?, heartbeat_at = ?, updated_at = ? "
+            "WHERE id = ? AND locked_by = ?",
+            (stage, progress, now, now, job_id, worker_id)
+        )
+        conn.commit()
+
+def heartbeat_segmentation_job(job_id: str, worker_id: str):
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE segmentation_jobs SET heartbeat_at = ? WHERE id = ? AND locked_by = ?",
+            (time.time(), job_id, worker_id)
+        )
+        conn.commit()
+
+def finish_segmentation_job(job_id: str, worker_id: str, analysis_id: Optional[int] = None,
+                            result: Optional[str] = None, error: Optional[str] = None) -> bool:
+    """
+    Marca o job como concluído (com result) ou com falha (com error). Retorna False se
+    o worker já não detinha o job (ex: heartbeat expirou e outro worker o assumiu).
+    """
+    now = time.time()
+    status = 'failed' if error is not None else 'succeeded'
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE segmentation_jobs SET status = ?, stage = ?, progress = ?, analysis_id = ?, result = ?, "
+            "error = ?, locked_by = NULL, updated_at = ? WHERE id = ? AND locked_by = ?",
+            (status, status, 1.0 if error is None else 0.0, analysis_id, result, error, now, job_id, worker_id)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+def get_segmentation_job(job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT id, status, stage, progress, analysis_id, result, error, created_at, updated_at "
+            "FROM segmentation_jobs WHERE id = ? AND user_id = ?",
+            (job_id, user_id)
+        ).fetchone()
+    return dict(row) if row else None
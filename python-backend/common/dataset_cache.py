@@ -0,0 +1,179 @@
+# python-backend/common/dataset_cache.py
+
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pyarrow é opcional: sem ele o cache fica desligado
+    pa = None
+    pa_ipc = None
+
+from common.ingestion import FEATURES_VERSION
+from common.metrics import REGISTRY
+
+# --- Configuração do Cache de Datasets ---
+# Tabelas de clientes já agregadas, guardadas em disco (Arrow IPC) e reaproveitadas
+# quando o mesmo arquivo é enviado de novo ou reanalisado pelo datasetId
+DATASET_CACHE_ENABLED = os.getenv("DATASET_CACHE_ENABLED", "1") == "1"
+DATASET_CACHE_DIR = os.getenv(
+    "DATASET_CACHE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'dataset_cache'))
+)
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+DATASET_FILE_SUFFIX = ".arrow"
+DATASET_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+DATASET_CACHE_LOOKUPS = REGISTRY.counter(
+    "dataset_cache_lookups_total", "Consultas ao cache de tabelas agregadas por resultado.", ("result",))
+DATASET_CACHE_EVICTIONS = REGISTRY.counter(
+    "dataset_cache_evictions_total", "Tabelas agregadas removidas do cache pelo limite de tamanho.")
+
+
+def new_dataset_hasher():
+    """
+    Hash do conteúdo do upload, alimentado bloco a bloco. A versão da engenharia de
+    features entra no hash: mudar a agregação invalida as tabelas antigas.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"features-v{FEATURES_VERSION}\0".encode('utf-8'))
+    return hasher
+
+
+def dataset_id_for_file(path: str, block_bytes: int = 1024 * 1024) -> str:
+    hasher = new_dataset_hasher()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def is_valid_dataset_id(dataset_id: str) -> bool:
+    return bool(DATASET_ID_PATTERN.match(dataset_id))
+
+
+class DatasetCache:
+    """
+    Cache em disco das tabelas agregadas por cliente, uma por arquivo Arrow IPC
+    (sem compressão). As leituras usam memory map: vários workers do uvicorn
+    compartilham as mesmas páginas do page cache do sistema, sem cópias por processo.
+    O tamanho total é limitado, removendo primeiro as tabelas usadas há mais tempo
+    (o mtime do arquivo é atualizado a cada acerto).
+    """
+
+    def __init__(self, directory: str = DATASET_CACHE_DIR, max_bytes: int = DATASET_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return DATASET_CACHE_ENABLED and pa is not None
+
+    def _path(self, dataset_id: str) -> str:
+        if not is_valid_dataset_id(dataset_id):
+            raise ValueError(f"datasetId inválido: {dataset_id}")
+        return os.path.join(self.directory, dataset_id + DATASET_FILE_SUFFIX)
+
+    def contains(self, dataset_id: str) -> bool:
+        return self.enabled and is_valid_dataset_id(dataset_id) and os.path.exists(self._path(dataset_id))
+
+    def get(self, dataset_id: str) -> Optional[pd.DataFrame]:
+        """Tabela agregada do dataset, ou None se não estiver no cache."""
+        if not self.enabled:
+            return None
+        path = self._path(dataset_id)
+        try:
+            # Sem `with`: os buffers da tabela continuam apontando para o mapeamento
+            source = pa.memory_map(path, 'r')
+            table = pa_ipc.open_file(source).read_all()
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("miss")
+            return None
+        except (OSError, pa.ArrowInvalid) as e:
+            print(f"Cache de datasets: arquivo ilegível {path} ({e}), descartando.", file=sys.stderr)
+            self._remove(path)
+            self._count("miss")
+            return None
+        self._count("hit")
+        # split_blocks evita consolidar as colunas numa nova cópia
+        return table.to_pandas(split_blocks=True)
+
+    def put(self, dataset_id: str, customer_df: pd.DataFrame):
+        """Grava a tabela (escrita atômica: arquivo temporário + rename) e aplica o limite de tamanho."""
+        if not self.enabled:
+            return
+        path = self._path(dataset_id)
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pandas(customer_df, preserve_index=False)
+        fd, tmp_path = tempfile.mkstemp(prefix='dataset_', suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink, pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self._evict(keep=path)
+
+    def _evict(self, keep: str):
+        """Remove as tabelas menos usadas até o total caber em max_bytes."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(DATASET_FILE_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                # Leitores com a tabela mapeada continuam válidos após a remoção (Linux)
+                self._remove(path)
+                total -= size
+                self.evictions += 1
+                DATASET_CACHE_EVICTIONS.inc()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _count(self, result: str):
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            else:
+                self.misses += 1
+        DATASET_CACHE_LOOKUPS.inc(result=result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+dataset_cache = DatasetCache()
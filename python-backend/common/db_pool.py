@@ -0,0 +1,109 @@
+# python-backend/common/db_pool.py
+
+import os
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict
+
+# --- Configuração das Conexões SQLite ---
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Valor negativo = tamanho em KiB (convenção do PRAGMA cache_size)
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16384"))
+
+
+class ConnectionPool:
+    """
+    Mantém uma conexão SQLite por thread e a reutiliza entre as consultas.
+    As conexões são criadas já configuradas (WAL, synchronous=NORMAL, busy timeout,
+    mmap, cache e chaves estrangeiras). Após um fork (ex: workers com preload)
+    o processo filho descarta as conexões herdadas e abre novas.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        # Conexões abertas por thread (ident), para fechar as de threads encerradas
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._created = 0
+        self._reused = 0
+
+    def _configure(self, conn: sqlite3.Connection):
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+        conn.execute("PRAGMA foreign_keys=ON")
+
+    def connection(self) -> sqlite3.Connection:
+        """Retorna a conexão da thread atual, criando-a se necessário."""
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                self._reused += 1
+            return conn
+
+        # check_same_thread=False apenas para permitir o close_all() a partir de outra thread;
+        # cada conexão continua sendo usada somente pela sua própria thread
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        self._configure(conn)
+        self._local.conn = conn
+        with self._lock:
+            self._created += 1
+            self._prune_dead_threads()
+            self._connections[threading.get_ident()] = conn
+        return conn
+
+    def open_connection(self) -> sqlite3.Connection:
+        """
+        Conexão avulsa, fora do pool e somente leitura (PRAGMA query_only), com a mesma
+        configuração. Usada por leituras longas consumidas aos poucos, possivelmente de
+        threads diferentes (ex: exportações); quem abre é responsável por fechar.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        self._configure(conn)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _prune_dead_threads(self):
+        """Fecha as conexões de threads que já terminaram (chamado com o lock adquirido)."""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            try:
+                self._connections.pop(ident).close()
+            except sqlite3.Error as e:
+                print(f"Erro ao fechar conexão SQLite: {e}", file=sys.stderr)
+
+    def close_all(self):
+        """Fecha todas as conexões abertas (ex: no shutdown do serviço)."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._reset()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Erro ao fechar conexão SQLite: {e}", file=sys.stderr)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune_dead_threads()
+            return {
+                "db_path": self.db_path,
+                "open_connections": len(self._connections),
+                "connections_created": self._created,
+                "connections_reused": self._reused,
+            }
@@ -0,0 +1,214 @@
+# python-backend/common/export.py
+
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pa_parquet
+except ImportError:  # pyarrow é opcional: sem ele a exportação em Parquet fica indisponível
+    pa = None
+    pa_parquet = None
+
+from common import database
+
+# --- Configuração das Exportações ---
+# Este módulo não importa pandas: as linhas vêm direto do cursor do SQLite.
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+# Linhas por row group do Parquet (cada row group é enviado assim que fica completo)
+PARQUET_ROW_GROUP_ROWS = 10000
+
+ANALYSIS_COLUMNS = [
+    'analysis_id', 'user_id', 'timestamp', 'number_of_clusters', 'data_treatment_normalize',
+    'data_treatment_exclude_nulls', 'data_treatment_group_categories', 'textual_insights',
+]
+SEGMENT_COLUMNS = [
+    'segment_name', 'segment_size', 'avg_purchase_value', 'purchase_frequency', 'segment_description',
+]
+EXPORT_COLUMNS = ANALYSIS_COLUMNS + ['segment_index'] + SEGMENT_COLUMNS
+BOOLEAN_COLUMNS = ('data_treatment_normalize', 'data_treatment_exclude_nulls', 'data_treatment_group_categories')
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_export_timestamp(value: Optional[str]) -> Optional[str]:
+    """Data ou data/hora ISO 8601 no formato do timestamp das análises (UTC). Lança ValueError."""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Data inválida: {value!r} (use AAAA-MM-DD ou AAAA-MM-DDTHH:MM:SS).")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime(TIMESTAMP_FORMAT)
+
+
+def is_format_available(export_format: str) -> bool:
+    return export_format in EXPORT_MEDIA_TYPES and (export_format != "parquet" or pa_parquet is not None)
+
+
+def _flat_rows(rows: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+    """Linhas do banco como dicionários, com booleanos e a posição do segmento na análise."""
+    current_id = None
+    index = 0
+    for row in rows:
+        record = dict(row)
+        for column in BOOLEAN_COLUMNS:
+            if record[column] is not None:
+                record[column] = bool(record[column])
+        if record['analysis_id'] != current_id:
+            current_id = record['analysis_id']
+            index = 0
+        if record['segment_name'] is None:
+            record['segment_index'] = None
+        else:
+            record['segment_index'] = index
+            index += 1
+        yield record
+
+
+def export_ndjson(rows: Iterable[Any]) -> Iterator[bytes]:
+    """Uma linha JSON por análise, com os seus segmentos aninhados."""
+    analysis: Optional[Dict[str, Any]] = None
+    for record in _flat_rows(rows):
+        if analysis is None or analysis['analysis_id'] != record['analysis_id']:
+            if analysis is not None:
+                yield (json.dumps(analysis, ensure_ascii=False) + "\n").encode('utf-8')
+            analysis = {column: record[column] for column in ANALYSIS_COLUMNS}
+            analysis['segments'] = []
+        if record['segment_index'] is not None:
+            analysis['segments'].append({column: record[column] for column in SEGMENT_COLUMNS})
+    if analysis is not None:
+        yield (json.dumps(analysis, ensure_ascii=False) + "\n").encode('utf-8')
+
+
+def export_csv(rows: Iterable[Any], batch_rows: int = database.EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """Uma linha por segmento (campos da análise repetidos), em blocos de `batch_rows` linhas."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, delimiter=';', lineterminator='\n')
+    writer.writeheader()
+    pending = 0
+    for record in _flat_rows(rows):
+        writer.writerow(record)
+        pending += 1
+        if pending >= batch_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Destino do ParquetWriter que guarda os bytes escritos até serem enviados."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        ('analysis_id', pa.int64()),
+        ('user_id', pa.int64()),
+        ('timestamp', pa.string()),
+        ('number_of_clusters', pa.int64()),
+        ('data_treatment_normalize', pa.bool_()),
+        ('data_treatment_exclude_nulls', pa.bool_()),
+        ('data_treatment_group_categories', pa.bool_()),
+        ('textual_insights', pa.string()),
+        ('segment_index', pa.int64()),
+        ('segment_name', pa.string()),
+        ('segment_size', pa.int64()),
+        ('avg_purchase_value', pa.float64()),
+        ('purchase_frequency', pa.float64()),
+        ('segment_description', pa.string()),
+    ])
+
+
+def export_parquet(rows: Iterable[Any], row_group_rows: int = PARQUET_ROW_GROUP_ROWS) -> Iterator[bytes]:
+    """Mesmas colunas do CSV; cada row group é enviado assim que fica completo (o rodapé no fim)."""
+    if pa_parquet is None:
+        raise RuntimeError("A exportação em Parquet requer o pyarrow.")
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pa_parquet.ParquetWriter(sink, schema)
+    try:
+        batch: List[Dict[str, Any]] = []
+        for record in _flat_rows(rows):
+            batch.append(record)
+            if len(batch) >= row_group_rows:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+                yield sink.drain()
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+EXPORTERS = {
+    "ndjson": export_ndjson,
+    "csv": export_csv,
+    "parquet": export_parquet,
+}
+
+
+def export_analyses(export_format: str, user_id: Optional[int] = None,
+                    since: Optional[str] = None, until: Optional[str] = None) -> Iterator[bytes]:
+    """Gerador com o conteúdo exportado, em pedaços (a leitura do banco acontece durante a iteração)."""
+    rows = database.iter_analysis_export_rows(user_id, since, until)
+    return EXPORTERS[export_format](rows)
+
+
+if __name__ == "__main__":
+    # Uso: python -m common.export --format parquet --since 2024-01-01 --output analises.parquet
+    parser = argparse.ArgumentParser(description="Exporta as análises e os segmentos salvos.")
+    parser.add_argument("--format", choices=sorted(EXPORTERS), default="ndjson")
+    parser.add_argument("--user-id", type=int, default=None, help="Somente as análises deste usuário (padrão: todos).")
+    parser.add_argument("--since", default=None, help="Data inicial, inclusiva (ISO 8601, UTC).")
+    parser.add_argument("--until", default=None, help="Data final, exclusiva (ISO 8601, UTC).")
+    parser.add_argument("--output", default="-", help="Arquivo de saída (padrão: stdout).")
+    args = parser.parse_args()
+
+    if not is_format_available(args.format):
+        parser.error("A exportação em Parquet requer o pyarrow.")
+    try:
+        since, until = parse_export_timestamp(args.since), parse_export_timestamp(args.until)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, 'wb')
+    try:
+        for chunk in export_analyses(args.format, args.user_id, since, until):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
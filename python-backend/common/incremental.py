@@ -0,0 +1,137 @@
+# python-backend/common/incremental.py
+
+import io
+import os
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common.clustering import ClusteringResult, raw_centroids
+from common.ingestion import CustomerAggregator, invoice_pair_keys
+from common.metrics import REGISTRY
+
+# --- Configuração das Análises Incrementais ---
+# Versão do formato do estado salvo com cada análise incremental
+# (1: pares cliente/nota completos; 2: contagens por cliente e hash dos pares)
+STATE_FORMAT_VERSION = 2
+# A IA só é chamada de novo quando a composição dos segmentos muda: a participação
+# de algum segmento varia mais que este limite (0.05 = 5 pontos percentuais)...
+SEGMENT_SHARE_SHIFT_THRESHOLD = float(os.getenv("INCREMENTAL_SHARE_SHIFT_THRESHOLD", "0.05"))
+# ... ou mais que esta fração dos clientes já conhecidos muda de segmento
+SEGMENT_MIGRATION_THRESHOLD = float(os.getenv("INCREMENTAL_MIGRATION_THRESHOLD", "0.10"))
+
+INCREMENTAL_ANALYSES = REGISTRY.counter(
+    "incremental_analyses_total", "Análises incrementais por uso da IA (invoked ou reused).", ("llm",))
+
+
+class IncrementalStateError(ValueError):
+    """Estado incremental ilegível ou de uma versão incompatível."""
+
+
+class ClusterModel(NamedTuple):
+    centroids: np.ndarray            # k x features, nas unidades originais (ver raw_centroids)
+    shares: np.ndarray               # participação de cada cluster nos clientes clusterizados
+    labels: pd.Series                # cluster de cada cliente (índice CustomerID; -1 = fora da clusterização)
+
+
+class CompositionShift(NamedTuple):
+    share_shift: float               # maior variação da participação de um segmento
+    migrated_share: float            # fração dos clientes já conhecidos que mudou de segmento
+
+    @property
+    def shifted(self) -> bool:
+        return (self.share_shift > SEGMENT_SHARE_SHIFT_THRESHOLD
+                or self.migrated_share > SEGMENT_MIGRATION_THRESHOLD)
+
+
+def _customer_labels(clustering: ClusteringResult) -> pd.Series:
+    return pd.Series(clustering.labels, index=clustering.customers['CustomerID'].to_numpy())
+
+
+def dump_state(aggregator: CustomerAggregator, clustering: ClusteringResult) -> bytes:
+    """
+    Serializa o estado da análise (arquivo .npz, sem pickle): somas e notas distintas
+    por cliente, o hash ordenado dos pares (cliente, nota) já vistos, que é só o que a
+    próxima soma precisa para não contar uma nota duas vezes, e o modelo de clusters.
+    """
+    totals, frequency, pair_keys = aggregator.state()
+    if totals is None:
+        raise IncrementalStateError("Não há clientes para salvar no estado incremental.")
+    k = len(clustering.centroids)
+    labels = _customer_labels(clustering).reindex(totals.index, fill_value=-1).to_numpy(np.int32)
+    pais = totals['Pais'].astype('category')
+
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        version=np.array([STATE_FORMAT_VERSION]),
+        customer_id=totals.index.to_numpy(np.float64),
+        total_gasto=totals['TotalGasto'].to_numpy(np.float64),
+        total_itens=totals['TotalItens'].to_numpy(np.float64),
+        pais_codes=pais.cat.codes.to_numpy(np.int32),
+        pais_categories=np.array(pais.cat.categories, dtype=str),
+        frequencia=frequency.reindex(totals.index, fill_value=0).to_numpy(np.int64),
+        pair_key=pair_keys,
+        centroids=raw_centroids(clustering),
+        shares=np.bincount(clustering.labels, minlength=k) / len(clustering.labels),
+        labels=labels,
+        customer_id_nulls=np.array([aggregator.customer_id_nulls]),
+    )
+    return buffer.getvalue()
+
+
+def _pairs_from_v1(invoice_customer: np.ndarray, invoice_key: np.ndarray, index: pd.Index):
+    """Contagens por cliente e hash ordenado dos pares a partir dos pares completos do formato 1."""
+    pair_keys = np.unique(invoice_pair_keys(invoice_customer, invoice_key))
+    frequency = pd.DataFrame({'CustomerID': invoice_customer, 'InvoiceKey': invoice_key}).groupby(
+        'CustomerID')['InvoiceKey'].nunique().reindex(index, fill_value=0)
+    return frequency, pair_keys
+
+
+def load_state(data: bytes) -> Tuple[CustomerAggregator, ClusterModel]:
+    """Recria o agregador (pronto para receber novas transações) e o modelo de clusters salvos."""
+    try:
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            version = int(arrays['version'][0])
+            if version not in (1, STATE_FORMAT_VERSION):
+                raise IncrementalStateError(f"Versão do estado incremental não suportada: {version}")
+            index = pd.Index(arrays['customer_id'], name='CustomerID')
+            pais = pd.Categorical.from_codes(arrays['pais_codes'], categories=arrays['pais_categories'])
+            totals = pd.DataFrame({
+                'TotalGasto': arrays['total_gasto'],
+                'TotalItens': arrays['total_itens'],
+                'Pais': pd.Series(pais, index=index).astype(pais.categories.dtype),
+            }, index=index)
+            if version == 1:
+                frequency, pair_keys = _pairs_from_v1(arrays['invoice_customer'], arrays['invoice_key'], index)
+            else:
+                frequency = pd.Series(arrays['frequencia'], index=index)
+                pair_keys = arrays['pair_key']
+            model = ClusterModel(
+                centroids=arrays['centroids'],
+                shares=arrays['shares'],
+                labels=pd.Series(arrays['labels'], index=index),
+            )
+            # Estados anteriores a este campo: CustomerID era sempre float na saída
+            customer_id_nulls = bool(arrays['customer_id_nulls'][0]) if 'customer_id_nulls' in arrays.files else True
+    except (OSError, KeyError, ValueError) as e:
+        if isinstance(e, IncrementalStateError):
+            raise
+        raise IncrementalStateError(f"Estado incremental ilegível: {e}")
+    aggregator = CustomerAggregator.from_state(totals, frequency, pair_keys)
+    aggregator.customer_id_nulls = customer_id_nulls
+    return aggregator, model
+
+
+def composition_shift(previous: ClusterModel, clustering: ClusteringResult) -> CompositionShift:
+    """Compara os segmentos refeitos com os da análise anterior (mesma numeração, ver cluster_customers)."""
+    shares = np.bincount(clustering.labels, minlength=len(previous.shares)) / len(clustering.labels)
+    share_shift = float(np.abs(shares - previous.shares).max())
+
+    known = previous.labels[previous.labels >= 0]
+    current = _customer_labels(clustering).reindex(known.index)
+    still_clustered = current.notna().to_numpy()
+    migrated = current.to_numpy()[still_clustered] != known.to_numpy()[still_clustered]
+    migrated_share = float(migrated.mean()) if len(migrated) else 0.0
+    return CompositionShift(share_shift=round(share_shift, 4), migrated_share=round(migrated_share, 4))
@@ -0,0 +1,345 @@
+# python-backend/common/ingestion.py
+
+import os
+import sys
+from typing import IO, Callable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow é opcional: sem ele, o parser tipado do pandas é usado
+    pa = None
+    pa_csv = None
+
+# --- Configuração da Ingestão de CSV ---
+CSV_DELIMITER = ';'
+CSV_ENCODING = 'utf-8'
+CSV_DECIMAL = ','
+# "auto" (pyarrow se instalado, senão pandas tipado), "pyarrow", "pandas" ou "legacy"
+# (todas as colunas com tipos inferidos, conversão de UnitPrice como texto)
+CSV_PARSER = os.getenv("CSV_PARSER", "auto")
+
+# Número de linhas lidas por vez no modo de streaming (parser do pandas)
+STREAMING_CHUNK_ROWS = int(os.getenv("CSV_STREAMING_CHUNK_ROWS", "200000"))
+# Tamanho dos blocos lidos por vez no modo de streaming (parser do pyarrow)
+STREAMING_BLOCK_BYTES = int(os.getenv("CSV_STREAMING_BLOCK_BYTES", str(16 * 1024 * 1024)))
+
+AGGREGATED_COLUMNS = ['CustomerID', 'TotalGasto', 'Frequencia', 'TotalItens', 'Pais']
+# Versão da engenharia de features: altere quando a agregação mudar
+# (as tabelas agregadas guardadas no cache de datasets deixam de ser usadas)
+FEATURES_VERSION = 2
+
+# Únicas colunas usadas na agregação, com os tipos declarados (o resto do arquivo não é lido).
+# CustomerID é lido como float por causa dos clientes sem ID (nulos); na saída volta a
+# ser inteiro quando o arquivo não tem IDs vazios, como na inferência do pandas
+# (ver _restore_customer_ids).
+TRANSACTION_DTYPES = {
+    'InvoiceNo': 'string',
+    'Quantity': 'int64',
+    'UnitPrice': 'float64',
+    'CustomerID': 'float64',
+    'Country': 'category',
+}
+
+CsvSource = Union[str, IO[bytes]]
+
+
+def _parser() -> str:
+    if CSV_PARSER == "auto":
+        return "pyarrow" if pa_csv is not None else "pandas"
+    if CSV_PARSER == "pyarrow" and pa_csv is None:
+        print("CSV_PARSER=pyarrow, mas o pyarrow não está instalado; usando o parser do pandas.", file=sys.stderr)
+        return "pandas"
+    return CSV_PARSER
+
+
+def _arrow_options():
+    column_types = {
+        'InvoiceNo': pa.string(),
+        'Quantity': pa.int64(),
+        'UnitPrice': pa.float64(),
+        'CustomerID': pa.float64(),
+        # Dicionário: vira uma coluna categórica no pandas
+        'Country': pa.dictionary(pa.int32(), pa.string()),
+    }
+    parse_options = pa_csv.ParseOptions(delimiter=CSV_DELIMITER)
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=list(TRANSACTION_DTYPES),
+        column_types=column_types,
+        decimal_point=CSV_DECIMAL,
+        strings_can_be_null=True,
+    )
+    return parse_options, convert_options
+
+
+def _rewind(source: CsvSource):
+    if not isinstance(source, str):
+        source.seek(0)
+
+
+def _read_legacy(source: CsvSource, **kwargs):
+    return pd.read_csv(source, delimiter=CSV_DELIMITER, encoding=CSV_ENCODING, **kwargs)
+
+
+def _read_typed_pandas(source: CsvSource, **kwargs):
+    return pd.read_csv(
+        source, delimiter=CSV_DELIMITER, encoding=CSV_ENCODING, decimal=CSV_DECIMAL,
+        usecols=list(TRANSACTION_DTYPES), dtype=TRANSACTION_DTYPES, **kwargs
+    )
+
+
+def read_transactions(source: CsvSource) -> pd.DataFrame:
+    """
+    Lê o CSV de transações (caminho ou arquivo binário) apenas com as colunas usadas,
+    tipos declarados e vírgula decimal interpretada pelo parser.
+    Arquivos fora desse formato (ex: ponto decimal, quantidades vazias) são lidos
+    novamente pelo caminho antigo, com tipos inferidos.
+    """
+    parser = _parser()
+    if parser != "legacy":
+        try:
+            if parser == "pyarrow":
+                parse_options, convert_options = _arrow_options()
+                table = pa_csv.read_csv(source, parse_options=parse_options, convert_options=convert_options)
+                return table.to_pandas()
+            return _read_typed_pandas(source)
+        except (ValueError, KeyError, TypeError) as e:
+            # ArrowInvalid e ArrowKeyError herdam de ValueError e KeyError
+            print(f"Leitura tipada do CSV falhou ({parser}: {e}); usando a leitura com tipos inferidos.", file=sys.stderr)
+            _rewind(source)
+    return _read_legacy(source)
+
+
+def _iter_typed_chunks(path: str, parser: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    if parser == "pyarrow":
+        parse_options, convert_options = _arrow_options()
+        read_options = pa_csv.ReadOptions(block_size=STREAMING_BLOCK_BYTES)
+        reader = pa_csv.open_csv(path, read_options=read_options, parse_options=parse_options,
+                                 convert_options=convert_options)
+        for batch in reader:
+            yield batch.to_pandas()
+        return
+    with _read_typed_pandas(path, chunksize=chunksize) as reader:
+        yield from reader
+
+
+def prepare_transactions(df: pd.DataFrame) -> pd.DataFrame:
+    """Limpa as transações e calcula o preço total de cada linha."""
+    # Leitura com tipos inferidos: converte UnitPrice para numérico (substitui vírgula por ponto)
+    if not pd.api.types.is_numeric_dtype(df['UnitPrice']):
+        df['UnitPrice'] = df['UnitPrice'].astype(str).str.replace(',', '.')
+        df['UnitPrice'] = pd.to_numeric(df['UnitPrice'])
+
+    # Garante que CustomerID não seja nulo para agregação
+    df.dropna(subset=['CustomerID'], inplace=True)
+
+    # Calcula o Preço Total da linha
+    df['TotalPrice'] = df['Quantity'] * df['UnitPrice']
+    return df
+
+
+def _plain_country(pais: pd.Series) -> pd.Series:
+    """Pais categórico (leitura tipada) volta ao tipo de texto da leitura inferida."""
+    if isinstance(pais.dtype, pd.CategoricalDtype):
+        return pais.astype(pais.cat.categories.dtype)
+    return pais
+
+
+def _restore_customer_ids(aggregated: pd.DataFrame, had_nulls: bool) -> pd.DataFrame:
+    """
+    CustomerID inteiro quando o arquivo não tinha IDs vazios, como na leitura com tipos
+    inferidos: o CSV agregado (enviado à IA e salvo com a análise) mostra '17850' e não
+    '17850.0', igual em todos os parsers.
+    """
+    if not had_nulls and _is_integral(aggregated['CustomerID']):
+        aggregated['CustomerID'] = aggregated['CustomerID'].astype('int64')
+    return aggregated
+
+
+def aggregate_customers(df: pd.DataFrame) -> pd.DataFrame:
+    """Agrega um DataFrame de transações (já carregado em memória) por CustomerID."""
+    had_nulls = bool(df['CustomerID'].isna().any())
+    df = prepare_transactions(df)
+    aggregated = df.groupby('CustomerID').agg(
+        TotalGasto=('TotalPrice', 'sum'),
+        Frequencia=('InvoiceNo', 'nunique'),
+        TotalItens=('Quantity', 'sum'),
+        Pais=('Country', 'first')
+    ).reset_index()
+    aggregated['Pais'] = _plain_country(aggregated['Pais'])
+    return _restore_customer_ids(aggregated, had_nulls)
+
+
+def invoice_keys(invoices: pd.Series) -> np.ndarray:
+    """
+    Hash de 64 bits de cada InvoiceNo: as notas distintas de cada cliente são guardadas
+    assim no estado incremental (tamanho fixo, independente do texto da nota).
+    O texto é usado para que leituras tipadas e inferidas gerem a mesma chave.
+    """
+    return pd.util.hash_pandas_object(invoices.astype(str), index=False).to_numpy()
+
+
+def invoice_pair_keys(customer_ids: np.ndarray, invoice_keys: np.ndarray) -> np.ndarray:
+    """Hash de 64 bits de cada par (CustomerID, hash da nota), como fica no estado incremental."""
+    pairs = pd.DataFrame({
+        'CustomerID': np.asarray(customer_ids, dtype=np.float64),
+        'InvoiceKey': np.asarray(invoice_keys, dtype=np.uint64),
+    })
+    return pd.util.hash_pandas_object(pairs, index=False).to_numpy()
+
+
+class CustomerAggregator:
+    """
+    Mantém agregados parciais por CustomerID enquanto o CSV é lido em blocos.
+    A memória usada cresce com o número de clientes (e de notas fiscais distintas),
+    e não com o número de linhas do arquivo.
+    Os agregados são somas, contagens de notas distintas e o conjunto (ordenado) dos
+    pares cliente/nota já vistos, que podem ser combinados: o estado de uma análise
+    pode ser guardado e receber novas transações depois (ver from_state).
+    """
+
+    def __init__(self):
+        self._totals: Optional[pd.DataFrame] = None
+        # Notas distintas por CustomerID (a Frequência) dos pares já consolidados...
+        self._frequency: Optional[pd.Series] = None
+        # ... e o hash desses pares, ordenado, para reconhecer uma nota repetida
+        self._pair_keys = np.empty(0, dtype=np.uint64)
+        # Pares dos blocos lidos desde a última consolidação (distintos só dentro de cada bloco)
+        self._pending_invoices: List[pd.DataFrame] = []
+        self.rows_read = 0
+        # Alguma linha lida sem CustomerID (ver _restore_customer_ids)
+        self.customer_id_nulls = False
+
+    @classmethod
+    def from_state(cls, totals: pd.DataFrame, frequency: pd.Series, pair_keys: np.ndarray) -> 'CustomerAggregator':
+        """
+        Recria o agregador a partir de um estado salvo: `totals` indexado por CustomerID
+        (TotalGasto, TotalItens, Pais), `frequency` (notas distintas por CustomerID) e
+        `pair_keys` (invoice_pair_keys dos pares já vistos, ordenado).
+        """
+        aggregator = cls()
+        if not totals.empty:
+            aggregator._totals = totals
+            aggregator._frequency = frequency
+            aggregator._pair_keys = pair_keys
+        return aggregator
+
+    def state(self):
+        """(totals, frequency, pair_keys) no formato aceito por from_state; totals é None se vazio."""
+        self._consolidate_invoices()
+        return self._totals, self._frequency, self._pair_keys
+
+    @property
+    def customers(self) -> int:
+        return 0 if self._totals is None else len(self._totals)
+
+    def update(self, chunk: pd.DataFrame):
+        """Incorpora um bloco de transações aos agregados."""
+        self.rows_read += len(chunk)
+        self.customer_id_nulls = self.customer_id_nulls or bool(chunk['CustomerID'].isna().any())
+        chunk = prepare_transactions(chunk)
+        if chunk.empty:
+            return
+
+        partial = chunk.groupby('CustomerID').agg(
+            TotalGasto=('TotalPrice', 'sum'),
+            TotalItens=('Quantity', 'sum'),
+            Pais=('Country', 'first')
+        )
+        partial['Pais'] = _plain_country(partial['Pais'])
+        pairs = chunk[['CustomerID', 'InvoiceNo']].dropna()
+        customer_ids = pairs['CustomerID'].to_numpy()
+        pairs = pd.DataFrame({
+            'CustomerID': customer_ids,
+            'PairKey': invoice_pair_keys(customer_ids, invoice_keys(pairs['InvoiceNo'])),
+        }).drop_duplicates('PairKey')
+
+        self._pending_invoices.append(pairs)
+
+        if self._totals is None:
+            self._totals = partial
+            return
+
+        sums = self._totals[['TotalGasto', 'TotalItens']].add(
+            partial[['TotalGasto', 'TotalItens']], fill_value=0
+        )
+        # 'first' do pandas ignora nulos: o país já conhecido tem prioridade
+        pais = self._totals['Pais'].combine_first(partial['Pais'])
+        self._totals = sums.join(pais)
+
+    def _consolidate_invoices(self):
+        """
+        Soma às contagens os pares pendentes ainda não vistos. Só os pares novos são
+        ordenados e comparados; os já conhecidos são consultados por busca binária.
+        Não altera os objetos recebidos em from_state (o estado pode ser reaproveitado).
+        """
+        if not self._pending_invoices:
+            return
+        pending = pd.concat(self._pending_invoices, ignore_index=True).drop_duplicates('PairKey')
+        self._pending_invoices = []
+
+        new_keys = pending['PairKey'].to_numpy()
+        positions = np.searchsorted(self._pair_keys, new_keys)
+        known = positions < len(self._pair_keys)
+        known[known] = self._pair_keys[positions[known]] == new_keys[known]
+        pending = pending[~known]
+
+        counts = pending.groupby('CustomerID').size()
+        self._frequency = counts if self._frequency is None else self._frequency.add(counts, fill_value=0)
+        new_keys = np.sort(pending['PairKey'].to_numpy())
+        self._pair_keys = np.insert(self._pair_keys, np.searchsorted(self._pair_keys, new_keys), new_keys)
+
+    def result(self) -> pd.DataFrame:
+        """Retorna o DataFrame agregado no mesmo formato de aggregate_customers()."""
+        if self._totals is None:
+            return pd.DataFrame(columns=AGGREGATED_COLUMNS)
+
+        self._consolidate_invoices()
+        totals = self._totals.sort_index()
+        totals['Frequencia'] = self._frequency.reindex(totals.index, fill_value=0).astype('int64')
+
+        # O alinhamento entre blocos converte TotalItens em float; restaura quando possível
+        if _is_integral(totals['TotalItens']):
+            totals['TotalItens'] = totals['TotalItens'].astype('int64')
+
+        totals.index.name = 'CustomerID'
+        return _restore_customer_ids(totals.reset_index()[AGGREGATED_COLUMNS], self.customer_id_nulls)
+
+
+def _is_integral(series: pd.Series) -> bool:
+    if not pd.api.types.is_float_dtype(series):
+        return False
+    return bool(series.notna().all() and (series % 1 == 0).all())
+
+
+def stream_into_aggregator(path: str, new_aggregator: Callable[[], CustomerAggregator] = CustomerAggregator,
+                           chunksize: int = STREAMING_CHUNK_ROWS) -> CustomerAggregator:
+    """
+    Lê o CSV do disco em blocos e os incorpora a um agregador criado por `new_aggregator`
+    (vazio ou, nas análises incrementais, carregado de um estado salvo).
+    """
+    parser = _parser()
+    aggregator = new_aggregator()
+    if parser != "legacy":
+        try:
+            for chunk in _iter_typed_chunks(path, parser, chunksize):
+                aggregator.update(chunk)
+        except (ValueError, KeyError, TypeError) as e:
+            # Recomeça do início: os blocos já agregados são descartados
+            print(f"Leitura tipada do CSV falhou ({parser}: {e}); usando a leitura com tipos inferidos.", file=sys.stderr)
+            aggregator = new_aggregator()
+            parser = "legacy"
+    if parser == "legacy":
+        with _read_legacy(path, chunksize=chunksize) as reader:
+            for chunk in reader:
+                aggregator.update(chunk)
+    print(f"Ingestão em streaming: {aggregator.rows_read} linhas lidas.", file=sys.stderr)
+    return aggregator
+
+
+def aggregate_customers_streaming(path: str, chunksize: int = STREAMING_CHUNK_ROWS) -> pd.DataFrame:
+    """Lê o CSV do disco em blocos e agrega por CustomerID com memória limitada."""
+    return stream_into_aggregator(path, chunksize=chunksize).result()
@@ -0,0 +1,126 @@
+# python-backend/common/json_stream.py
+
+import json
+from typing import Any, List, Optional
+
+# Cabeçalhos das respostas NDJSON: sem cache e sem buffer em proxies (nginx)
+NDJSON_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def ndjson_event(event: str, **fields: Any) -> str:
+    """Uma linha de um stream NDJSON: {"event": ..., ...campos}."""
+    return json.dumps({"event": event, **fields}, ensure_ascii=False) + "\n"
+
+
+class IncrementalArrayParser:
+    """
+    Lê um documento JSON recebido em pedaços e devolve, assim que ficam completos,
+    os itens do array associado a `array_key` no objeto raiz
+    (ex: cada segmento de {"segments": [...]}).
+    Cada caractere é examinado uma única vez e só o trecho ainda não consumido (o item
+    ou a chave em andamento) fica no buffer; o texto completo é montado em `text` sob demanda.
+    """
+
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self._chunks: List[str] = []
+        # Trecho ainda necessário para a análise; as posições abaixo são relativas a ele
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._last_key: Optional[str] = None
+        self._in_target = False
+        self._item_start: Optional[int] = None
+        self.items_found = 0
+
+    @property
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Adiciona um pedaço do texto e retorna os itens completados por ele."""
+        self._chunks.append(chunk)
+        self._buffer += chunk
+        text = self._buffer
+        completed: List[Any] = []
+
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            depth = len(self._stack)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if depth == 1 and self._expect_key:
+                        self._last_key = json.loads(text[self._string_start:i + 1])
+                        self._expect_key = False
+                    elif self._in_target and depth == 2 and self._item_start is not None:
+                        self._emit(text, i + 1, completed)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+                if self._in_target and depth == 2 and self._item_start is None:
+                    self._item_start = i
+            elif char in '{[':
+                if self._in_target and depth == 2 and self._item_start is None:
+                    self._item_start = i
+                self._stack.append(char)
+                if depth == 0 and char == '{':
+                    self._expect_key = True
+                elif depth == 1 and char == '[' and self._last_key == self.array_key:
+                    self._in_target = True
+            elif char in '}]':
+                if self._in_target and depth == 2 and self._item_start is not None:
+                    # Fim do array com um escalar (número, true...) como último item
+                    self._emit(text, i, completed)
+                self._stack.pop()
+                if self._in_target and len(self._stack) == 2 and self._item_start is not None:
+                    self._emit(text, i + 1, completed)
+                elif self._in_target and len(self._stack) < 2:
+                    self._in_target = False
+            elif char == ',':
+                if self._in_target and depth == 2 and self._item_start is not None:
+                    self._emit(text, i, completed)
+                elif depth == 1:
+                    self._expect_key = True
+            elif not char.isspace() and char != ':':
+                if self._in_target and depth == 2 and self._item_start is None:
+                    self._item_start = i
+
+        self._pos = len(text)
+        self._trim()
+        return completed
+
+    def _trim(self):
+        """Descarta do buffer o prefixo que nenhum item ou chave em andamento ainda referencia."""
+        keep = self._pos
+        if self._item_start is not None:
+            keep = min(keep, self._item_start)
+        if self._in_string:
+            keep = min(keep, self._string_start)
+        if keep == 0:
+            return
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        self._string_start -= keep
+        if self._item_start is not None:
+            self._item_start -= keep
+
+    def _emit(self, text: str, end: int, completed: List[Any]):
+        raw = text[self._item_start:end].strip()
+        self._item_start = None
+        if raw:
+            completed.append(json.loads(raw))
+            self.items_found += 1
@@ -0,0 +1,188 @@
+# python-backend/common/k_selection.py
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from common.clustering import KMEANS_SEED, ClusteringError, fit_kmeans, prepare_features, squared_distances
+from common.models import K_SELECTION_MAX_K, K_SELECTION_MIN_K, ClusterRecommendation, DataTreatment, KEvaluation
+
+# --- Configuração da Recomendação do Número de Clusters ---
+# Cada k do intervalo é avaliado num processo do pool
+K_SELECTION_WORKERS = int(os.getenv("K_SELECTION_WORKERS", str(os.cpu_count() or 1)))
+# Recomendações em andamento (cada uma com vários k) antes de recusar novas (503)
+K_SELECTION_MAX_PENDING = int(os.getenv("K_SELECTION_MAX_PENDING", "4"))
+# O intervalo de k (K_SELECTION_MIN_K a K_SELECTION_MAX_K) é definido em common.models
+# A silhueta é O(n²): calculada numa amostra fixa de clientes
+SILHOUETTE_SAMPLE_SIZE = int(os.getenv("K_SELECTION_SILHOUETTE_SAMPLE", "2000"))
+# Clusters menores que esta fração dos clientes tornam um k desaconselhável
+MIN_CLUSTER_SHARE = float(os.getenv("K_SELECTION_MIN_CLUSTER_SHARE", "0.02"))
+
+
+class KSelectionPoolSaturated(Exception):
+    """Muitas recomendações aguardando no pool."""
+
+
+# --- Funções executadas nos processos do pool ---
+
+def silhouette_score(X: np.ndarray, labels: np.ndarray, k: int) -> float:
+    """Silhueta média (distância euclidiana); clientes sozinhos no cluster contam 0."""
+    distances = np.sqrt(squared_distances(X, X))
+    one_hot = np.zeros((len(X), k))
+    one_hot[np.arange(len(X)), labels] = 1.0
+    counts = one_hot.sum(axis=0)
+    # Soma das distâncias de cada ponto a cada cluster (n x k)
+    sums = distances @ one_hot
+
+    own_counts = counts[labels]
+    a = sums[np.arange(len(X)), labels] / np.maximum(own_counts - 1, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts[None, :]
+    means[np.arange(len(X)), labels] = np.inf
+    means[:, counts == 0] = np.inf
+    b = means.min(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = (b - a) / np.maximum(a, b)
+    scores[(own_counts <= 1) | ~np.isfinite(scores)] = 0.0
+    return float(scores.mean())
+
+
+def cluster_balance(labels: np.ndarray, k: int) -> Tuple[float, float]:
+    """(entropia normalizada dos tamanhos, fração do menor cluster)."""
+    shares = np.bincount(labels, minlength=k) / len(labels)
+    nonzero = shares[shares > 0]
+    entropy = float(-(nonzero * np.log(nonzero)).sum() / np.log(k)) if k > 1 else 1.0
+    return entropy, float(shares.min())
+
+
+def evaluate_k(X: np.ndarray, k: int, sample_indices: np.ndarray) -> KEvaluation:
+    """Ajusta o k-means (o mesmo da segmentação) e calcula as métricas de qualidade."""
+    labels, _, inertia = fit_kmeans(X, k)
+    balance, min_share = cluster_balance(labels, k)
+    silhouette = silhouette_score(X[sample_indices], labels[sample_indices], k)
+    return KEvaluation(
+        k=k,
+        inertia=round(inertia, 4),
+        silhouette=round(silhouette, 4),
+        balance=round(balance, 4),
+        min_cluster_share=round(min_share, 4),
+    )
+
+
+def elbow_k(evaluations: List[KEvaluation]) -> int:
+    """Cotovelo: o ponto da curva de inércia (normalizada) mais distante da reta entre as pontas."""
+    if len(evaluations) < 3:
+        return evaluations[0].k
+    ks = np.array([e.k for e in evaluations], dtype=np.float64)
+    inertias = np.array([e.inertia for e in evaluations], dtype=np.float64)
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    span = inertias[0] - inertias[-1]
+    y = (inertias - inertias[-1]) / span if span > 0 else np.zeros_like(inertias)
+    # Reta de (0, 1) a (1, 0): distância proporcional a 1 - x - y
+    return int(ks[int(np.argmax(1.0 - x - y))])
+
+
+def recommend(evaluations: List[KEvaluation]) -> Tuple[int, int, int, str]:
+    """
+    Escolhe o k com a maior silhueta entre os que não geram clusters minúsculos;
+    se nenhum passar no critério de tamanho, usa o cotovelo da inércia.
+    Retorna (k recomendado, k do cotovelo, k de maior silhueta, justificativa).
+    """
+    elbow = elbow_k(evaluations)
+    best_silhouette = max(evaluations, key=lambda e: e.silhouette)
+    balanced = [e for e in evaluations if e.min_cluster_share >= MIN_CLUSTER_SHARE]
+    if balanced:
+        chosen = max(balanced, key=lambda e: (e.silhouette, -e.k))
+        reason = (f"k={chosen.k} tem a maior silhueta ({chosen.silhouette:.3f}) entre os valores "
+                  f"cujo menor cluster tem ao menos {MIN_CLUSTER_SHARE:.0%} dos clientes; "
+                  f"o cotovelo da inércia está em k={elbow}.")
+        return chosen.k, elbow, best_silhouette.k, reason
+    reason = (f"Todos os valores geram algum cluster com menos de {MIN_CLUSTER_SHARE:.0%} dos clientes; "
+              f"usando o cotovelo da inércia (k={elbow}).")
+    return elbow, elbow, best_silhouette.k, reason
+
+
+class KSelectionPool:
+    """
+    Avalia vários valores de k em paralelo num pool de processos, fora do event loop.
+    Segue o mesmo modelo do pool de hash de senhas: criado sob demanda com 'spawn'
+    e com um limite de recomendações pendentes (KSelectionPoolSaturated acima dele).
+    """
+
+    def __init__(self, workers: int = K_SELECTION_WORKERS, max_pending: int = K_SELECTION_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def start(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._executor_pid = os.getpid()
+                print(f"Pool de avaliação de k iniciado com {self.workers} processos.", file=sys.stderr)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def evaluate(self, X: np.ndarray, ks: List[int], sample_indices: np.ndarray) -> List[KEvaluation]:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise KSelectionPoolSaturated()
+            self._pending += 1
+        try:
+            executor = self.start()
+            loop = asyncio.get_running_loop()
+            return list(await asyncio.gather(*(
+                loop.run_in_executor(executor, evaluate_k, X, k, sample_indices) for k in ks
+            )))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def recommend(self, customer_df: pd.DataFrame, data_treatment: DataTreatment,
+                        min_k: int = K_SELECTION_MIN_K, max_k: int = K_SELECTION_MAX_K) -> ClusterRecommendation:
+        """
+        Avalia k de min_k a max_k sobre as mesmas features da clusterização local e recomenda um k.
+        max_k é limitado a K_SELECTION_MAX_K: cada k é um ajuste do k-means no pool.
+        """
+        _, X, _ = await asyncio.to_thread(prepare_features, customer_df, data_treatment)
+        max_k = min(max_k, K_SELECTION_MAX_K, len(X) - 1)
+        if min_k < K_SELECTION_MIN_K or max_k < min_k:
+            raise ClusteringError(
+                f"Intervalo de clusters inválido ({min_k} a {max_k}) para {len(X)} clientes válidos."
+            )
+        rng = np.random.default_rng(KMEANS_SEED)
+        sample_indices = np.sort(rng.choice(len(X), size=min(len(X), SILHOUETTE_SAMPLE_SIZE), replace=False))
+
+        evaluations = await self.evaluate(X, list(range(min_k, max_k + 1)), sample_indices)
+        recommended, elbow, best_silhouette, reason = recommend(evaluations)
+        print(f"Recomendação de clusters: k={recommended} ({len(X)} clientes, k de {min_k} a {max_k}).", file=sys.stderr)
+        return ClusterRecommendation(
+            customers=len(X),
+            silhouette_sample_size=len(sample_indices),
+            recommended_k=recommended,
+            elbow_k=elbow,
+            best_silhouette_k=best_silhouette,
+            reason=reason,
+            evaluations=evaluations,
+        )
+
+
+k_selection_pool = KSelectionPool()
@@ -0,0 +1,199 @@
+# python-backend/common/llm_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from common.async_database import run_db
+from common.db_pool import ConnectionPool
+
+# --- Configuração do Cache de Respostas da IA ---
+# O arquivo SQLite é compartilhado pelos serviços de segmentação e de estratégias
+LLM_CACHE_DB_PATH = os.getenv(
+    "LLM_CACHE_DB_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'llm_cache.db'))
+)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# A limpeza (expiradas e limite em bytes) roda quando o tamanho estimado passa do limite
+# ou, no máximo, a cada este intervalo (o arquivo também recebe gravações de outros processos)
+LLM_CACHE_EVICTION_INTERVAL_SECONDS = float(os.getenv("LLM_CACHE_EVICTION_INTERVAL_SECONDS", "60"))
+# Ao passar do limite, remove entradas até esta fração dele (folga para as próximas gravações)
+LLM_CACHE_EVICTION_TARGET = 0.9
+
+
+def make_cache_key(model_name: str, generation_config: Dict[str, Any], prompt_text: str, schema_name: str) -> str:
+    """Hash (SHA-256) do modelo, da configuração de geração, do schema esperado e do prompt."""
+    hasher = hashlib.sha256()
+    hasher.update(model_name.encode('utf-8'))
+    hasher.update(b'\0')
+    hasher.update(json.dumps(generation_config, sort_keys=True).encode('utf-8'))
+    hasher.update(b'\0')
+    hasher.update(schema_name.encode('utf-8'))
+    hasher.update(b'\0')
+    hasher.update(prompt_text.encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Cache de respostas validadas da IA, endereçado pelo conteúdo do pedido.
+    Possui dois níveis: um LRU em memória (por processo) e uma tabela SQLite
+    compartilhada entre os serviços, ambos com expiração (TTL). A tabela SQLite
+    também é limitada em bytes, removendo as entradas acessadas há mais tempo.
+    No event loop use get_async/set_async: o SQLite é acessado pelo executor do banco.
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_DB_PATH, ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                 memory_entries: int = LLM_CACHE_MEMORY_ENTRIES, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ConnectionPool(db_path)
+        self.hits = 0
+        self.misses = 0
+        # Tamanho estimado da tabela: somado a cada gravação e recalculado em cada limpeza
+        self._estimated_bytes = 0
+        self._next_eviction = 0.0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._pool.connection()
+
+    def close(self):
+        """Fecha as conexões SQLite do cache (ex: no processo mestre, antes do fork dos workers)."""
+        self._pool.close_all()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access);")
+            self._estimated_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _get_remembered(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+        return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_remembered(key)
+        return value if value is not None else self._get_stored(key)
+
+    async def get_async(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() para o event loop: só a leitura do SQLite sai da thread do loop."""
+        value = self._get_remembered(key)
+        return value if value is not None else await run_db(self._get_stored, key)
+
+    def _get_stored(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"Erro ao ler o cache da IA: {e}", file=sys.stderr)
+            row = None
+
+        if not row:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        value = json.loads(row[0])
+        self._remember(key, value, row[1])
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        self._store(key, value, expires_at)
+
+    async def set_async(self, key: str, value: Dict[str, Any]):
+        """set() para o event loop: a gravação no SQLite roda no executor do banco."""
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        await run_db(self._store, key, value, expires_at)
+
+    def _store(self, key: str, value: Dict[str, Any], expires_at: float):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode('utf-8'))
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, payload, size, now, expires_at, now)
+                )
+                with self._lock:
+                    self._estimated_bytes += size
+                    due = self._estimated_bytes > self.max_bytes or now >= self._next_eviction
+                if due:
+                    self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"Erro ao gravar no cache da IA: {e}", file=sys.stderr)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Remove entradas expiradas e, se preciso, as menos acessadas até caber no limite."""
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        with self._lock:
+            self._estimated_bytes = total
+            self._next_eviction = now + LLM_CACHE_EVICTION_INTERVAL_SECONDS
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * LLM_CACHE_EVICTION_TARGET)
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        with self._lock:
+            self._estimated_bytes = total - freed
+        print(f"Cache da IA: {len(victims)} entradas removidas por limite de tamanho.", file=sys.stderr)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            memory_entries = len(self._memory)
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": memory_entries}
@@ -0,0 +1,280 @@
+# python-backend/common/llm_governance.py
+
+import asyncio
+import os
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from fastapi import HTTPException, status
+
+T = TypeVar("T")
+
+# --- Configuração da Governança das Chamadas à IA ---
+# Chamadas simultâneas ao Gemini por processo
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Limite de requisições (token bucket) compatível com a cota do projeto
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "60"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "10"))
+# Novas tentativas para erros transitórios (429, 5xx, timeouts)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+# Novos prompts quando a saída não é um JSON válido ou não passa na validação
+LLM_INVALID_OUTPUT_RETRIES = int(os.getenv("LLM_INVALID_OUTPUT_RETRIES", "1"))
+# Tempo máximo de cada tentativa e prazo total da chamada (incluindo filas e esperas)
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "90"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "180"))
+# Circuit breaker: falhas consecutivas para abrir e tempo aberto antes de testar de novo
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+# Códigos HTTP considerados transitórios (google.api_core expõe o código em `exc.code`)
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    """A IA está indisponível (circuito aberto ou limite local); o cliente deve tentar mais tarde."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMDeadlineExceeded(Exception):
+    """O prazo total da chamada à IA terminou."""
+
+
+class InvalidModelOutput(ValueError):
+    """A resposta da IA não é um JSON válido ou não corresponde ao modelo esperado."""
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, 'code', None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+def http_exception_for(exc: Exception) -> HTTPException:
+    """Resposta HTTP para as falhas de governança (503 com Retry-After ou 504)."""
+    if isinstance(exc, UpstreamUnavailable):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Serviço de IA temporariamente indisponível: {exc}",
+            headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))},
+        )
+    return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(exc))
+
+
+class TokenBucket:
+    """Limitador de taxa: `rate` requisições por segundo com rajadas de até `capacity`."""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        # Os pedidos esperam em fila (FIFO) pela vez de consumir um token
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, deadline: float):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                if now + wait > deadline:
+                    raise UpstreamUnavailable("limite de requisições à IA atingido", retry_after=wait)
+                await asyncio.sleep(wait)
+                self._refill(time.monotonic())
+            self._tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Fechado: as chamadas passam e falhas transitórias consecutivas são contadas.
+    Aberto: as chamadas falham na hora, até reset_seconds depois da abertura.
+    Meio aberto: uma única chamada de teste decide se o circuito fecha ou volta a abrir.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        if self.state == "closed":
+            return
+        elapsed = time.monotonic() - self._opened_at
+        if self.state == "open" and elapsed >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        raise UpstreamUnavailable("circuito aberto após falhas consecutivas", retry_after=max(1.0, self.reset_seconds - elapsed))
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito aceitar uma chamada de teste (0 se não estiver aberto)."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def release_probe(self):
+        """A chamada autorizada não chegou a ser feita."""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        if self.state != "closed":
+            print("Circuito da IA fechado: chamada de teste bem-sucedida.", file=sys.stderr)
+        self.state = "closed"
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"Circuito da IA aberto por {self.reset_seconds:.0f}s ({self._failures} falhas).", file=sys.stderr)
+            self.state = "open"
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+class LLMCallGovernor:
+    """
+    Envolve as chamadas à IA com limite de concorrência, limite de taxa, circuit breaker,
+    prazos e novas tentativas com backoff exponencial e jitter.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 rate_per_minute: float = LLM_RATE_PER_MINUTE, burst: int = LLM_RATE_BURST,
+                 max_retries: int = LLM_MAX_RETRIES, invalid_output_retries: int = LLM_INVALID_OUTPUT_RETRIES,
+                 attempt_timeout: float = LLM_ATTEMPT_TIMEOUT_SECONDS, deadline_seconds: float = LLM_DEADLINE_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.invalid_output_retries = invalid_output_retries
+        self.attempt_timeout = attempt_timeout
+        self.deadline_seconds = deadline_seconds
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.breaker = CircuitBreaker(LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_SECONDS)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.retries = 0
+        self.reprompts = 0
+        self.rejected = 0
+
+    def ensure_available(self):
+        """Falha rápida (sem consumir a chamada de teste) enquanto o circuito estiver aberto."""
+        retry_after = self.breaker.retry_after()
+        if retry_after > 0:
+            self.rejected += 1
+            raise UpstreamUnavailable("circuito aberto após falhas consecutivas", retry_after=retry_after)
+
+    def new_deadline(self, seconds: Optional[float] = None) -> float:
+        return time.monotonic() + (seconds if seconds is not None else self.deadline_seconds)
+
+    def attempt_timeout_for(self, deadline: float) -> float:
+        """Tempo disponível para a próxima espera: o menor entre a tentativa e o prazo."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded("Prazo da chamada à IA esgotado.")
+        return min(self.attempt_timeout, remaining)
+
+    @asynccontextmanager
+    async def permit(self, deadline: float):
+        """Autoriza uma tentativa: circuito, taxa e vaga de concorrência, nessa ordem."""
+        try:
+            self.breaker.before_call()
+        except UpstreamUnavailable:
+            self.rejected += 1
+            raise
+        try:
+            await self.bucket.acquire(deadline)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.attempt_timeout_for(deadline))
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded("Prazo esgotado aguardando uma vaga para chamar a IA.")
+        except BaseException:
+            # Nenhuma chamada foi feita: libera a vaga de teste do circuito sem contá-la
+            self.breaker.release_probe()
+            raise
+
+        self.in_flight += 1
+        try:
+            yield
+        except LLMDeadlineExceeded:
+            self.breaker.release_probe()
+            raise
+        except Exception as e:
+            if is_transient(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            # Cancelamento ou cliente desconectado no meio de um stream
+            self.breaker.release_probe()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def backoff(self, failures: int, deadline: float):
+        """Espera com backoff exponencial e jitter total antes de uma nova tentativa."""
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** (failures - 1)))
+        if time.monotonic() + delay >= deadline:
+            raise LLMDeadlineExceeded("Prazo da chamada à IA esgotado durante as novas tentativas.")
+        self.retries += 1
+        await asyncio.sleep(delay)
+
+    async def call(self, attempt: Callable[[Optional[str]], Awaitable[T]], deadline: Optional[float] = None) -> T:
+        """
+        Executa `attempt(erro_anterior)` com as proteções acima. `erro_anterior` é None na
+        primeira tentativa e a mensagem de InvalidModelOutput quando a IA deve ser
+        chamada de novo com um prompt de correção.
+        """
+        deadline = deadline if deadline is not None else self.new_deadline()
+        failures = 0
+        invalid_outputs = 0
+        previous_error: Optional[str] = None
+        while True:
+            try:
+                async with self.permit(deadline):
+                    return await asyncio.wait_for(attempt(previous_error), timeout=self.attempt_timeout_for(deadline))
+            except InvalidModelOutput as e:
+                invalid_outputs += 1
+                if invalid_outputs > self.invalid_output_retries:
+                    raise
+                self.reprompts += 1
+                previous_error = str(e)
+                print(f"Saída inválida da IA, solicitando correção ({invalid_outputs}): {e}", file=sys.stderr)
+            except Exception as e:
+                if not is_transient(e) or failures >= self.max_retries:
+                    raise
+                failures += 1
+                print(f"Erro transitório na chamada à IA ({type(e).__name__}), nova tentativa {failures}: {e}", file=sys.stderr)
+                await self.backoff(failures, deadline)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "circuit_state": self.breaker.state,
+            "retries": self.retries,
+            "reprompts": self.reprompts,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,266 @@
+# python-backend/common/llm_providers.py
+
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, Optional
+
+from common.metrics import record_llm_tokens
+
+# --- Configuração do Provedor de IA ---
+# "gemini" (padrão) ou "fake" (local, determinístico, sem rede nem chave de API)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-pro-latest")
+# Lista os modelos disponíveis ao criar o modelo (chamada de rede, apenas para diagnóstico)
+GENAI_LIST_MODELS = os.getenv("GENAI_LIST_MODELS", "0") == "1"
+
+# Provedor falso: latência (tempo total da resposta), erros transitórios e saídas inválidas
+LLM_FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "50"))
+LLM_FAKE_JITTER_MS = float(os.getenv("LLM_FAKE_JITTER_MS", "0"))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+LLM_FAKE_INVALID_RATE = float(os.getenv("LLM_FAKE_INVALID_RATE", "0"))
+LLM_FAKE_SEED = int(os.getenv("LLM_FAKE_SEED", "42"))
+LLM_FAKE_STREAM_CHUNK_CHARS = 64
+
+
+class LLMProvider(ABC):
+    """
+    Interface dos provedores de IA usados pelo GeminiMarketingService.
+    `schema_name` é o nome do modelo Pydantic esperado na resposta (JSON).
+    """
+
+    name = "base"
+    model_name = ""
+    generation_config: Dict[str, Any] = {}
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def initialize(self):
+        """Prepara o cliente (síncrono; chamado fora do event loop)."""
+
+    @abstractmethod
+    async def generate(self, prompt_text: str, schema_name: str) -> str:
+        """Resposta completa (texto JSON)."""
+
+    @abstractmethod
+    def stream(self, prompt_text: str, schema_name: str) -> AsyncIterator[str]:
+        """Resposta em pedaços de texto, à medida que são gerados."""
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini via google.generativeai (importado só na criação do modelo)."""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME):
+        self.api_key = os.getenv("GOOGLE_API_KEY")
+        if not self.api_key:
+            print("ERRO FATAL: GOOGLE_API_KEY não encontrada.", file=sys.stderr)
+            raise ValueError("GOOGLE_API_KEY não configurada")
+        else:
+            print("GOOGLE_API_KEY encontrada.", file=sys.stderr)
+        self.model_name = model_name
+        self.generation_config = {
+            "temperature": 1,
+            "top_p": 0.95,
+            "top_k": 64,
+            "max_output_tokens": 8192,
+            "response_mime_type": "application/json",
+        }
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        """Modelo Gemini, criado no primeiro acesso."""
+        self.initialize()
+        return self._model
+
+    def initialize(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._initialize_model()
+
+    def _configure_genai(self):
+        import google.generativeai as genai
+        try:
+            genai.configure(api_key=self.api_key)
+            print("genai configurado com sucesso.", file=sys.stderr)
+        except Exception as config_error:
+            print(f"Erro durante genai.configure(): {config_error}", file=sys.stderr)
+            raise config_error
+
+    def _list_models(self):
+        import google.generativeai as genai
+        try:
+            print("Modelos disponíveis que suportam 'generateContent':", file=sys.stderr)
+            found_model = False
+            for m in genai.list_models():
+              if 'generateContent' in m.supported_generation_methods:
+                print(f"- {m.name}", file=sys.stderr)
+                found_model = True
+            if not found_model:
+                print("Nenhum modelo encontrado.", file=sys.stderr)
+        except Exception as list_error:
+            print(f"Erro ao listar modelos: {list_error}", file=sys.stderr)
+
+    def _initialize_model(self):
+        self._configure_genai()
+        if GENAI_LIST_MODELS:
+            self._list_models() # Lista os modelos para depuração
+        import google.generativeai as genai
+        model_name_to_use = self.model_name
+
+        try:
+            model = genai.GenerativeModel(
+                model_name=model_name_to_use,
+                generation_config=self.generation_config,
+            )
+            print(f"Modelo {model_name_to_use} inicializado.", file=sys.stderr)
+            return model
+        except Exception as e:
+            print(f"Erro ao inicializar modelo: {e}", file=sys.stderr)
+            raise
+
+    def _record_usage(self, response):
+        """Tokens informados pela API (usage_metadata), quando disponíveis."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_llm_tokens(self.name, getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
+
+    async def generate(self, prompt_text: str, schema_name: str) -> str:
+        # Em versões mais recentes, 'response_text' pode não ser síncrono
+        response = await self.model.generate_content_async(prompt_text)
+        self._record_usage(response)
+
+        # Tenta acessar a propriedade 'text'
+        try:
+            return response.text
+        except Exception:
+            # 'text' só funciona com um candidato de parte única: junta as partes do primeiro candidato
+            print("Acessando 'response.text' falhou, juntando as partes do primeiro candidato...", file=sys.stderr)
+            candidates = getattr(response, "candidates", None)
+            if not candidates:
+                raise
+            return "".join(getattr(part, "text", "") for part in candidates[0].content.parts)
+
+    async def stream(self, prompt_text: str, schema_name: str) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt_text, stream=True)
+        last_chunk = None
+        async for chunk in response:
+            last_chunk = chunk
+            yield chunk.text
+        # O último pedaço traz o uso de tokens da resposta inteira
+        if last_chunk is not None:
+            self._record_usage(last_chunk)
+
+
+class FakeUpstreamError(Exception):
+    """Erro transitório injetado pelo provedor falso (tratado como um 503 do Gemini)."""
+    code = 503
+
+
+class FakeProvider(LLMProvider):
+    """
+    Provedor local e determinístico para testes e benchmarks: gera JSON válido para os
+    schemas do serviço, com latência configurável e injeção de erros e de saídas inválidas.
+    O número de itens vem do próprio prompt ("exatamente N ...").
+    """
+
+    name = "fake"
+
+    def __init__(self, latency_ms: float = LLM_FAKE_LATENCY_MS, jitter_ms: float = LLM_FAKE_JITTER_MS,
+                 error_rate: float = LLM_FAKE_ERROR_RATE, invalid_rate: float = LLM_FAKE_INVALID_RATE,
+                 seed: int = LLM_FAKE_SEED):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.model_name = "fake"
+        self.generation_config = {"seed": seed}
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    def _latency(self) -> float:
+        return max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+    def _roll_failure(self):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise FakeUpstreamError("Falha transitória simulada pelo provedor falso.")
+
+    def _response(self, prompt_text: str, schema_name: str) -> str:
+        if self.invalid_rate and self._rng.random() < self.invalid_rate:
+            return '{"resposta": "incompleta"'
+        match = re.search(r'exatamente (\d+)', prompt_text)
+        count = int(match.group(1)) if match else 3
+        text = json.dumps(fake_payload(schema_name, count), ensure_ascii=False)
+        # Estimativa de ~4 caracteres por token, para exercitar as métricas de uso
+        record_llm_tokens(self.name, len(prompt_text) // 4, len(text) // 4)
+        return text
+
+    async def generate(self, prompt_text: str, schema_name: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self._latency())
+        self._roll_failure()
+        return self._response(prompt_text, schema_name)
+
+    async def stream(self, prompt_text: str, schema_name: str) -> AsyncIterator[str]:
+        self.calls += 1
+        text = self._response(prompt_text, schema_name)
+        chunks = [text[i:i + LLM_FAKE_STREAM_CHUNK_CHARS] for i in range(0, len(text), LLM_FAKE_STREAM_CHUNK_CHARS)]
+        # A latência total é dividida entre os pedaços
+        delay = self._latency() / max(1, len(chunks))
+        self._roll_failure()
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+
+def fake_payload(schema_name: str, count: int) -> Dict[str, Any]:
+    """Resposta válida (e determinística) para o schema `schema_name` com `count` itens."""
+    if schema_name == "MarketSegmentationInsightsOutput":
+        return {
+            "textualInsights": f"Resumo simulado de {count} segmentos.",
+            "segments": [
+                {
+                    "name": f"Segmento {i + 1}",
+                    "size": 100 * (count - i),
+                    "avg_purchase_value": round(50.0 + 25.0 * i, 2),
+                    "purchase_frequency": round(1.0 + 0.5 * i, 2),
+                    "description": f"Descrição simulada do segmento {i + 1}.",
+                }
+                for i in range(count)
+            ],
+        }
+    if schema_name == "SegmentStrategiesList":
+        return {
+            "segments": [
+                {"segmentName": f"Segmento {i + 1}", "marketingStrategies": [f"Estratégia simulada {i + 1}.{j + 1}" for j in range(3)]}
+                for i in range(count)
+            ]
+        }
+    if schema_name == "MarketingStrategiesOutput":
+        return {"marketingStrategies": [f"Estratégia simulada {j + 1}" for j in range(3)]}
+    raise ValueError(f"Schema sem resposta simulada: {schema_name}")
+
+
+def create_provider(name: Optional[str] = None) -> LLMProvider:
+    name = (name or LLM_PROVIDER).lower()
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "fake":
+        print("Usando o provedor de IA falso (LLM_PROVIDER=fake).", file=sys.stderr)
+        return FakeProvider()
+    raise ValueError(f"LLM_PROVIDER desconhecido: {name}")
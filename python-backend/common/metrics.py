@@ -0,0 +1,319 @@
+# python-backend/common/metrics.py
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import FastAPI, Response
+
+# --- Configuração das Métricas ---
+# Métricas no formato de texto do Prometheus, expostas em GET /metrics de cada serviço
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PREFIX = "marketwise_"
+# Limites dos histogramas: duração (segundos) e tamanho (caracteres)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base dos contadores, gauges e histogramas (valores por combinação de labels)."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [contagem por faixa (não acumulada)..., soma, total]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        names = self.label_names + ("le",)
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {state[-1]}"
+
+
+# Coletor: chamado a cada leitura de /metrics, retorna linhas já no formato de texto
+Collector = Callable[[], Iterable[str]]
+
+
+class MetricsRegistry:
+    """Conjunto das métricas deste processo e dos coletores de estatísticas avaliados na leitura."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, name: str, collector: Collector):
+        """Registra (ou substitui) um coletor; o nome evita duplicatas quando o app é recarregado."""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        for collector in collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# erro no coletor: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- Métricas compartilhadas pelos serviços ---
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Requisições HTTP atendidas.", ("service", "method", "route", "status"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP (até o fim do corpo da resposta).",
+    ("service", "method", "route"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requisições HTTP em andamento.", ("service",))
+STAGE_DURATION = REGISTRY.histogram(
+    "stage_duration_seconds", "Duração das etapas do processamento (leitura do CSV, agregação, IA...).", ("stage",))
+DB_CALL_DURATION = REGISTRY.histogram(
+    "db_call_duration_seconds", "Duração das funções de banco de dados (incluindo a espera no executor).",
+    ("operation",))
+DB_CALLS_IN_FLIGHT = REGISTRY.gauge(
+    "db_calls_in_flight", "Funções de banco de dados em andamento ou aguardando o executor.")
+LLM_PROMPT_CHARS = REGISTRY.histogram(
+    "llm_prompt_chars", "Tamanho dos prompts enviados à IA (caracteres).", ("schema",), SIZE_BUCKETS)
+LLM_RESPONSE_CHARS = REGISTRY.histogram(
+    "llm_response_chars", "Tamanho das respostas da IA (caracteres).", ("schema",), SIZE_BUCKETS)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens consumidos na IA, informados pelo provedor (ou estimados).",
+    ("provider", "kind"))
+LLM_REQUESTS = REGISTRY.counter(
+    "llm_requests_total", "Tentativas de chamada à IA por resultado.", ("schema", "outcome"))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Mede uma etapa (código síncrono ou assíncrono dentro do bloco)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=stage)
+
+
+def record_llm_tokens(provider: str, prompt_tokens: Optional[int], output_tokens: Optional[int]):
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, kind="prompt")
+    if output_tokens:
+        LLM_TOKENS.inc(output_tokens, provider=provider, kind="output")
+
+
+def stats_collector(name: str, stats: Callable[[], Dict[str, Any]], counters: Sequence[str] = ()) -> Collector:
+    """
+    Converte um método stats() (pool de conexões, cache, governança) em métricas:
+    chaves em `counters` viram contadores, os demais números viram gauges e
+    textos viram um gauge com o valor no label (ex: estado do circuito).
+    """
+    def collect() -> Iterable[str]:
+        lines = []
+        for key, value in stats().items():
+            metric = f"{METRICS_PREFIX}{name}_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                if key in counters:
+                    metric += "_total"
+                    lines.append(f"# TYPE {metric} counter")
+                else:
+                    lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {_format_value(value)}")
+            elif isinstance(value, str) and key != "db_path":
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f'{metric}{{value="{_escape(value)}"}} 1')
+        return lines
+    return collect
+
+
+def register_stats_collectors(service=None):
+    """Coletores do pool de conexões e, se houver um GeminiMarketingService, do cache e da governança da IA."""
+    from common import database
+
+    REGISTRY.add_collector("db_pool", stats_collector(
+        "db_pool", database.get_pool_stats, counters=("connections_created", "connections_reused")))
+    if service is None:
+        return
+    if service.cache is not None:
+        REGISTRY.add_collector("llm_cache", stats_collector("llm_cache", service.cache.stats, counters=("hits", "misses")))
+    REGISTRY.add_collector("llm_governor", stats_collector(
+        "llm_governor", service.governor.stats, counters=("retries", "reprompts", "rejected")))
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: conta e mede as requisições HTTP por rota (o template, ex:
+    /api/segmentation-analyses/{analysis_id}, para limitar a cardinalidade).
+    A duração inclui o envio de respostas em streaming.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(service=self.service)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec(service=self.service)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(service=self.service, method=method, route=route_path, status=status_code)
+            HTTP_REQUEST_DURATION.observe(elapsed, service=self.service, method=method, route=route_path)
+
+
+def install_metrics(app: FastAPI, service: str):
+    """Adiciona o middleware de métricas e a rota GET /metrics (formato do Prometheus) ao app."""
+    app.add_middleware(MetricsMiddleware, service=service)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,5 +1,7 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+import os
+
+from pydantic import BaseModel, Field, EmailStr, model_validator
+from typing import Dict, List, Optional
 
 # --- Modelos de Usuário e Autenticação ---
 
@@ -41,11 +43,35 @@ class DataTreatment(BaseModel):
     excludeNulls: bool
     groupCategories: bool
 
+class ClusterProfile(BaseModel):
+    cluster_id: int
+    size: int = Field(description='O número exato de clientes no cluster.')
+    avg_purchase_value: float = Field(description='Ticket médio: total gasto / número de compras.')
+    purchase_frequency: float = Field(description='Número médio de compras por cliente.')
+    avg_total_spent: float = Field(description='Gasto total médio por cliente.')
+    avg_items: float = Field(description='Quantidade média de itens por cliente.')
+    top_countries: Dict[str, float] = Field(description='Participação dos principais países no cluster.')
+
 class MarketSegmentationInsightsInput(BaseModel):
 # ... (código existente, sem alterações)
     clusterData: str = Field(description='Uma amostra de dados de clientes em formato CSV...')
     dataTreatment: DataTreatment
     numberOfClusters: int = Field(description='O número desejado de segmentos de mercado...')
+    # Preenchido quando a clusterização é feita localmente: a IA apenas nomeia e descreve
+    clusterProfiles: Optional[List[ClusterProfile]] = None
+    # Resumo estatístico de tamanho fixo usado no prompt no lugar de clusterData
+    promptSketch: Optional[str] = None
+
+class SegmentationOptions(BaseModel):
+    """Parâmetros do formulário de segmentação (usados também pelos jobs assíncronos)."""
+    numberOfClusters: int
+    normalize: bool
+    excludeNulls: bool
+    groupCategories: bool
+    streamingIngestion: bool = False
+    localClustering: bool = False
+    compactPrompt: bool = False
+    bypassCache: bool = False
 
 class Segment(BaseModel):
 # ... (código existente, sem alterações)
@@ -60,6 +86,81 @@ class MarketSegmentationInsightsOutput(BaseModel):
     textualInsights: str = Field(description='Um resumo legível por humanos...')
     segments: List[Segment] = Field(description='Um array de segmentos de mercado identificados...')
 
+# --- Modelos da Recomendação do Número de Clusters ---
+
+class KEvaluation(BaseModel):
+    k: int
+    inertia: float = Field(description='Soma das distâncias ao quadrado até o centróide (curva do cotovelo).')
+    silhouette: float = Field(description='Silhueta média numa amostra limitada de clientes (-1 a 1).')
+    balance: float = Field(description='Entropia normalizada dos tamanhos dos clusters (1 = tamanhos iguais).')
+    min_cluster_share: float = Field(description='Fração de clientes no menor cluster.')
+
+# Intervalo de k avaliado (definido aqui para as rotas não importarem o pipeline).
+# Intervalos pedidos além de K_SELECTION_MAX_K são reduzidos a ele.
+K_SELECTION_MIN_K = 2
+K_SELECTION_MAX_K = int(os.getenv("K_SELECTION_MAX_K", "12"))
+
+class ClusterRecommendationOptions(BaseModel):
+    """Parâmetros do formulário de recomendação do número de clusters."""
+    normalize: bool
+    excludeNulls: bool
+    groupCategories: bool
+    minK: int = K_SELECTION_MIN_K
+    maxK: int = K_SELECTION_MAX_K
+    streamingIngestion: bool = False
+
+class ClusterRecommendation(BaseModel):
+    dataset_id: Optional[str] = None
+    customers: int
+    silhouette_sample_size: int
+    recommended_k: int
+    elbow_k: int
+    best_silhouette_k: int
+    reason: str
+    evaluations: List[KEvaluation]
+
+# --- Modelos de Datasets (tabelas agregadas reaproveitáveis) ---
+
+class DatasetInfo(BaseModel):
+    dataset_id: str
+    customers: int
+    created_at: float
+    last_used_at: float
+    cached: bool = Field(description='False se a tabela já saiu do cache (o arquivo precisa ser enviado de novo)')
+
+# --- Modelos de Análises Incrementais ---
+
+class IncrementalAnalysisResult(BaseModel):
+    analysis_id: int
+    parent_analysis_id: Optional[int] = None
+    customers: int
+    new_customers: int
+    transactions_read: int
+    # Maior variação da participação de um segmento e fração dos clientes que mudou de segmento
+    # (em relação à análise anterior; None na análise base)
+    segment_share_shift: Optional[float] = None
+    migrated_customers_share: Optional[float] = None
+    # False quando os nomes e descrições da análise anterior foram mantidos
+    llm_invoked: bool
+    result: MarketSegmentationInsightsOutput
+
+# --- Modelos de Jobs de Segmentação ---
+
+class SegmentationJobSubmitted(BaseModel):
+    job_id: str
+    status: str
+
+class SegmentationJobStatus(BaseModel):
+    job_id: str
+    status: str = Field(description='queued, running, succeeded ou failed')
+    stage: Optional[str] = None
+    progress: float = 0.0
+    analysis_id: Optional[int] = None
+    error: Optional[str] = None
+    result: Optional[MarketSegmentationInsightsOutput] = None
+    created_at: float
+    updated_at: float
+
 # --- Modelos de Estratégia ---
 
 class MarketingStrategiesInput(BaseModel):
@@ -71,6 +172,37 @@ class MarketingStrategiesOutput(BaseModel):
 # ... (código existente, sem alterações)
     marketingStrategies: List[str] = Field(description='Estratégias de marketing personalizadas...')
 
+# Estratégias em lote: todos os segmentos de uma análise (ou uma lista livre) de uma vez
+MAX_BATCH_SEGMENTS = 20
+
+class SegmentDescription(BaseModel):
+    segmentName: str = Field(description='Nome do segmento (chave do resultado)')
+    customerSegmentAttributes: str = Field(description='Descrição dos atributos do segmento de cliente')
+
+class BatchMarketingStrategiesInput(BaseModel):
+    campaignObjectives: str = Field(description='Objetivos da campanha, comuns a todos os segmentos')
+    analysisId: Optional[int] = Field(default=None, description='Análise salva cujos segmentos serão usados')
+    segments: Optional[List[SegmentDescription]] = Field(default=None, max_length=MAX_BATCH_SEGMENTS)
+
+    @model_validator(mode='after')
+    def _one_source(self):
+        if (self.analysisId is None) == (not self.segments):
+            raise ValueError("Informe 'analysisId' ou uma lista não vazia de 'segments' (apenas um dos dois).")
+        return self
+
+class SegmentStrategies(BaseModel):
+    segmentName: str
+    marketingStrategies: List[str]
+
+class SegmentStrategiesList(BaseModel):
+    """Formato da resposta da IA para o lote (um item por segmento, na mesma ordem)."""
+    segments: List[SegmentStrategies]
+
+class BatchMarketingStrategiesOutput(BaseModel):
+    analysisId: Optional[int] = None
+    campaignObjectives: str
+    segments: List[SegmentStrategies]
+
 # --- Modelo de Histórico ---
 
 class AnalysisMetadata(BaseModel):
@@ -78,4 +210,8 @@ class AnalysisMetadata(BaseModel):
     id: int
     timestamp: str
     number_of_clusters: int
-    original_data_snippet: str
\ No newline at end of file
+    original_data_snippet: str
+
+class AnalysisSearchResult(AnalysisMetadata):
+    score: float = Field(description='Relevância (BM25); quanto menor, mais relevante')
+    snippet: str = Field(description='Trecho dos insights ou dos segmentos com os termos entre **')
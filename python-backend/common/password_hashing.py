@@ -0,0 +1,103 @@
+# python-backend/common/password_hashing.py
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+# Este módulo é importado pelos processos do pool: mantenha-o leve
+# (sem FastAPI, pandas ou acesso ao banco).
+
+# --- Configuração do Hash de Senhas ---
+# Custo do bcrypt. Hashes com custo diferente são refeitos no próximo login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Número máximo de operações aguardando no pool antes de recusar (503)
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class HashingPoolSaturated(Exception):
+    """A fila do pool de hash de senhas está cheia."""
+
+
+# --- Funções executadas nos processos do pool ---
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifica a senha; se o hash usar uma política antiga, retorna também o novo hash."""
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Executa o bcrypt num pool de processos do tamanho do número de núcleos,
+    liberando o event loop. O número de operações pendentes é limitado:
+    acima do limite, HashingPoolSaturated é lançada imediatamente.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def start(self) -> ProcessPoolExecutor:
+        """Cria o pool (sob demanda, ou no startup do serviço)."""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # 'spawn' evita herdar threads e conexões do processo pai
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._executor_pid = os.getpid()
+                print(f"Pool de hash de senhas iniciado com {self.workers} processos "
+                      f"(bcrypt rounds={BCRYPT_ROUNDS}).", file=sys.stderr)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HashingPoolSaturated()
+            self._pending += 1
+        try:
+            executor = self.start()
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._submit(verify_and_update, password, hashed_password)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+
+password_hasher = PasswordHasher()
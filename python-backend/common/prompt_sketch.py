@@ -0,0 +1,99 @@
+# python-backend/common/prompt_sketch.py
+
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# --- Configuração do Resumo Estatístico ("sketch") ---
+SKETCH_FEATURES = ['TotalGasto', 'Frequencia', 'TotalItens']
+SKETCH_QUANTILES = [0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0]
+SKETCH_HISTOGRAM_BINS = int(os.getenv("SKETCH_HISTOGRAM_BINS", "10"))
+SKETCH_TOP_COUNTRIES = int(os.getenv("SKETCH_TOP_COUNTRIES", "10"))
+# Amostra estratificada: estratos por faixa de gasto x clientes por estrato
+SKETCH_SAMPLE_STRATA = int(os.getenv("SKETCH_SAMPLE_STRATA", "5"))
+SKETCH_SAMPLE_PER_STRATUM = int(os.getenv("SKETCH_SAMPLE_PER_STRATUM", "4"))
+SKETCH_SEED = 42
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def _quantile_section(customers: pd.DataFrame) -> List[str]:
+    header = "Feature;Media;" + ";".join(f"P{int(q * 100)}" for q in SKETCH_QUANTILES)
+    lines = [header]
+    for feature in SKETCH_FEATURES:
+        values = customers[feature]
+        quantiles = values.quantile(SKETCH_QUANTILES).tolist()
+        lines.append(";".join([feature, _format_number(values.mean())] + [_format_number(q) for q in quantiles]))
+    return lines
+
+
+def _histogram_section(customers: pd.DataFrame) -> List[str]:
+    """Histogramas de largura fixa entre P1 e P99; valores fora entram nas faixas extremas."""
+    lines = []
+    for feature in SKETCH_FEATURES:
+        values = customers[feature].to_numpy(dtype=np.float64)
+        low, high = np.quantile(values, [0.01, 0.99])
+        if high <= low:
+            high = low + 1.0
+        counts, edges = np.histogram(np.clip(values, low, high), bins=SKETCH_HISTOGRAM_BINS, range=(low, high))
+        bins = ", ".join(
+            f"[{_format_number(edges[i])}, {_format_number(edges[i + 1])}): {int(count)}"
+            for i, count in enumerate(counts)
+        )
+        lines.append(f"{feature}: {bins}")
+    return lines
+
+
+def _country_section(customers: pd.DataFrame) -> List[str]:
+    countries = customers['Pais'].fillna('Desconhecido').value_counts()
+    lines = [f"{name}: {int(count)}" for name, count in countries.head(SKETCH_TOP_COUNTRIES).items()]
+    if len(countries) > SKETCH_TOP_COUNTRIES:
+        others = countries.iloc[SKETCH_TOP_COUNTRIES:]
+        lines.append(f"Outros ({len(others)} países): {int(others.sum())}")
+    return lines
+
+
+def _stratified_sample(customers: pd.DataFrame) -> pd.DataFrame:
+    """Seleciona alguns clientes representativos de cada faixa de gasto."""
+    strata = pd.qcut(customers['TotalGasto'].rank(method='first'), q=min(SKETCH_SAMPLE_STRATA, len(customers)),
+                     labels=False)
+    return (
+        customers.groupby(strata, group_keys=False)
+        .apply(lambda group: group.sample(n=min(len(group), SKETCH_SAMPLE_PER_STRATUM), random_state=SKETCH_SEED))
+        .sort_values('TotalGasto')
+    )
+
+
+def build_profile_sketch(customer_df: pd.DataFrame) -> str:
+    """
+    Gera um resumo estatístico de tamanho fixo da base de clientes agregada.
+    O tamanho do texto não cresce com o número de clientes.
+    """
+    customers = customer_df.copy()
+    for feature in SKETCH_FEATURES:
+        customers[feature] = pd.to_numeric(customers[feature], errors='coerce')
+    customers = customers.dropna(subset=SKETCH_FEATURES)
+    if customers.empty:
+        return "Nenhum cliente válido encontrado nos dados."
+
+    sample = _stratified_sample(customers)
+    sections = [
+        f"Total de clientes: {len(customers)}",
+        "",
+        "Quantis por feature (formato CSV):",
+        *_quantile_section(customers),
+        "",
+        f"Histogramas ({SKETCH_HISTOGRAM_BINS} faixas entre P1 e P99, contagem de clientes):",
+        *_histogram_section(customers),
+        "",
+        "Clientes por país:",
+        *_country_section(customers),
+        "",
+        f"Amostra estratificada por faixa de gasto ({len(sample)} clientes, formato CSV):",
+        sample.to_csv(index=False, sep=';', float_format='%.2f').strip(),
+    ]
+    return "\n".join(sections)
@@ -0,0 +1,101 @@
+# python-backend/common/startup.py
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# --- Configuração da Inicialização dos Serviços ---
+# Executa o warm-up (imports pesados, criação do modelo) em segundo plano após o startup.
+# Desligado, tudo é criado no primeiro uso e o serviço fica pronto imediatamente.
+SERVICE_WARMUP = os.getenv("SERVICE_WARMUP", "1") == "1"
+
+_MODULE_LOADED = time.perf_counter()
+
+
+def process_uptime() -> float:
+    """Segundos desde o início do processo (Linux); fora do Linux, desde o import deste módulo."""
+    try:
+        with open('/proc/self/stat') as f:
+            # O campo 2 (nome) pode conter espaços: os demais vêm depois do último ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        started_ticks = int(fields[19])
+        with open('/proc/uptime') as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - started_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _MODULE_LOADED
+
+
+class ServiceReadiness:
+    """
+    Estado de prontidão de um serviço. O warm-up roda em segundo plano, depois que o
+    servidor já aceita conexões, e a rota /ready responde 503 até ele terminar.
+    Guarda também os tempos de inicialização (segundos desde o início do processo).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ready = False
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def mark(self, event: str):
+        self.timings[event] = round(process_uptime(), 3)
+
+    def start_warmup(self, *steps: Callable[[], Awaitable[Any]]):
+        """Chamado no startup: agenda as etapas de warm-up sem bloquear o servidor."""
+        self.mark("startup")
+        if not SERVICE_WARMUP:
+            self.ready = True
+            return
+        self._task = asyncio.create_task(self._warm_up(steps))
+
+    async def _warm_up(self, steps):
+        try:
+            for step in steps:
+                await step()
+        except Exception as e:
+            self.error = str(e)
+            print(f"Falha no warm-up do {self.name}: {e}", file=sys.stderr)
+            return
+        self.ready = True
+        self.mark("ready")
+        print(f"{self.name} pronto. Tempos de inicialização (s): {self.timings}", file=sys.stderr)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"service": self.name, "ready": self.ready, "error": self.error, "timings": self.timings}
+
+
+def measure_import_time(module: str, runs: int = 5) -> Dict[str, float]:
+    """Mede, em processos novos, o tempo de import de um módulo (ex: segmentation_service.main)."""
+    backend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - started)"
+    )
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=backend_dir, check=True,
+            capture_output=True, text=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return {"min": min(samples), "median": statistics.median(samples), "max": max(samples)}
+
+
+if __name__ == "__main__":
+    # Uso: python -m common.startup segmentation_service.main strategy_service.main
+    for module_name in sys.argv[1:] or ["segmentation_service.main", "strategy_service.main"]:
+        result = measure_import_time(module_name)
+        print(f"{module_name}: min={result['min']:.3f}s mediana={result['median']:.3f}s max={result['max']:.3f}s")
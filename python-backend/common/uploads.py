@@ -0,0 +1,44 @@
+# python-backend/common/uploads.py
+
+import os
+import tempfile
+from typing import Any, Optional
+
+from fastapi import UploadFile
+
+# Este módulo não importa pandas: é usado pelas rotas antes do pipeline ser carregado.
+
+# --- Configuração dos Uploads ---
+# Uploads maiores que este limite usam o modo de streaming automaticamente
+STREAMING_THRESHOLD_BYTES = int(os.getenv("CSV_STREAMING_THRESHOLD_BYTES", str(50 * 1024 * 1024)))
+# Tamanho do bloco copiado do upload para o disco
+UPLOAD_SPOOL_BLOCK_BYTES = 1024 * 1024
+
+
+async def spool_upload_to_disk(file: UploadFile, directory: Optional[str] = None, hasher: Any = None) -> str:
+    """
+    Copia o upload para um arquivo temporário em blocos e retorna o caminho.
+    Se `hasher` (ex: hashlib.sha256()) for informado, ele recebe cada bloco copiado.
+    """
+    fd, path = tempfile.mkstemp(prefix='upload_', suffix='.csv', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = await file.read(UPLOAD_SPOOL_BLOCK_BYTES)
+                if not block:
+                    break
+                if hasher is not None:
+                    hasher.update(block)
+                out.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def should_stream(file: UploadFile, requested: bool) -> bool:
+    """Decide se o upload deve ser processado em streaming."""
+    if requested:
+        return True
+    size = getattr(file, 'size', None)
+    return size is not None and size > STREAMING_THRESHOLD_BYTES
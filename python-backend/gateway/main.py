@@ -0,0 +1,89 @@
+from fastapi import FastAPI, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import sys
+import os
+
+# Adiciona a pasta 'common' ao sys.path para permitir importações
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import async_database, database
+from common.metrics import install_metrics
+import auth_service.main as auth_main
+import segmentation_service.main as segmentation_main
+import strategy_service.main as strategy_main
+
+# --- Configuração do Gateway ---
+# Os três serviços num único app e processo: um só GeminiMarketingService (cache e
+# governança da IA), um só pool de conexões e um só warm-up. A implantação separada
+# (auth_service, segmentation_service e strategy_service) continua disponível.
+#
+# Com workers criados por fork depois do import (preload), os módulos carregados aqui
+# são compartilhados entre os workers (copy-on-write):
+#   gunicorn gateway.main:app -k uvicorn.workers.UvicornWorker -w 4 --preload
+# (gunicorn é opcional e não está no requirements.txt: pip install gunicorn)
+# (uvicorn --workers inicia cada worker com spawn e repete os imports.)
+# Importa o pipeline de segmentação (pandas, numpy) já no import do app
+GATEWAY_PRELOAD_PIPELINE = os.getenv("GATEWAY_PRELOAD_PIPELINE", "1") == "1"
+
+if GATEWAY_PRELOAD_PIPELINE:
+    segmentation_main._pipeline()
+
+app = FastAPI(
+    title="MarketWise - Gateway",
+    description="Autenticação, segmentação e estratégias num único processo."
+)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Dataset-Id", "X-Access-Token"],
+)
+install_metrics(app, "gateway")
+
+app.include_router(auth_main.router)
+app.include_router(segmentation_main.router)
+app.include_router(strategy_main.router)
+
+# Conexões SQLite abertas durante o import (ex: schema do cache da IA) não devem ser
+# herdadas pelos workers: cada processo abre as suas no primeiro uso
+database.close_db_connections()
+if segmentation_main.service.cache is not None:
+    segmentation_main.service.cache.close()
+
+
+@app.on_event("startup")
+async def on_startup():
+    """Cria o schema uma única vez (fora do event loop) e inicia os três serviços (pool de hash de senhas, jobs e warm-ups)."""
+    await async_database.run_db(database.init_db)
+    auth_main.start_service()
+    segmentation_main.start_service()
+    strategy_main.start_service()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Encerra os serviços; os jobs de segmentação param primeiro (ainda usam o executor do banco)."""
+    await segmentation_main.on_shutdown()
+    await strategy_main.on_shutdown()
+    auth_main.on_shutdown()
+
+@app.get("/ready")
+async def readiness_endpoint():
+    """Prontidão dos serviços montados (503 até todos terminarem o warm-up)."""
+    readiness = [segmentation_main.readiness, strategy_main.readiness]
+    ready = all(service.ready for service in readiness)
+    status_code = status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(
+        {"service": "gateway", "ready": ready, "services": [service.status() for service in readiness]},
+        status_code=status_code
+    )
+
+@app.get("/")
+def read_root():
+    return {"Hello": "Gateway MarketWise AI"}
+
+# Para rodar o gateway (no lugar dos três serviços):
+# uvicorn gateway.main:app --port 8000
@@ -0,0 +1,8 @@
+@echo off
+echo Ativando ambiente virtual...
+CALL .\.venv\Scripts\activate.bat
+
+echo Iniciando o gateway (Auth, Segmentation e Strategy num unico processo)...
+echo Aponte NEXT_PUBLIC_AUTH_API_URL, NEXT_PUBLIC_SEGMENTATION_API_URL e NEXT_PUBLIC_STRATEGY_API_URL para a porta 8000.
+
+uvicorn gateway.main:app --port 8000
@@ -0,0 +1,140 @@
+# python-backend/segmentation_service/jobs.py
+
+import asyncio
+import os
+import socket
+import sys
+from typing import Any, Dict, List
+
+from common.ai_service import GeminiMarketingService
+from common import async_database
+from common.models import SegmentationOptions
+
+# --- Configuração dos Jobs de Segmentação ---
+# Número de jobs executados em paralelo por processo (limita também as chamadas à IA)
+JOB_WORKERS = int(os.getenv("SEGMENTATION_JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("SEGMENTATION_JOB_POLL_SECONDS", "2"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("SEGMENTATION_JOB_HEARTBEAT_SECONDS", "15"))
+# Jobs 'running' sem heartbeat há mais que isto voltam para a fila
+JOB_STALE_SECONDS = float(os.getenv("SEGMENTATION_JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("SEGMENTATION_JOB_MAX_ATTEMPTS", "3"))
+JOB_UPLOAD_DIR = os.getenv(
+    "SEGMENTATION_JOB_UPLOAD_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'job_uploads'))
+)
+
+
+class SegmentationJobRunner:
+    """
+    Pool de workers (tarefas asyncio) que consome a fila de jobs persistida no SQLite.
+    Vários processos podem rodar o pool ao mesmo tempo: a reserva de cada job é atômica.
+    """
+
+    def __init__(self, service: GeminiMarketingService, workers: int = JOB_WORKERS):
+        self.service = service
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+        self._tasks = [asyncio.create_task(self._worker_loop(f"{self._worker_prefix}:{n}")) for n in range(self.workers)]
+        print(f"{self.workers} workers de jobs de segmentação iniciados.", file=sys.stderr)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_id: int, input_path: str, options: SegmentationOptions) -> str:
+        """Enfileira um job; input_path deve estar em JOB_UPLOAD_DIR."""
+        job_id = await async_database.create_segmentation_job(user_id, options.model_dump(), input_path)
+        self._wakeup.set()
+        return job_id
+
+    async def _worker_loop(self, worker_id: str):
+        while True:
+            try:
+                job, abandoned_inputs = await async_database.claim_segmentation_job(
+                    worker_id, JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro ao buscar job na fila: {e}", file=sys.stderr)
+                job, abandoned_inputs = None, []
+            # Jobs que falharam por excederem o número de tentativas não serão mais lidos
+            for path in abandoned_inputs:
+                _remove_input(path)
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run_job(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro inesperado no worker {worker_id}: {e}", file=sys.stderr)
+
+    async def _heartbeat(self, job_id: str, worker_id: str):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await async_database.heartbeat_segmentation_job(job_id, worker_id)
+            except Exception as e:
+                print(f"Erro no heartbeat do job {job_id}: {e}", file=sys.stderr)
+
+    async def _run_job(self, job: Dict[str, Any], worker_id: str):
+        job_id = job['id']
+        print(f"Job {job_id} iniciado por {worker_id} (tentativa {job['attempts'] + 1}).", file=sys.stderr)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, worker_id))
+
+        async def progress(stage: str, fraction: float):
+            await async_database.update_segmentation_job_progress(job_id, worker_id, stage, fraction)
+
+        try:
+            # Importado aqui: o pipeline carrega pandas e numpy
+            from segmentation_service.pipeline import analyze_customers, dataset_cache, load_customer_dataset
+            options = SegmentationOptions(**job['params'])
+            await progress("parsing", 0.1)
+            dataset_id, customer_df = await asyncio.to_thread(
+                load_customer_dataset, job['input_path'], options.streamingIngestion
+            )
+            if dataset_cache.enabled:
+                await async_database.register_user_dataset(job['user_id'], dataset_id, len(customer_df))
+            analysis_id, output = await analyze_customers(
+                self.service, customer_df, options, job['user_id'], progress
+            )
+            finished = await async_database.finish_segmentation_job(
+                job_id, worker_id, analysis_id=analysis_id, result=output.model_dump_json()
+            )
+            print(f"Job {job_id} concluído (análise {analysis_id}).", file=sys.stderr)
+        except asyncio.CancelledError:
+            # Shutdown: o job fica 'running' e volta para a fila quando o heartbeat expirar
+            raise
+        except Exception as e:
+            print(f"Job {job_id} falhou: {e}", file=sys.stderr)
+            finished = await async_database.finish_segmentation_job(job_id, worker_id, error=str(e))
+        finally:
+            heartbeat.cancel()
+        # Sem a reserva (o job voltou para a fila e outro worker o assumiu), o arquivo
+        # de entrada pertence ao novo dono
+        if finished:
+            _remove_input(job['input_path'])
+        else:
+            print(f"Job {job_id}: {worker_id} perdeu a reserva; o arquivo de entrada fica com o novo dono.", file=sys.stderr)
+
+
+def _remove_input(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
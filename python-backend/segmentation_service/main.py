@@ -1,21 +1,32 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Form
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, status, File, UploadFile, Form, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import importlib
+import json
 import sys
 import os
-import pandas as pd
-import io
-from typing import List
+from typing import Any, Dict, List, Optional
 
 # Adiciona a pasta 'common' ao sys.path para permitir importações
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from common.models import (
-    MarketSegmentationInsightsInput, MarketSegmentationInsightsOutput, 
-    AnalysisMetadata, User, DataTreatment # Importar DataTreatment
+    MarketSegmentationInsightsOutput, AnalysisMetadata, AnalysisSearchResult, User, DatasetInfo,
+    ClusterRecommendation, ClusterRecommendationOptions, DataTreatment, K_SELECTION_MAX_K, K_SELECTION_MIN_K, IncrementalAnalysisResult, SegmentationOptions, SegmentationJobSubmitted, SegmentationJobStatus
 )
-from common.ai_service import GeminiMarketingService
+from common.ai_service import get_shared_service
 from common.auth import get_current_user # IMPORTAR AUTENTICAÇÃO
-from common import database # IMPORTAR FUNÇÕES DO DATABASE
+from common import async_database # FUNÇÕES DO DATABASE, FORA DO EVENT LOOP
+from common import export
+from common.database import JOB_TERMINAL_STATUSES, init_db
+from common.uploads import should_stream, spool_upload_to_disk
+from common.json_stream import NDJSON_HEADERS, ndjson_event
+from common.llm_governance import LLMDeadlineExceeded, UpstreamUnavailable, http_exception_for
+from common.metrics import install_metrics, register_stats_collectors
+from common.startup import ServiceReadiness
+from segmentation_service.jobs import JOB_UPLOAD_DIR, SegmentationJobRunner
+# O pipeline (pandas, numpy) é importado sob demanda ou no warm-up: ver _pipeline()
 
 app = FastAPI(
     title="MarketWise - Serviço de Segmentação",
@@ -28,111 +39,585 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Dataset-Id"],
 )
+install_metrics(app, "segmentation_service")
+
+# Paginação do histórico
+DEFAULT_HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+# Busca textual no histórico
+MAX_SEARCH_QUERY_LENGTH = 200
+# Datasets listados em /api/datasets
+MAX_LISTED_DATASETS = 50
+# Intervalo de consulta do status do job no stream de eventos
+JOB_EVENTS_POLL_SECONDS = 1.0
 
 try:
-    service = GeminiMarketingService()
+    service = get_shared_service()
 except Exception as e:
     print(f"ERRO FATAL ao inicializar o GeminiMarketingService no segmentation_service: {e}", file=sys.stderr)
     sys.exit(1)
 
+job_runner = SegmentationJobRunner(service)
+register_stats_collectors(service)
+readiness = ServiceReadiness("segmentation_service")
+readiness.mark("imported")
+
+# Rotas da API: incluídas no app deste serviço (no fim do arquivo) e no gateway (gateway/main.py)
+router = APIRouter()
+
+
+def _pipeline():
+    """Módulo do pipeline de segmentação; o primeiro import carrega pandas e numpy."""
+    return importlib.import_module("segmentation_service.pipeline")
+
+async def _preload_pipeline():
+    await asyncio.to_thread(_pipeline)
+
+@app.on_event("startup")
+async def on_startup():
+    """
+    Garante o schema (fila de jobs) e inicia os workers de jobs de segmentação.
+    O pipeline e o modelo da IA são preparados em segundo plano (ver /ready).
+    """
+    await async_database.run_db(init_db)
+    start_service()
+
+def start_service():
+    """Startup sem o schema (também usado pelo gateway, que cria o schema uma única vez)."""
+    job_runner.start()
+    readiness.start_warmup(_preload_pipeline, service.warm_up)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Para os workers, encerra os pools (avaliação de k, banco de dados) e fecha as conexões do pool."""
+    await readiness.stop()
+    await job_runner.stop()
+    # O pool vive em common.k_selection (o import do pipeline pode estar pela metade se o warm-up foi cancelado)
+    pool = getattr(sys.modules.get("common.k_selection"), "k_selection_pool", None)
+    if pool is not None:
+        pool.shutdown()
+    async_database.shutdown_executor()
+
+@app.get("/ready")
+async def readiness_endpoint():
+    """Prontidão do serviço (503 até o warm-up terminar) e tempos de inicialização."""
+    status_code = status.HTTP_200_OK if readiness.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(readiness.status(), status_code=status_code)
+
+
+def segmentation_options_form(
+    numberOfClusters: int = Form(...),
+    normalize: bool = Form(...),
+    excludeNulls: bool = Form(...),
+    groupCategories: bool = Form(...),
+    streamingIngestion: bool = Form(False),
+    localClustering: bool = Form(False),
+    compactPrompt: bool = Form(False),
+    bypassCache: bool = Form(False)
+) -> SegmentationOptions:
+    """Campos do formulário multipart comuns às rotas de segmentação."""
+    return SegmentationOptions(
+        numberOfClusters=numberOfClusters,
+        normalize=normalize,
+        excludeNulls=excludeNulls,
+        groupCategories=groupCategories,
+        streamingIngestion=streamingIngestion,
+        localClustering=localClustering,
+        compactPrompt=compactPrompt,
+        bypassCache=bypassCache
+    )
+
+def cluster_recommendation_form(
+    normalize: bool = Form(...),
+    excludeNulls: bool = Form(...),
+    groupCategories: bool = Form(...),
+    minK: int = Form(K_SELECTION_MIN_K),
+    maxK: int = Form(K_SELECTION_MAX_K),
+    streamingIngestion: bool = Form(False)
+) -> ClusterRecommendationOptions:
+    """Campos do formulário multipart das rotas de recomendação do número de clusters."""
+    return ClusterRecommendationOptions(
+        normalize=normalize,
+        excludeNulls=excludeNulls,
+        groupCategories=groupCategories,
+        minK=minK,
+        maxK=maxK,
+        streamingIngestion=streamingIngestion
+    )
+
+
+async def _recommend_clusters(
+    pipeline, dataset_id: Optional[str], customer_df, options: ClusterRecommendationOptions
+) -> ClusterRecommendation:
+    """Executa a recomendação traduzindo os erros do pipeline para respostas HTTP."""
+    data_treatment = DataTreatment(
+        normalize=options.normalize,
+        excludeNulls=options.excludeNulls,
+        groupCategories=options.groupCategories
+    )
+    try:
+        recommendation = await pipeline.recommend_clusters(customer_df, data_treatment, options.minK, options.maxK)
+    except pipeline.ClusteringError as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    except pipeline.KSelectionPoolSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Muitas recomendações em andamento. Tente novamente em instantes.",
+            headers={"Retry-After": "1"},
+        )
+    recommendation.dataset_id = dataset_id
+    return recommendation
+
+async def _publish_dataset(pipeline, user_id: int, dataset_id: str, customers: int) -> Optional[str]:
+    """
+    Registra o dataset do usuário e retorna o id a anunciar (X-Dataset-Id). Com o cache
+    de datasets desligado a tabela não fica guardada: o id não é anunciado nem registrado.
+    """
+    if not pipeline.dataset_cache.enabled:
+        return None
+    await async_database.register_user_dataset(user_id, dataset_id, customers)
+    return dataset_id
+
 # --- ROTA DE SEGMENTAÇÃO (MODIFICADA) ---
-@app.post("/api/segmentation-insights", response_model=MarketSegmentationInsightsOutput)
+@router.post("/api/segmentation-insights", response_model=MarketSegmentationInsightsOutput)
 async def get_segmentation_insights_endpoint(
+    response: Response,
     # Recebe os dados como multipart/form-data
     current_user: User = Depends(get_current_user), # Protege o endpoint
     file: UploadFile = File(...),
-    numberOfClusters: int = Form(...),
-    normalize: bool = Form(...),
-    excludeNulls: bool = Form(...),
-    groupCategories: bool = Form(...)
+    options: SegmentationOptions = Depends(segmentation_options_form)
 ):
     """
     Endpoint para gerar novos insights de segmentação.
     Recebe um arquivo CSV, processa-o com pandas e envia para a IA.
+    Com streamingIngestion (ou uploads muito grandes) o CSV é lido em blocos.
+    Com localClustering os clusters e suas estatísticas são calculados localmente
+    (k-means) e a IA apenas nomeia e descreve cada segmento.
+    Com compactPrompt a IA recebe um resumo estatístico de tamanho fixo
+    em vez do CSV agregado completo.
+    Com bypassCache a IA é chamada mesmo que exista uma resposta em cache.
+    Com o cache de datasets ligado, o header X-Dataset-Id identifica a tabela agregada, que pode ser reanalisada
+    (ex: com outro numberOfClusters) em /api/datasets/{dataset_id}/segmentation-insights.
     """
+    pipeline = await asyncio.to_thread(_pipeline)
     try:
-        # 1. Ler o CSV com pandas
-        # Usamos io.BytesIO para ler o arquivo em memória
-        # Usamos o delimitador correto
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents), delimiter=';', encoding='utf-8')
-
-        # 2. Engenharia de Features (Agregação por Cliente)
-        # Converte UnitPrice para numérico (substitui vírgula por ponto)
-        df['UnitPrice'] = df['UnitPrice'].astype(str).str.replace(',', '.')
-        df['UnitPrice'] = pd.to_numeric(df['UnitPrice'])
-        
-        # Garante que CustomerID não seja nulo para agregação
-        df.dropna(subset=['CustomerID'], inplace=True)
-        
-        # Calcula o Preço Total da linha
-        df['TotalPrice'] = df['Quantity'] * df['UnitPrice']
-        
-        # Agrega os dados por CustomerID
-        customer_df = df.groupby('CustomerID').agg(
-            TotalGasto=('TotalPrice', 'sum'),
-            Frequencia=('InvoiceNo', 'nunique'),
-            TotalItens=('Quantity', 'sum'),
-            Pais=('Country', 'first')
-        ).reset_index()
+        # Falha rápida com 503 enquanto a IA estiver indisponível
+        service.governor.ensure_available()
+
+        # 1. Ler o CSV e 2. Engenharia de Features (Agregação por Cliente)
+        dataset_id, customer_df = await pipeline.read_upload_dataset(file, should_stream(file, options.streamingIngestion))
+        dataset_id = await _publish_dataset(pipeline, current_user.id, dataset_id, len(customer_df))
+        if dataset_id:
+            response.headers["X-Dataset-Id"] = dataset_id
+
+        # 3, 4 e 5. Monta os inputs, gera a análise com a IA e salva no banco
+        _, validated_output = await pipeline.analyze_customers(service, customer_df, options, current_user.id)
+        return validated_output
         
-        # Converte o DataFrame agregado para uma string CSV
-        aggregated_csv_string = customer_df.to_csv(index=False, sep=';')
-
-        # 3. Montar os inputs para a IA e para o BD
-        data_treatment = DataTreatment(
-            normalize=normalize,
-            excludeNulls=excludeNulls,
-            groupCategories=groupCategories
+    except pipeline.EmptyDataError:
+        raise HTTPException(status_code=400, detail="O arquivo CSV está vazio ou mal formatado.")
+    except pipeline.ClusteringError as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    except (UpstreamUnavailable, LLMDeadlineExceeded) as ue:
+        raise http_exception_for(ue)
+    except Exception as e:
+        print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
+
+
+@router.post("/api/segmentation-insights/stream")
+async def stream_segmentation_insights_endpoint(
+    current_user: User = Depends(get_current_user),
+    file: UploadFile = File(...),
+    options: SegmentationOptions = Depends(segmentation_options_form)
+):
+    """
+    Mesmo que /api/segmentation-insights, mas responde em NDJSON (uma linha JSON por evento):
+    {"event": "segment", "index": n, "data": {...}} para cada segmento assim que a IA o completa,
+    {"event": "result", "analysis_id": id, "dataset_id": "...", "data": {...}} com a saída validada e salva, ou
+    {"event": "error", "detail": "..."} se a geração falhar depois de iniciada.
+    """
+    try:
+        # Falha rápida com 503 enquanto a IA estiver indisponível
+        service.governor.ensure_available()
+    except UpstreamUnavailable as ue:
+        raise http_exception_for(ue)
+    pipeline = await asyncio.to_thread(_pipeline)
+    try:
+        dataset_id, customer_df = await pipeline.read_upload_dataset(file, should_stream(file, options.streamingIngestion))
+        dataset_id = await _publish_dataset(pipeline, current_user.id, dataset_id, len(customer_df))
+        input_data = await pipeline.build_insights_input(customer_df, options)
+    except pipeline.EmptyDataError:
+        raise HTTPException(status_code=400, detail="O arquivo CSV está vazio ou mal formatado.")
+    except pipeline.ClusteringError as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    except Exception as e:
+        print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
+
+    async def events():
+        index = 0
+        try:
+            async for kind, value in service.stream_segmentation_insights(input_data, use_cache=not options.bypassCache):
+                if kind == "segment":
+                    yield ndjson_event("segment", index=index, data=value.model_dump())
+                    index += 1
+                else:
+                    analysis_id = await async_database.save_analysis(
+                        user_id=current_user.id, analysis_input=input_data, analysis_output=value
+                    )
+                    yield ndjson_event("result", analysis_id=analysis_id, dataset_id=dataset_id, data=value.model_dump())
+        except Exception as e:
+            print(f"Erro no streaming de insights: {e}", file=sys.stderr)
+            yield ndjson_event("error", detail=str(e))
+
+    headers = {**NDJSON_HEADERS, "X-Dataset-Id": dataset_id} if dataset_id else NDJSON_HEADERS
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers=headers)
+
+
+# --- ROTAS DE DATASETS (TABELAS AGREGADAS EM CACHE) ---
+
+@router.get("/api/datasets", response_model=List[DatasetInfo])
+async def list_datasets_endpoint(current_user: User = Depends(get_current_user)):
+    """Datasets enviados pelo usuário, do usado mais recentemente para o mais antigo."""
+    pipeline = await asyncio.to_thread(_pipeline)
+    rows = await async_database.get_user_datasets(current_user.id, MAX_LISTED_DATASETS)
+    return [DatasetInfo(**row, cached=pipeline.dataset_cache.contains(row['dataset_id'])) for row in rows]
+
+@router.post("/api/datasets/{dataset_id}/segmentation-insights", response_model=MarketSegmentationInsightsOutput)
+async def rerun_segmentation_insights_endpoint(
+    dataset_id: str,
+    current_user: User = Depends(get_current_user),
+    options: SegmentationOptions = Depends(segmentation_options_form)
+):
+    """
+    Nova análise de um dataset já enviado, sem reenviar o arquivo: a tabela agregada
+    vem do cache de datasets. Responde 410 se ela já saiu do cache.
+    """
+    if not await async_database.user_has_dataset(current_user.id, dataset_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset não encontrado")
+    pipeline = await asyncio.to_thread(_pipeline)
+    try:
+        service.governor.ensure_available()
+        customer_df = await asyncio.to_thread(pipeline.load_cached_dataset, dataset_id)
+        if customer_df is None:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="O dataset não está mais em cache. Envie o arquivo novamente."
+            )
+        await async_database.register_user_dataset(current_user.id, dataset_id, len(customer_df))
+        _, validated_output = await pipeline.analyze_customers(service, customer_df, options, current_user.id)
+        return validated_output
+    except HTTPException:
+        raise
+    except pipeline.ClusteringError as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    except (UpstreamUnavailable, LLMDeadlineExceeded) as ue:
+        raise http_exception_for(ue)
+    except Exception as e:
+        print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
+
+
+# --- ROTAS DE ANÁLISES INCREMENTAIS ---
+
+@router.post("/api/incremental-analyses", response_model=IncrementalAnalysisResult)
+async def create_incremental_analysis_endpoint(
+    current_user: User = Depends(get_current_user),
+    file: UploadFile = File(...),
+    options: SegmentationOptions = Depends(segmentation_options_form)
+):
+    """
+    Cria a análise base de uma série incremental (ex: o histórico completo). Os clusters
+    são sempre calculados localmente (localClustering e compactPrompt são ignorados) e o
+    estado agregado por cliente é salvo com a análise, para receber os próximos meses em
+    /api/incremental-analyses/{analysis_id}/transactions.
+    """
+    pipeline = await asyncio.to_thread(_pipeline)
+    try:
+        service.governor.ensure_available()
+        options.streamingIngestion = should_stream(file, options.streamingIngestion)
+        return await pipeline.create_incremental_analysis(service, file, options, current_user.id)
+    except pipeline.EmptyDataError:
+        raise HTTPException(status_code=400, detail="O arquivo CSV está vazio ou mal formatado.")
+    except pipeline.ClusteringError as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    except (UpstreamUnavailable, LLMDeadlineExceeded) as ue:
+        raise http_exception_for(ue)
+    except Exception as e:
+        print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
+
+@router.post("/api/incremental-analyses/{analysis_id}/transactions", response_model=IncrementalAnalysisResult)
+async def append_transactions_endpoint(
+    analysis_id: int,
+    current_user: User = Depends(get_current_user),
+    file: UploadFile = File(...),
+    streamingIngestion: bool = Form(False),
+    regenerateInsights: bool = Form(False),
+    bypassCache: bool = Form(False)
+):
+    """
+    Soma um CSV só com as novas transações a uma análise incremental e salva o resultado
+    como uma nova análise (que pode receber o próximo delta). Os clusters partem dos
+    centróides anteriores e a IA só é chamada se a composição dos segmentos mudar
+    (ou com regenerateInsights); senão os nomes e descrições anteriores são mantidos.
+    Só a análise mais recente da série guarda o estado: as anteriores respondem 409.
+    """
+    base = await async_database.get_analysis_state(analysis_id, current_user.id)
+    previous_output = await async_database.get_analysis_by_id(analysis_id, current_user.id)
+    if base is None or previous_output is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Análise incremental não encontrada")
+    if base["state"] is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"A análise {analysis_id} já recebeu novas transações; envie o delta para a análise {base['superseded_by']}."
         )
-        input_data = MarketSegmentationInsightsInput(
-            clusterData=aggregated_csv_string, # Envia o CSV agregado
-            dataTreatment=data_treatment,
-            numberOfClusters=numberOfClusters
+    pipeline = await asyncio.to_thread(_pipeline)
+    try:
+        # Falha rápida com 503 enquanto a IA estiver indisponível
+        service.governor.ensure_available()
+        return await pipeline.append_transactions(
+            service, base, previous_output, analysis_id, file,
+            should_stream(file, streamingIngestion), current_user.id,
+            regenerate_insights=regenerateInsights, use_cache=not bypassCache
         )
+    except pipeline.EmptyDataError:
+        raise HTTPException(status_code=400, detail="O arquivo CSV está vazio ou mal formatado.")
+    except pipeline.ClusteringError as ce:
+        raise HTTPException(status_code=400, detail=str(ce))
+    except (UpstreamUnavailable, LLMDeadlineExceeded) as ue:
+        raise http_exception_for(ue)
+    except Exception as e:
+        print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
 
-        # 4. Gera a análise usando a IA
-        #
-        validated_output = await service.generate_segmentation_insights(input_data)
-        
-        # 5. Salva a análise no banco de dados
-        #
-        database.save_analysis(
-            user_id=current_user.id,
-            analysis_input=input_data, # Salva o input que foi para a IA
-            analysis_output=validated_output
-        )
-        
-        return validated_output
-        
-    except pd.errors.EmptyDataError:
+
+# --- ROTAS DE RECOMENDAÇÃO DO NÚMERO DE CLUSTERS ---
+
+@router.post("/api/cluster-recommendations", response_model=ClusterRecommendation)
+async def recommend_clusters_endpoint(
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    file: UploadFile = File(...),
+    options: ClusterRecommendationOptions = Depends(cluster_recommendation_form)
+):
+    """
+    Avalia k de minK a maxK com o k-means local (em paralelo, sem chamar a IA) e
+    recomenda um numberOfClusters: curva de inércia (cotovelo), silhueta numa amostra
+    limitada de clientes e equilíbrio dos tamanhos dos clusters de cada k.
+    A análise com o k escolhido é feita em /api/datasets/{dataset_id}/segmentation-insights
+    (X-Dataset-Id), sem reenviar o arquivo.
+    """
+    pipeline = await asyncio.to_thread(_pipeline)
+    try:
+        dataset_id, customer_df = await pipeline.read_upload_dataset(file, should_stream(file, options.streamingIngestion))
+    except pipeline.EmptyDataError:
         raise HTTPException(status_code=400, detail="O arquivo CSV está vazio ou mal formatado.")
     except Exception as e:
         print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
         raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
+    dataset_id = await _publish_dataset(pipeline, current_user.id, dataset_id, len(customer_df))
+    if dataset_id:
+        response.headers["X-Dataset-Id"] = dataset_id
+    return await _recommend_clusters(pipeline, dataset_id, customer_df, options)
+
+@router.post("/api/datasets/{dataset_id}/cluster-recommendations", response_model=ClusterRecommendation)
+async def recommend_clusters_for_dataset_endpoint(
+    dataset_id: str,
+    current_user: User = Depends(get_current_user),
+    options: ClusterRecommendationOptions = Depends(cluster_recommendation_form)
+):
+    """Mesmo que /api/cluster-recommendations para um dataset já enviado (410 se saiu do cache)."""
+    if not await async_database.user_has_dataset(current_user.id, dataset_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset não encontrado")
+    pipeline = await asyncio.to_thread(_pipeline)
+    customer_df = await asyncio.to_thread(pipeline.load_cached_dataset, dataset_id)
+    if customer_df is None:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="O dataset não está mais em cache. Envie o arquivo novamente."
+        )
+    return await _recommend_clusters(pipeline, dataset_id, customer_df, options)
+
+
+# --- ROTAS DE JOBS ASSÍNCRONOS DE SEGMENTAÇÃO ---
+
+def _job_status(job: Dict[str, Any]) -> SegmentationJobStatus:
+    result = job.get('result')
+    return SegmentationJobStatus(
+        job_id=job['id'],
+        status=job['status'],
+        stage=job['stage'],
+        progress=job['progress'],
+        analysis_id=job['analysis_id'],
+        error=job['error'],
+        result=MarketSegmentationInsightsOutput.model_validate_json(result) if result else None,
+        created_at=job['created_at'],
+        updated_at=job['updated_at']
+    )
+
+@router.post("/api/segmentation-jobs", response_model=SegmentationJobSubmitted, status_code=status.HTTP_202_ACCEPTED)
+async def submit_segmentation_job_endpoint(
+    current_user: User = Depends(get_current_user),
+    file: UploadFile = File(...),
+    options: SegmentationOptions = Depends(segmentation_options_form)
+):
+    """
+    Enfileira uma segmentação e retorna imediatamente o id do job.
+    Aceita os mesmos campos de /api/segmentation-insights.
+    """
+    options.streamingIngestion = should_stream(file, options.streamingIngestion)
+    upload_path = await spool_upload_to_disk(file, directory=JOB_UPLOAD_DIR)
+    try:
+        job_id = await job_runner.submit(current_user.id, upload_path, options)
+    except Exception as e:
+        os.remove(upload_path)
+        print(f"Erro ao enfileirar job: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail="Erro ao enfileirar a segmentação.")
+    return SegmentationJobSubmitted(job_id=job_id, status="queued")
+
+@router.get("/api/segmentation-jobs/{job_id}", response_model=SegmentationJobStatus)
+async def get_segmentation_job_endpoint(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Status, etapa atual, progresso e (quando concluído) o resultado do job."""
+    job = await async_database.get_segmentation_job(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job não encontrado")
+    return _job_status(job)
+
+@router.get("/api/segmentation-jobs/{job_id}/events")
+async def stream_segmentation_job_events_endpoint(
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Server-sent events com o progresso do job, até que ele termine."""
+    job = await async_database.get_segmentation_job(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job não encontrado")
+
+    async def events():
+        last_update = None
+        current = job
+        while True:
+            if current['updated_at'] != last_update:
+                last_update = current['updated_at']
+                status_data = _job_status(current)
+                event = status_data.status if status_data.status in JOB_TERMINAL_STATUSES else "progress"
+                yield f"event: {event}\ndata: {status_data.model_dump_json()}\n\n"
+                if status_data.status in JOB_TERMINAL_STATUSES:
+                    return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            current = await async_database.get_segmentation_job(job_id, current_user.id)
+            if current is None:
+                # Job removido durante o stream (ex.: limpeza de jobs antigos): encerra com um evento terminal
+                yield f"event: error\ndata: {json.dumps({'job_id': job_id, 'detail': 'Job não encontrado'}, ensure_ascii=False)}\n\n"
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 # --- ROTAS DE HISTÓRICO (Sem alteração) ---
 
-@app.get("/api/segmentation-analyses", response_model=List[AnalysisMetadata])
+@router.get("/api/segmentation-analyses", response_model=List[AnalysisMetadata])
 async def get_saved_analyses_endpoint(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Histórico de análises, da mais recente para a mais antiga.
+    Com limit e/ou cursor a resposta é paginada: o cursor da próxima página
+    vem no header X-Next-Cursor (ausente na última página).
+    """
     try:
-        analyses = database.get_all_analyses(user_id=current_user.id)
+        if limit is None and cursor is None:
+            return await async_database.get_all_analyses(user_id=current_user.id)
+
+        analyses, next_cursor = await async_database.get_analyses_page(
+            user_id=current_user.id, limit=limit or DEFAULT_HISTORY_PAGE_SIZE, cursor=cursor
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return analyses
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         print(f"Erro ao buscar histórico: {e}", file=sys.stderr)
         raise HTTPException(status_code=500, detail="Erro ao buscar histórico de análises.")
 
-@app.get("/api/segmentation-analyses/{analysis_id}", response_model=MarketSegmentationInsightsOutput)
+# Declaradas antes de /{analysis_id} para "search" e "export" não serem lidos como id
+@router.get("/api/segmentation-analyses/search", response_model=List[AnalysisSearchResult])
+async def search_analyses_endpoint(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_SEARCH_QUERY_LENGTH),
+    limit: int = Query(DEFAULT_HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Busca nos insights e nos nomes/descrições dos segmentos das análises do usuário,
+    da mais para a menos relevante. Todas as palavras precisam aparecer (a última
+    também como prefixo); acentos e maiúsculas são ignorados. A relevância ordena as
+    SEARCH_RANK_WINDOW análises mais recentes encontradas; as mais antigas vêm depois,
+    da mais recente para a mais antiga. O cursor da próxima página vem no header
+    X-Next-Cursor (ausente na última página).
+    """
+    try:
+        results, next_cursor = await async_database.search_analyses(
+            user_id=current_user.id, text=q, limit=limit, cursor=cursor
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        print(f"Erro na busca de análises: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail="Erro ao buscar análises.")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
+
+@router.get("/api/segmentation-analyses/export")
+def export_analyses_endpoint(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Exporta as análises do usuário com os seus segmentos (ndjson: uma análise por linha;
+    csv e parquet: uma linha por segmento). `since` (inclusivo) e `until` (exclusivo) em
+    ISO 8601, UTC. A resposta é gerada enquanto o banco é lido, sem montar o arquivo em memória.
+    """
+    if not export.is_format_available(format):
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="A exportação em Parquet requer o pyarrow no servidor.")
+    try:
+        since, until = export.parse_export_timestamp(since), export.parse_export_timestamp(until)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    # Gerador síncrono: o StreamingResponse o consome no threadpool, fora do event loop
+    return StreamingResponse(
+        export.export_analyses(format, user_id=current_user.id, since=since, until=until),
+        media_type=export.EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="analises.{format}"'},
+    )
+
+@router.get("/api/segmentation-analyses/{analysis_id}", response_model=MarketSegmentationInsightsOutput)
 async def get_saved_analysis_by_id_endpoint(
     analysis_id: int,
     current_user: User = Depends(get_current_user)
 ):
     try:
-        analysis = database.get_analysis_by_id(analysis_id=analysis_id, user_id=current_user.id)
+        analysis = await async_database.get_analysis_by_id(analysis_id=analysis_id, user_id=current_user.id)
         if not analysis:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Análise não encontrada")
         return analysis
@@ -143,6 +628,23 @@ async def get_saved_analysis_by_id_endpoint(
         raise HTTPException(status_code=500, detail="Erro ao buscar análise.")
 
 
+@router.get("/api/segmentation-analyses/{analysis_id}/data", response_class=PlainTextResponse)
+async def get_saved_analysis_data_endpoint(
+    analysis_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Retorna o CSV agregado usado na análise."""
+    try:
+        csv_data = await async_database.get_analysis_csv_data(analysis_id=analysis_id, user_id=current_user.id)
+    except Exception as e:
+        print(f"Erro ao buscar dados da análise: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail="Erro ao buscar dados da análise.")
+    if csv_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Análise não encontrada")
+    return PlainTextResponse(csv_data, media_type="text/csv")
+
 @app.get("/")
 def read_root():
-    return {"Hello": "Serviço de Segmentação MarketWise AI"}
\ No newline at end of file
+    return {"Hello": "Serviço de Segmentação MarketWise AI"}
+
+app.include_router(router)
@@ -0,0 +1,356 @@
+# python-backend/segmentation_service/pipeline.py
+
+import asyncio
+import io
+import os
+import sys
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+from fastapi import UploadFile
+from pandas.errors import EmptyDataError
+
+from common.models import (
+    MarketSegmentationInsightsInput, MarketSegmentationInsightsOutput,
+    ClusterRecommendation, DataTreatment, IncrementalAnalysisResult, SegmentationOptions
+)
+from common.ai_service import GeminiMarketingService
+from common import async_database
+from common.clustering import ClusteringError, ClusteringResult, cluster_customers
+from common.dataset_cache import dataset_cache, dataset_id_for_file, new_dataset_hasher
+from common.k_selection import KSelectionPoolSaturated, k_selection_pool
+from common.incremental import INCREMENTAL_ANALYSES, composition_shift, dump_state, load_state
+from common.ingestion import (
+    CustomerAggregator, aggregate_customers, aggregate_customers_streaming, read_transactions,
+    stream_into_aggregator
+)
+from common.metrics import stage_timer
+from common.prompt_sketch import build_profile_sketch
+from common.uploads import spool_upload_to_disk
+
+# Este módulo carrega pandas e numpy: as rotas o importam sob demanda (ou no warm-up),
+# por isso ClusteringError, EmptyDataError e KSelectionPoolSaturated também são expostas por aqui.
+
+# Recebe (etapa, progresso de 0 a 1)
+ProgressCallback = Callable[[str, float], Awaitable[None]]
+
+
+async def _report(progress: Optional[ProgressCallback], stage: str, fraction: float):
+    if progress is not None:
+        await progress(stage, fraction)
+
+
+def load_customer_table(path: str, streaming: bool) -> pd.DataFrame:
+    """Lê o CSV de transações do disco e agrega por cliente."""
+    if streaming:
+        with stage_timer("aggregate_streaming"):
+            return aggregate_customers_streaming(path)
+    with stage_timer("read_csv"):
+        df = read_transactions(path)
+    with stage_timer("aggregate"):
+        return aggregate_customers(df)
+
+
+def load_cached_dataset(dataset_id: str) -> Optional[pd.DataFrame]:
+    """Tabela agregada do cache de datasets (None se não estiver em cache)."""
+    with stage_timer("dataset_cache_read"):
+        return dataset_cache.get(dataset_id)
+
+
+def store_dataset(dataset_id: str, customer_df: pd.DataFrame):
+    """Guarda a tabela agregada no cache; uma falha aqui não interrompe a análise."""
+    try:
+        with stage_timer("dataset_cache_write"):
+            dataset_cache.put(dataset_id, customer_df)
+    except Exception as e:
+        print(f"Erro ao gravar no cache de datasets: {e}", file=sys.stderr)
+
+
+def load_customer_dataset(path: str, streaming: bool) -> Tuple[str, pd.DataFrame]:
+    """Como load_customer_table, mas reaproveita a tabela agregada se o arquivo já foi processado."""
+    with stage_timer("dataset_hash"):
+        dataset_id = dataset_id_for_file(path)
+    customer_df = load_cached_dataset(dataset_id)
+    if customer_df is None:
+        customer_df = load_customer_table(path, streaming)
+        store_dataset(dataset_id, customer_df)
+    return dataset_id, customer_df
+
+
+async def read_upload_dataset(file: UploadFile, streaming: bool) -> Tuple[str, pd.DataFrame]:
+    """
+    Etapas 1 e 2: lê o CSV enviado e agrega as transações por cliente.
+    Retorna (datasetId, tabela agregada); um arquivo já enviado antes (mesmo conteúdo)
+    é lido do cache de datasets, sem repetir a leitura e a agregação.
+    """
+    hasher = new_dataset_hasher()
+    if streaming:
+        # Modo streaming: grava o upload em disco (calculando o hash) e agrega em blocos,
+        # mantendo a memória proporcional ao número de clientes
+        with stage_timer("upload_spool"):
+            upload_path = await spool_upload_to_disk(file, hasher=hasher)
+        try:
+            dataset_id = hasher.hexdigest()
+            customer_df = await asyncio.to_thread(load_cached_dataset, dataset_id)
+            if customer_df is not None:
+                return dataset_id, customer_df
+            with stage_timer("aggregate_streaming"):
+                customer_df = aggregate_customers_streaming(upload_path)
+        finally:
+            os.remove(upload_path)
+    else:
+        with stage_timer("upload_read"):
+            contents = await file.read()
+        with stage_timer("dataset_hash"):
+            await asyncio.to_thread(hasher.update, contents)
+        dataset_id = hasher.hexdigest()
+        customer_df = await asyncio.to_thread(load_cached_dataset, dataset_id)
+        if customer_df is not None:
+            return dataset_id, customer_df
+        # Usamos io.BytesIO para ler o arquivo em memória
+        # (apenas as colunas usadas, com tipos declarados: ver read_transactions)
+        with stage_timer("read_csv"):
+            df = read_transactions(io.BytesIO(contents))
+        with stage_timer("aggregate"):
+            customer_df = aggregate_customers(df)
+    await asyncio.to_thread(store_dataset, dataset_id, customer_df)
+    return dataset_id, customer_df
+
+
+async def recommend_clusters(
+    customer_df: pd.DataFrame,
+    data_treatment: DataTreatment,
+    min_k: int,
+    max_k: int
+) -> ClusterRecommendation:
+    """Avalia k de min_k a max_k em paralelo (pool de processos) e recomenda o numberOfClusters."""
+    with stage_timer("k_selection"):
+        return await k_selection_pool.recommend(customer_df, data_treatment, min_k, max_k)
+
+
+async def build_insights_input(
+    customer_df: pd.DataFrame,
+    options: SegmentationOptions,
+    progress: Optional[ProgressCallback] = None
+) -> MarketSegmentationInsightsInput:
+    """Etapa 3 da segmentação: monta o input para a IA e para o BD."""
+    # 3. Montar os inputs para a IA e para o BD
+    await _report(progress, "preparing", 0.3)
+    # Converte o DataFrame agregado para uma string CSV
+    with stage_timer("serialize_csv"):
+        aggregated_csv_string = await asyncio.to_thread(customer_df.to_csv, index=False, sep=';')
+    data_treatment = DataTreatment(
+        normalize=options.normalize,
+        excludeNulls=options.excludeNulls,
+        groupCategories=options.groupCategories
+    )
+    input_data = MarketSegmentationInsightsInput(
+        clusterData=aggregated_csv_string, # Envia o CSV agregado
+        dataTreatment=data_treatment,
+        numberOfClusters=options.numberOfClusters
+    )
+    if options.compactPrompt:
+        with stage_timer("prompt_sketch"):
+            input_data.promptSketch = await asyncio.to_thread(build_profile_sketch, customer_df)
+    if options.localClustering:
+        await _report(progress, "clustering", 0.4)
+        with stage_timer("clustering"):
+            clustering = await asyncio.to_thread(
+                cluster_customers, customer_df, options.numberOfClusters, data_treatment
+            )
+        input_data.clusterProfiles = clustering.profiles
+    return input_data
+
+
+async def analyze_customers(
+    service: GeminiMarketingService,
+    customer_df: pd.DataFrame,
+    options: SegmentationOptions,
+    user_id: int,
+    progress: Optional[ProgressCallback] = None
+) -> Tuple[int, MarketSegmentationInsightsOutput]:
+    """
+    Etapas 3 a 5 da segmentação: monta o input, chama a IA e salva a análise.
+    Retorna (id da análise salva, saída validada).
+    """
+    input_data = await build_insights_input(customer_df, options, progress)
+
+    # 4. Gera a análise usando a IA
+    await _report(progress, "generating_insights", 0.5)
+    with stage_timer("insights"):
+        validated_output = await service.generate_segmentation_insights(input_data, use_cache=not options.bypassCache)
+
+    # 5. Salva a análise no banco de dados
+    await _report(progress, "saving", 0.9)
+    with stage_timer("save_analysis"):
+        analysis_id = await async_database.save_analysis(
+            user_id=user_id,
+            analysis_input=input_data, # Salva o input que foi para a IA
+            analysis_output=validated_output
+        )
+    return analysis_id, validated_output
+
+
+# --- Análises incrementais ---
+
+async def read_upload_aggregator(
+    file: UploadFile,
+    streaming: bool,
+    new_aggregator: Callable[[], CustomerAggregator] = CustomerAggregator
+) -> CustomerAggregator:
+    """
+    Lê o CSV enviado para um agregador por cliente (vazio ou, para um delta,
+    carregado com o estado de uma análise anterior).
+    """
+    if streaming:
+        with stage_timer("upload_spool"):
+            upload_path = await spool_upload_to_disk(file)
+        try:
+            with stage_timer("aggregate_streaming"):
+                return await asyncio.to_thread(stream_into_aggregator, upload_path, new_aggregator)
+        finally:
+            os.remove(upload_path)
+    with stage_timer("upload_read"):
+        contents = await file.read()
+    with stage_timer("read_csv"):
+        df = await asyncio.to_thread(read_transactions, io.BytesIO(contents))
+    aggregator = new_aggregator()
+    with stage_timer("aggregate"):
+        await asyncio.to_thread(aggregator.update, df)
+    return aggregator
+
+
+async def _incremental_input(
+    customer_df: pd.DataFrame,
+    clustering: ClusteringResult,
+    data_treatment: DataTreatment,
+    number_of_clusters: int
+) -> MarketSegmentationInsightsInput:
+    with stage_timer("serialize_csv"):
+        aggregated_csv_string = await asyncio.to_thread(customer_df.to_csv, index=False, sep=';')
+    return MarketSegmentationInsightsInput(
+        clusterData=aggregated_csv_string,
+        dataTreatment=data_treatment,
+        numberOfClusters=number_of_clusters,
+        clusterProfiles=clustering.profiles
+    )
+
+
+async def _save_incremental_analysis(
+    user_id: int,
+    input_data: MarketSegmentationInsightsInput,
+    output: MarketSegmentationInsightsOutput,
+    aggregator: CustomerAggregator,
+    clustering: ClusteringResult,
+    parent_analysis_id: Optional[int]
+) -> int:
+    with stage_timer("incremental_state_dump"):
+        state = await asyncio.to_thread(dump_state, aggregator, clustering)
+    with stage_timer("save_analysis"):
+        return await async_database.save_analysis(
+            user_id, input_data, output, state=state, customers=aggregator.customers,
+            parent_analysis_id=parent_analysis_id
+        )
+
+
+async def create_incremental_analysis(
+    service: GeminiMarketingService,
+    file: UploadFile,
+    options: SegmentationOptions,
+    user_id: int
+) -> IncrementalAnalysisResult:
+    """
+    Análise base de uma série incremental: clusterização local (k-means) e, junto
+    com a análise, o estado agregado por cliente que recebe os próximos deltas.
+    """
+    aggregator = await read_upload_aggregator(file, options.streamingIngestion)
+    customer_df = aggregator.result()
+    data_treatment = DataTreatment(
+        normalize=options.normalize,
+        excludeNulls=options.excludeNulls,
+        groupCategories=options.groupCategories
+    )
+    with stage_timer("clustering"):
+        clustering = await asyncio.to_thread(
+            cluster_customers, customer_df, options.numberOfClusters, data_treatment
+        )
+    input_data = await _incremental_input(customer_df, clustering, data_treatment, options.numberOfClusters)
+    with stage_timer("insights"):
+        output = await service.generate_segmentation_insights(input_data, use_cache=not options.bypassCache)
+    analysis_id = await _save_incremental_analysis(user_id, input_data, output, aggregator, clustering, None)
+    INCREMENTAL_ANALYSES.inc(llm="invoked")
+    return IncrementalAnalysisResult(
+        analysis_id=analysis_id,
+        customers=aggregator.customers,
+        new_customers=aggregator.customers,
+        transactions_read=aggregator.rows_read,
+        llm_invoked=True,
+        result=output
+    )
+
+
+async def append_transactions(
+    service: GeminiMarketingService,
+    base: Dict[str, Any],
+    previous_output: MarketSegmentationInsightsOutput,
+    parent_analysis_id: int,
+    file: UploadFile,
+    streaming: bool,
+    user_id: int,
+    regenerate_insights: bool = False,
+    use_cache: bool = True
+) -> IncrementalAnalysisResult:
+    """
+    Soma um CSV apenas com as novas transações ao estado de uma análise incremental
+    (`base`, ver async_database.get_analysis_state) e salva o resultado como nova análise.
+    O k-means parte dos centróides anteriores; a IA só é chamada quando a composição
+    dos segmentos muda (ver CompositionShift) ou com regenerate_insights. Caso contrário
+    os nomes e descrições anteriores são mantidos, com os números dos novos clusters.
+    """
+    with stage_timer("incremental_state_load"):
+        base_aggregator, model = await asyncio.to_thread(load_state, base["state"])
+    # update() não altera os DataFrames do estado: cada tentativa parte de uma cópia rasa
+    aggregator = await read_upload_aggregator(
+        file, streaming, lambda: CustomerAggregator.from_state(*base_aggregator.state())
+    )
+    customer_df = aggregator.result()
+    data_treatment = DataTreatment(
+        normalize=base["normalize"],
+        excludeNulls=base["excludeNulls"],
+        groupCategories=base["groupCategories"]
+    )
+    number_of_clusters = base["number_of_clusters"]
+    with stage_timer("clustering"):
+        clustering = await asyncio.to_thread(
+            cluster_customers, customer_df, number_of_clusters, data_treatment, model.centroids
+        )
+    shift = composition_shift(model, clustering)
+    input_data = await _incremental_input(customer_df, clustering, data_treatment, number_of_clusters)
+
+    llm_invoked = regenerate_insights or shift.shifted
+    if llm_invoked:
+        with stage_timer("insights"):
+            output = await service.generate_segmentation_insights(input_data, use_cache=use_cache)
+    else:
+        output = GeminiMarketingService._apply_cluster_profiles(
+            previous_output.model_copy(deep=True), clustering.profiles
+        )
+    INCREMENTAL_ANALYSES.inc(llm="invoked" if llm_invoked else "reused")
+
+    analysis_id = await _save_incremental_analysis(
+        user_id, input_data, output, aggregator, clustering, parent_analysis_id
+    )
+    print(f"Análise incremental {analysis_id} (base {parent_analysis_id}): {aggregator.rows_read} novas linhas, "
+          f"variação={shift.share_shift}, migração={shift.migrated_share}, IA={'sim' if llm_invoked else 'não'}.",
+          file=sys.stderr)
+    return IncrementalAnalysisResult(
+        analysis_id=analysis_id,
+        parent_analysis_id=parent_analysis_id,
+        customers=aggregator.customers,
+        new_customers=aggregator.customers - base_aggregator.customers,
+        transactions_read=aggregator.rows_read,
+        segment_share_shift=shift.share_shift,
+        migrated_customers_share=shift.migrated_share,
+        llm_invoked=llm_invoked,
+        result=output
+    )
@@ -1,14 +1,24 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 import sys
 import os
 
 # Adiciona a pasta 'common' ao sys.path para permitir importações
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from common.models import MarketingStrategiesInput, MarketingStrategiesOutput, User
-from common.ai_service import GeminiMarketingService
+from common.models import (
+    MarketingStrategiesInput, MarketingStrategiesOutput, User, Segment,
+    BatchMarketingStrategiesInput, BatchMarketingStrategiesOutput, SegmentDescription
+)
+from common.ai_service import get_shared_service
 from common.auth import get_current_user # IMPORTAR AUTENTICAÇÃO
+from common import async_database
+from common.database import init_db
+from common.json_stream import NDJSON_HEADERS, ndjson_event
+from common.llm_governance import LLMDeadlineExceeded, UpstreamUnavailable, http_exception_for
+from common.metrics import install_metrics, register_stats_collectors
+from common.startup import ServiceReadiness
 
 app = FastAPI(
 # ... (código existente, sem alterações)
@@ -24,27 +34,61 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+install_metrics(app, "strategy_service")
 
 # Instancia o serviço OOP
 try:
 # ... (código existente, sem alterações)
-    service = GeminiMarketingService()
+    service = get_shared_service()
 except Exception as e:
     print(f"ERRO FATAL ao inicializar o GeminiMarketingService: {e}", file=sys.stderr)
     sys.exit(1)
 
-@app.post("/api/marketing-strategies", response_model=MarketingStrategiesOutput)
+register_stats_collectors(service)
+readiness = ServiceReadiness("strategy_service")
+readiness.mark("imported")
+
+# Rotas da API: incluídas no app deste serviço (no fim do arquivo) e no gateway (gateway/main.py)
+router = APIRouter()
+
+@app.on_event("startup")
+async def on_startup():
+    """Garante o schema (estratégias salvas) e prepara o modelo da IA em segundo plano (ver /ready)."""
+    await async_database.run_db(init_db)
+    start_service()
+
+def start_service():
+    """Startup sem o schema (também usado pelo gateway, que cria o schema uma única vez)."""
+    readiness.start_warmup(service.warm_up)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Encerra o executor do banco de dados e fecha as conexões do pool."""
+    await readiness.stop()
+    async_database.shutdown_executor()
+
+@app.get("/ready")
+async def readiness_endpoint():
+    """Prontidão do serviço (503 até o warm-up terminar) e tempos de inicialização."""
+    status_code = status.HTTP_200_OK if readiness.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(readiness.status(), status_code=status_code)
+
+@router.post("/api/marketing-strategies", response_model=MarketingStrategiesOutput)
 async def get_marketing_strategies_endpoint(
     input_data: MarketingStrategiesInput,
+    bypassCache: bool = False,
     current_user: User = Depends(get_current_user) # PROTEGER ENDPOINT
 ):
     """
     Endpoint para gerar estratégias de marketing personalizadas.
+    Use ?bypassCache=true para ignorar respostas em cache.
     """
     try:
         # Delega a lógica de negócios para a classe de serviço
-        validated_output = await service.generate_marketing_strategies(input_data)
+        validated_output = await service.generate_marketing_strategies(input_data, use_cache=not bypassCache)
         return validated_output
+    except (UpstreamUnavailable, LLMDeadlineExceeded) as ue:
+        raise http_exception_for(ue)
     except ValueError as ve: # Erro de JSON ou validação
 # ... (código existente, sem alterações)
         print(f"Erro de validação ou JSON: {ve}", file=sys.stderr)
@@ -53,10 +97,107 @@ async def get_marketing_strategies_endpoint(
         print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
         raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
 
+@router.post("/api/marketing-strategies/stream")
+async def stream_marketing_strategies_endpoint(
+    input_data: MarketingStrategiesInput,
+    bypassCache: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Mesmo que /api/marketing-strategies, mas responde em NDJSON (uma linha JSON por evento):
+    {"event": "strategy", "index": n, "data": "..."} para cada estratégia assim que a IA a completa,
+    {"event": "result", "data": {...}} com a saída validada, ou
+    {"event": "error", "detail": "..."} se a geração falhar.
+    """
+    try:
+        # Falha rápida com 503 enquanto a IA estiver indisponível
+        service.governor.ensure_available()
+    except UpstreamUnavailable as ue:
+        raise http_exception_for(ue)
+
+    async def events():
+        index = 0
+        try:
+            async for kind, value in service.stream_marketing_strategies(input_data, use_cache=not bypassCache):
+                if kind == "strategy":
+                    yield ndjson_event("strategy", index=index, data=value)
+                    index += 1
+                else:
+                    yield ndjson_event("result", data=value.model_dump())
+        except Exception as e:
+            print(f"Erro no streaming de estratégias: {e}", file=sys.stderr)
+            yield ndjson_event("error", detail=str(e))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers=NDJSON_HEADERS)
+
+def _describe_segment(segment: Segment) -> str:
+    """Atributos de um segmento salvo, no formato de customerSegmentAttributes."""
+    return (
+        f"{segment.description} Tamanho: {segment.size} clientes. "
+        f"Valor médio de compra: {segment.avg_purchase_value:.2f}. "
+        f"Frequência média de compra: {segment.purchase_frequency:.2f}."
+    )
+
+@router.post("/api/marketing-strategies/batch", response_model=BatchMarketingStrategiesOutput)
+async def get_batch_marketing_strategies_endpoint(
+    input_data: BatchMarketingStrategiesInput,
+    bypassCache: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Estratégias para todos os segmentos de uma vez: os de uma análise salva (analysisId)
+    ou uma lista de segmentos, com objetivos de campanha comuns.
+    Para uma análise salva, o resultado também é gravado junto à análise.
+    """
+    if input_data.analysisId is not None:
+        analysis = await async_database.get_analysis_by_id(input_data.analysisId, current_user.id)
+        if not analysis:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Análise não encontrada")
+        if not analysis.segments:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A análise não possui segmentos.")
+        segments = [
+            SegmentDescription(segmentName=segment.name, customerSegmentAttributes=_describe_segment(segment))
+            for segment in analysis.segments
+        ]
+    else:
+        segments = input_data.segments
+
+    try:
+        results = await service.generate_batch_marketing_strategies(
+            segments, input_data.campaignObjectives, use_cache=not bypassCache
+        )
+    except (UpstreamUnavailable, LLMDeadlineExceeded) as ue:
+        raise http_exception_for(ue)
+    except ValueError as ve: # Erro de JSON ou validação
+        print(f"Erro de validação ou JSON: {ve}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=str(ve))
+    except Exception as e:
+        print(f"Erro inesperado no endpoint: {e}", file=sys.stderr)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar a solicitação: {str(e)}")
+
+    if input_data.analysisId is not None:
+        await async_database.save_segment_strategies(input_data.analysisId, input_data.campaignObjectives, results)
+    return BatchMarketingStrategiesOutput(
+        analysisId=input_data.analysisId, campaignObjectives=input_data.campaignObjectives, segments=results
+    )
+
+@router.get("/api/marketing-strategies/batch/{analysis_id}", response_model=BatchMarketingStrategiesOutput)
+async def get_saved_batch_marketing_strategies_endpoint(
+    analysis_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """Estratégias salvas para os segmentos de uma análise."""
+    saved = await async_database.get_segment_strategies(analysis_id, current_user.id)
+    if not saved:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhuma estratégia salva para esta análise")
+    return saved
+
 @app.get("/")
 def read_root():
 # ... (código existente, sem alterações)
     return {"Hello": "Serviço de Estratégias MarketWise AI"}
 
+app.include_router(router)
+
 # Para rodar este serviço:
 # uvicorn strategy_service.main:app --reload --port 8002
\ No newline at end of file
@@ -0,0 +1,26 @@
+# python-backend/tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Banco, caches e uploads num diretório temporário: definidos antes de importar os módulos,
+# que leem a configuração no import
+_TMP_DIR = tempfile.mkdtemp(prefix="marketwise_tests_")
+os.environ.setdefault("DB_PATH", os.path.join(_TMP_DIR, "analyses.db"))
+os.environ.setdefault("LLM_CACHE_DB_PATH", os.path.join(_TMP_DIR, "llm_cache.db"))
+os.environ.setdefault("DATASET_CACHE_DIR", os.path.join(_TMP_DIR, "dataset_cache"))
+os.environ.setdefault("SEGMENTATION_JOB_UPLOAD_DIR", os.path.join(_TMP_DIR, "job_uploads"))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+@pytest.fixture(scope="session")
+def database():
+    from common import database
+    database.init_db()
+    return database
@@ -0,0 +1,142 @@
+# python-backend/tests/test_ai_service.py
+
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from common.ai_service import GeminiMarketingService
+from common.llm_governance import InvalidModelOutput
+from common.llm_providers import LLMProvider
+from common.models import (
+    ClusterProfile, DataTreatment, MarketSegmentationInsightsInput, SegmentDescription, SegmentStrategies
+)
+
+
+class _ScriptedProvider(LLMProvider):
+    """Devolve as respostas dadas, na ordem, e conta as chamadas."""
+
+    name = "scripted"
+
+    def __init__(self, *responses: str):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def generate(self, prompt_text, schema_name):
+        self.calls += 1
+        return self.responses.pop(0)
+
+    async def stream(self, prompt_text, schema_name):
+        self.calls += 1
+        text = self.responses.pop(0)
+        for start in range(0, len(text), 16):
+            yield text[start:start + 16]
+
+
+def _insights(segments: int) -> str:
+    return json.dumps({
+        "textualInsights": "Resumo.",
+        "segments": [
+            {"name": f"Segmento {i}", "size": 0, "avg_purchase_value": 0.0, "purchase_frequency": 0.0,
+             "description": "Descrição."}
+            for i in range(segments)
+        ],
+    })
+
+
+def _profiled_input(clusters: int) -> MarketSegmentationInsightsInput:
+    # País único por teste: a chave do cache vem do prompt, que traz os perfis dos clusters
+    country = uuid.uuid4().hex
+    profiles = [
+        ClusterProfile(cluster_id=i, size=10 + i, avg_purchase_value=1.0, purchase_frequency=2.0,
+                       avg_total_spent=3.0, avg_items=4.0, top_countries={country: 1.0})
+        for i in range(clusters)
+    ]
+    return MarketSegmentationInsightsInput(
+        clusterData="", numberOfClusters=clusters, clusterProfiles=profiles,
+        dataTreatment=DataTreatment(normalize=True, excludeNulls=True, groupCategories=True),
+    )
+
+
+def _segments(*names: str):
+    return [SegmentDescription(segmentName=name, customerSegmentAttributes=f"Atributos de {name}") for name in names]
+
+
+def _generated(*pairs):
+    return [SegmentStrategies(segmentName=name, marketingStrategies=[strategy]) for name, strategy in pairs]
+
+
+def _strategies(matched):
+    return [None if item is None else item.marketingStrategies[0] for item in matched]
+
+
+def test_duplicate_names_keep_their_own_strategies():
+    segments = _segments("Fiéis", "Fiéis", "Novos")
+    generated = _generated(("Fiéis", "a"), ("Fiéis", "b"), ("Novos", "c"))
+    assert _strategies(GeminiMarketingService._match_batch_strategies(segments, generated)) == ["a", "b", "c"]
+
+
+def test_same_names_in_another_order_are_reordered():
+    segments = _segments("Fiéis", "Novos", "Fiéis")
+    generated = _generated(("novos ", "c"), ("Fiéis", "a"), ("Fiéis", "b"))
+    assert _strategies(GeminiMarketingService._match_batch_strategies(segments, generated)) == ["a", "c", "b"]
+
+
+def test_renamed_segments_match_by_position():
+    segments = _segments("Fiéis", "Novos")
+    generated = _generated(("Clientes fiéis", "a"), ("Novos", "b"))
+    assert _strategies(GeminiMarketingService._match_batch_strategies(segments, generated)) == ["a", "b"]
+
+
+def test_missing_items_match_by_name():
+    segments = _segments("Fiéis", "Novos", "Fiéis")
+    generated = _generated(("Fiéis", "a"), ("Fiéis", "b"))
+    assert _strategies(GeminiMarketingService._match_batch_strategies(segments, generated)) == ["a", None, "b"]
+
+
+def test_wrong_segment_count_is_reprompted_and_not_cached():
+    provider = _ScriptedProvider(_insights(3), _insights(2))
+    service = GeminiMarketingService(provider=provider)
+    input_data = _profiled_input(2)
+
+    output = asyncio.run(service.generate_segmentation_insights(input_data))
+    assert [segment.size for segment in output.segments] == [10, 11]
+    # A resposta corrigida foi para o cache; a inválida não
+    assert asyncio.run(service.generate_segmentation_insights(input_data)).segments == output.segments
+    assert provider.calls == 2
+
+
+def test_stream_rejects_extra_segments():
+    provider = _ScriptedProvider(_insights(3))
+    service = GeminiMarketingService(provider=provider)
+
+    async def consume():
+        return [kind async for kind, _ in service.stream_segmentation_insights(_profiled_input(2))]
+
+    with pytest.raises(InvalidModelOutput):
+        asyncio.run(consume())
+
+
+def test_stream_timing_excludes_the_client(monkeypatch):
+    import common.ai_service as ai_service
+
+    observed = {}
+
+    class _Recorder:
+        def observe(self, value, stage):
+            observed[stage] = observed.get(stage, 0.0) + value
+
+    monkeypatch.setattr(ai_service, "STAGE_DURATION", _Recorder())
+    service = GeminiMarketingService(provider=_ScriptedProvider(_insights(3)))
+
+    async def slow_consumer():
+        kinds = []
+        async for kind, _ in service.stream_segmentation_insights(_profiled_input(3)):
+            kinds.append(kind)
+            await asyncio.sleep(0.1)
+        return kinds
+
+    assert asyncio.run(slow_consumer()) == ["segment", "segment", "segment", "result"]
+    # O cliente ficou ~0,4 s com os itens; o modelo respondeu na hora
+    assert observed["llm_stream"] < 0.1
@@ -0,0 +1,108 @@
+# python-backend/tests/test_database.py
+
+import threading
+import uuid
+
+import pytest
+
+from common.models import DataTreatment, MarketSegmentationInsightsInput, MarketSegmentationInsightsOutput, Segment, UserCreate
+
+# Gravações simultâneas do mesmo CSV, repetidas para exercitar intercalações diferentes
+THREADS = 8
+ROUNDS = 20
+
+
+def _new_user(database) -> int:
+    user = UserCreate(email=f"{uuid.uuid4().hex}@example.com", password="senha123", name="Teste")
+    return database.create_user(user, hashed_password="x").id
+
+
+def _analysis(csv_data: str):
+    analysis_input = MarketSegmentationInsightsInput(
+        clusterData=csv_data,
+        dataTreatment=DataTreatment(normalize=True, excludeNulls=True, groupCategories=True),
+        numberOfClusters=1,
+    )
+    analysis_output = MarketSegmentationInsightsOutput(
+        textualInsights="Resumo.",
+        segments=[Segment(name="Segmento 1", size=1, avg_purchase_value=1.0, purchase_frequency=1.0, description="Descrição.")],
+    )
+    return analysis_input, analysis_output
+
+
+def test_concurrent_saves_of_the_same_csv_share_one_blob(database):
+    user_id = _new_user(database)
+    for _ in range(ROUNDS):
+        csv_data = f"CustomerID;TotalGasto\n{uuid.uuid4().int};10.0\n"
+        analysis_input, analysis_output = _analysis(csv_data)
+        barrier = threading.Barrier(THREADS)
+        errors, ids = [], []
+
+        def save():
+            barrier.wait()
+            try:
+                ids.append(database.save_analysis(user_id, analysis_input, analysis_output))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert all(database.get_analysis_csv_data(analysis_id, user_id) == csv_data for analysis_id in ids)
+        with database.get_db_connection() as conn:
+            hashes = {row[0] for row in conn.execute(
+                f"SELECT csv_blob_hash FROM analyses WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+        assert len(ids) == THREADS and len(hashes) == 1
+
+
+def test_collect_unreferenced_blobs_keeps_referenced_ones(database):
+    user_id = _new_user(database)
+    kept_csv = f"CustomerID\n{uuid.uuid4().int}\n"
+    removed_csv = f"CustomerID\n{uuid.uuid4().int}\n"
+    kept_id = database.save_analysis(user_id, *_analysis(kept_csv))
+    removed_id = database.save_analysis(user_id, *_analysis(removed_csv))
+    with database.get_db_connection() as conn:
+        removed_hash = conn.execute("SELECT csv_blob_hash FROM analyses WHERE id = ?", (removed_id,)).fetchone()[0]
+        conn.execute("DELETE FROM analyses WHERE id = ?", (removed_id,))
+        conn.commit()
+
+    assert database.collect_unreferenced_blobs() >= 1
+    assert database.get_analysis_csv_data(kept_id, user_id) == kept_csv
+    with database.get_db_connection() as conn:
+        assert conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (removed_hash,)).fetchone() is None
+
+
+def _search_all(database, user_id: int, text: str, limit: int, between_pages=None):
+    ids, cursor = [], None
+    while True:
+        results, cursor = database.search_analyses(user_id, text, limit, cursor)
+        ids += [result.id for result in results]
+        if cursor is None:
+            return ids
+        if between_pages:
+            between_pages()
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_search_pages_past_the_rank_window_and_ignores_new_analyses(database, monkeypatch, limit):
+    user_id = _new_user(database)
+    saved = []
+    for i in range(7):
+        analysis_input, analysis_output = _analysis(f"CustomerID\n{uuid.uuid4().int}\n")
+        analysis_output.textualInsights = "Clientes fiéis " + "fiéis " * i
+        saved.append(database.save_analysis(user_id, analysis_input, analysis_output))
+    monkeypatch.setattr(database, "SEARCH_RANK_WINDOW", 3)
+
+    def save_another():
+        # Seria a mais relevante e muda as estatísticas do BM25, mas foi salva depois da primeira página
+        analysis_input, analysis_output = _analysis(f"CustomerID\n{uuid.uuid4().int}\n")
+        analysis_output.textualInsights = "fiéis " * 20
+        database.save_analysis(user_id, analysis_input, analysis_output)
+
+    ids = _search_all(database, user_id, "fieis", limit, between_pages=save_another)
+    # As 3 mais recentes por relevância (mais ocorrências primeiro), depois as demais da mais recente
+    assert ids == saved[6:3:-1] + saved[3::-1]
@@ -0,0 +1,83 @@
+# python-backend/tests/test_incremental.py
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_transactions_csv
+from common import ingestion
+from common.clustering import cluster_customers
+from common.incremental import STATE_FORMAT_VERSION, dump_state, load_state
+from common.models import DataTreatment
+from tests.test_database import _analysis, _new_user
+
+TREATMENT = DataTreatment(normalize=True, excludeNulls=True, groupCategories=True)
+
+
+def _split(data: bytes, at: int, overlap: int):
+    """Base e delta de um mesmo CSV; as últimas `overlap` linhas da base se repetem no delta."""
+    lines = data.decode('utf-8').splitlines()
+    header, rows = lines[:1], lines[1:]
+    base = "\n".join(header + rows[:at]) + "\n"
+    delta = "\n".join(header + rows[at - overlap:]) + "\n"
+    return base.encode('utf-8'), delta.encode('utf-8')
+
+
+def _aggregator(data: bytes, aggregator=None) -> ingestion.CustomerAggregator:
+    aggregator = aggregator or ingestion.CustomerAggregator()
+    for chunk in pd.read_csv(io.BytesIO(data), sep=';', chunksize=400):
+        aggregator.update(chunk)
+    return aggregator
+
+
+@pytest.mark.parametrize("overlap", [0, 300])
+def test_delta_counts_each_invoice_once(overlap):
+    data = make_transactions_csv(3000)
+    base, delta = _split(data, 2000, overlap)
+    expected = _aggregator(data).result()['Frequencia']
+
+    base_aggregator = _aggregator(base)
+    base_result = base_aggregator.result()
+    aggregator = _aggregator(delta, ingestion.CustomerAggregator.from_state(*base_aggregator.state()))
+
+    # Notas repetidas no delta não são contadas de novo
+    pd.testing.assert_series_equal(aggregator.result()['Frequencia'], expected)
+    # O estado da base não é alterado pela soma do delta
+    pd.testing.assert_frame_equal(base_aggregator.result(), base_result)
+
+
+def _state(data: bytes) -> bytes:
+    aggregator = _aggregator(data)
+    clustering = cluster_customers(aggregator.result(), 3, TREATMENT)
+    return dump_state(aggregator, clustering)
+
+
+def test_state_round_trip_keeps_counts_and_pairs():
+    data = make_transactions_csv(2000)
+    aggregator, model = load_state(_state(data))
+    with np.load(io.BytesIO(_state(data))) as arrays:
+        assert int(arrays['version'][0]) == STATE_FORMAT_VERSION
+        assert 'invoice_key' not in arrays.files
+    expected = _aggregator(data).result()
+    pd.testing.assert_series_equal(aggregator.result()['Frequencia'], expected['Frequencia'])
+    assert len(model.shares) == 3
+
+
+def test_child_analysis_drops_the_parent_state(database):
+    user_id = _new_user(database)
+    state = _state(make_transactions_csv(500))
+    parent_id = database.save_analysis(user_id, *_analysis("CustomerID\n1\n"), state=state, customers=1)
+    child_state = _state(make_transactions_csv(600))
+    child_id = database.save_analysis(
+        user_id, *_analysis("CustomerID\n2\n"), state=child_state, customers=1, parent_analysis_id=parent_id
+    )
+
+    parent = database.get_analysis_state(parent_id, user_id)
+    assert parent["state"] is None and parent["superseded_by"] == child_id
+    assert database.get_analysis_state(child_id, user_id)["state"] == child_state
+    with database.get_db_connection() as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM analysis_states WHERE state_blob_hash IS NOT NULL AND analysis_id IN (?, ?)",
+            (parent_id, child_id)).fetchone()[0] == 1
@@ -0,0 +1,61 @@
+# python-backend/tests/test_ingestion.py
+
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_transactions_csv
+from common import ingestion
+
+PARSERS = ["legacy", "pandas", "pyarrow"]
+
+
+def _without_blank_customer_ids(data: bytes) -> bytes:
+    lines = data.decode('utf-8').splitlines()
+    return ("\n".join(lines[:1] + [line for line in lines[1:] if line.split(';')[6]]) + "\n").encode('utf-8')
+
+
+def _aggregated(data: bytes, parser: str, streaming: bool, tmp_path, monkeypatch) -> pd.DataFrame:
+    if parser == "pyarrow":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(ingestion, "CSV_PARSER", parser)
+    if streaming:
+        path = tmp_path / "transacoes.csv"
+        path.write_bytes(data)
+        customer_df = ingestion.aggregate_customers_streaming(str(path), chunksize=500)
+    else:
+        customer_df = ingestion.aggregate_customers(ingestion.read_transactions(io.BytesIO(data)))
+    return customer_df
+
+
+@pytest.mark.parametrize("blank_ids", [False, True])
+@pytest.mark.parametrize("parser", PARSERS)
+def test_typed_parsers_match_the_legacy_reader(parser, blank_ids, tmp_path, monkeypatch):
+    data = make_transactions_csv(3000)
+    if not blank_ids:
+        data = _without_blank_customer_ids(data)
+    expected = _aggregated(data, "legacy", False, tmp_path, monkeypatch).to_csv(index=False, sep=';')
+
+    # O CSV agregado (enviado à IA e chave do cache de respostas) é idêntico
+    assert _aggregated(data, parser, False, tmp_path, monkeypatch).to_csv(index=False, sep=';') == expected
+
+
+@pytest.mark.parametrize("blank_ids", [False, True])
+@pytest.mark.parametrize("parser", PARSERS)
+def test_streaming_matches_the_legacy_reader(parser, blank_ids, tmp_path, monkeypatch):
+    data = make_transactions_csv(3000)
+    if not blank_ids:
+        data = _without_blank_customer_ids(data)
+    expected = _aggregated(data, "legacy", False, tmp_path, monkeypatch)
+    streamed = _aggregated(data, parser, True, tmp_path, monkeypatch)
+
+    # As somas por blocos podem diferir na última casa do float; os IDs não
+    assert streamed['CustomerID'].astype(str).tolist() == expected['CustomerID'].astype(str).tolist()
+    pd.testing.assert_frame_equal(streamed, expected, check_exact=False)
+
+
+def test_customer_ids_stay_integral_without_blanks(tmp_path, monkeypatch):
+    data = _without_blank_customer_ids(make_transactions_csv(500))
+    customer_df = _aggregated(data, "pandas", False, tmp_path, monkeypatch)
+    assert customer_df.to_csv(index=False, sep=';').splitlines()[1].split(';')[0] == "17000"
@@ -0,0 +1,39 @@
+import json
+
+from common.json_stream import IncrementalArrayParser
+
+
+def _document(count: int) -> dict:
+    return {
+        "intro": "texto com \"aspas\", [colchetes] e {chaves}",
+        "segments": [
+            {"name": f"Segmento {i}", "tags": ["a", "b"], "score": i / 3, "note": "vírgula, aqui"}
+            for i in range(count)
+        ] + ["escalar", 7, None],
+        "outro": [1, 2, 3],
+    }
+
+
+def test_items_are_emitted_across_arbitrary_chunks():
+    document = _document(5)
+    raw = json.dumps(document, ensure_ascii=False)
+    for size in (1, 3, 17, len(raw)):
+        parser = IncrementalArrayParser("segments")
+        items = []
+        for start in range(0, len(raw), size):
+            items.extend(parser.feed(raw[start:start + size]))
+        assert items == document["segments"]
+        assert parser.items_found == len(document["segments"])
+        assert parser.text == raw
+
+
+def test_buffer_keeps_only_the_item_in_progress():
+    raw = json.dumps(_document(200), ensure_ascii=False)
+    longest_item = max(len(json.dumps(item, ensure_ascii=False)) for item in _document(200)["segments"])
+    parser = IncrementalArrayParser("segments")
+    largest_buffer = 0
+    for start in range(0, len(raw), 5):
+        parser.feed(raw[start:start + 5])
+        largest_buffer = max(largest_buffer, len(parser._buffer))
+    assert largest_buffer < 2 * longest_item
+    assert parser.text == raw
@@ -0,0 +1,22 @@
+# python-backend/tests/test_k_selection.py
+
+import asyncio
+import io
+
+from benchmarks.synthetic import make_transactions_csv
+from common.ingestion import aggregate_customers, read_transactions
+from common.k_selection import KSelectionPool
+from common.models import K_SELECTION_MAX_K, DataTreatment
+
+
+def test_requested_max_k_is_capped():
+    customer_df = aggregate_customers(read_transactions(io.BytesIO(make_transactions_csv(5000))))
+    pool = KSelectionPool(workers=2)
+    try:
+        recommendation = asyncio.run(pool.recommend(
+            customer_df, DataTreatment(normalize=True, excludeNulls=True, groupCategories=True), max_k=5000
+        ))
+    finally:
+        pool.shutdown()
+    assert len(customer_df) > K_SELECTION_MAX_K + 1
+    assert max(e.k for e in recommendation.evaluations) == K_SELECTION_MAX_K
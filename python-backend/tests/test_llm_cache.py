@@ -0,0 +1,42 @@
+# python-backend/tests/test_llm_cache.py
+
+import asyncio
+
+from common.llm_cache import LLMResponseCache
+
+
+def _cache(tmp_path, **kwargs) -> LLMResponseCache:
+    return LLMResponseCache(db_path=str(tmp_path / "llm_cache.db"), memory_entries=1, **kwargs)
+
+
+def _stored_bytes(cache: LLMResponseCache) -> int:
+    with cache._connect() as conn:
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+
+def test_async_round_trip_reads_from_sqlite(tmp_path):
+    cache = _cache(tmp_path)
+
+    async def round_trip():
+        await cache.set_async("a", {"valor": 1})
+        await cache.set_async("b", {"valor": 2})  # tira "a" do LRU em memória
+        return await cache.get_async("a"), await cache.get_async("ausente")
+
+    assert asyncio.run(round_trip()) == ({"valor": 1}, None)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_eviction_runs_only_past_the_size_limit(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, max_bytes=2000)
+    evictions = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, "_evict", lambda conn, now: (evictions.append(now), evict(conn, now)))
+
+    for index in range(100):
+        cache.set(f"chave-{index}", {"texto": "x" * 100})
+        assert _stored_bytes(cache) <= 2000
+
+    # A primeira gravação faz a limpeza periódica; depois, só quando o limite é ultrapassado,
+    # e cada limpeza abre folga para várias gravações
+    assert 1 < len(evictions) <= 100 // 2
+    assert cache.get("chave-99") is not None and cache.get("chave-0") is None
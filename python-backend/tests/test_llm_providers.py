@@ -0,0 +1,52 @@
+# python-backend/tests/test_llm_providers.py
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from common.llm_providers import GeminiProvider, LLMProvider
+
+
+class _MultiPartResponse:
+    """Resposta com várias partes: como no google.generativeai, 'text' não é suportado."""
+
+    usage_metadata = None
+
+    def __init__(self, *texts: str):
+        parts = [SimpleNamespace(text=text) for text in texts]
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=parts))]
+
+    @property
+    def text(self):
+        raise ValueError("The `response.text` quick accessor only works for simple (single-`Part`) text responses.")
+
+
+class _Model:
+    def __init__(self, response):
+        self.response = response
+
+    async def generate_content_async(self, prompt_text, **kwargs):
+        return self.response
+
+
+def test_provider_interface_is_abstract():
+    with pytest.raises(TypeError):
+        LLMProvider()
+
+
+def test_generate_joins_the_parts_when_text_is_unavailable(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "teste")
+    provider = GeminiProvider()
+    provider._model = _Model(_MultiPartResponse('{"segments": ', '[]}'))
+    assert asyncio.run(provider.generate("prompt", "MarketSegmentationInsightsOutput")) == '{"segments": []}'
+
+
+def test_generate_without_candidates_raises(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "teste")
+    provider = GeminiProvider()
+    response = _MultiPartResponse()
+    response.candidates = []
+    provider._model = _Model(response)
+    with pytest.raises(ValueError):
+        asyncio.run(provider.generate("prompt", "MarketSegmentationInsightsOutput"))
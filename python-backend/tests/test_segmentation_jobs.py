@@ -0,0 +1,74 @@
+# python-backend/tests/test_segmentation_jobs.py
+
+import uuid
+
+from common.models import UserCreate
+
+
+def _new_job(database, tmp_path) -> str:
+    user = UserCreate(email=f"{uuid.uuid4().hex}@example.com", password="senha123", name="Teste")
+    user_id = database.create_user(user, hashed_password="x").id
+    input_path = str(tmp_path / f"{uuid.uuid4().hex}.csv")
+    return database.create_segmentation_job(user_id, {}, input_path), input_path
+
+
+def _claim_until(database, job_id, worker_id, stale_seconds, max_attempts):
+    """Reserva jobs até chegar a job_id (a fila é compartilhada entre os testes)."""
+    abandoned = []
+    while True:
+        job, inputs = database.claim_segmentation_job(worker_id, stale_seconds, max_attempts)
+        abandoned.extend(inputs)
+        if job is None or job['id'] == job_id:
+            return job, abandoned
+
+
+def test_finish_reports_a_lost_reservation(database, tmp_path):
+    job_id, _ = _new_job(database, tmp_path)
+    job, _ = _claim_until(database, job_id, "worker-a", stale_seconds=120, max_attempts=3)
+    assert job['id'] == job_id
+
+    # Heartbeat expirado: o job volta para a fila e outro worker o assume
+    job, _ = _claim_until(database, job_id, "worker-b", stale_seconds=-1, max_attempts=3)
+    assert job['id'] == job_id
+
+    assert database.finish_segmentation_job(job_id, "worker-a", error="tarde demais") is False
+    assert database.finish_segmentation_job(job_id, "worker-b", result="{}") is True
+
+
+def test_claim_returns_inputs_of_jobs_over_max_attempts(database, tmp_path):
+    job_id, input_path = _new_job(database, tmp_path)
+    job, _ = _claim_until(database, job_id, "worker-a", stale_seconds=120, max_attempts=1)
+    assert job['id'] == job_id
+
+    job, abandoned = _claim_until(database, job_id, "worker-b", stale_seconds=-1, max_attempts=1)
+    assert job is None
+    assert input_path in abandoned
+
+
+def test_events_stream_ends_with_error_when_the_job_disappears(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import segmentation_service.main as segmentation_main
+    from common.auth import get_current_user
+    from common.models import User
+
+    job = {
+        'id': "job-1", 'status': "running", 'stage': "clustering", 'progress': 0.5,
+        'analysis_id': None, 'error': None, 'result': None, 'created_at': 1.0, 'updated_at': 2.0,
+    }
+    lookups = iter([job, None])
+
+    async def get_segmentation_job(job_id, user_id):
+        return next(lookups)
+
+    monkeypatch.setattr(segmentation_main.async_database, "get_segmentation_job", get_segmentation_job)
+    monkeypatch.setattr(segmentation_main, "JOB_EVENTS_POLL_SECONDS", 0)
+    segmentation_main.app.dependency_overrides[get_current_user] = lambda: User(id=1, email="a@example.com", name="Teste")
+    try:
+        body = TestClient(segmentation_main.app).get("/api/segmentation-jobs/job-1/events").text
+    finally:
+        segmentation_main.app.dependency_overrides.clear()
+
+    events = [block.split("\n")[0] for block in body.strip().split("\n\n")]
+    assert events == ["event: progress", "event: error"]
+    assert "Job não encontrado" in body